@@ -0,0 +1,454 @@
+"""
+Offline benchmark suite: no Vertex AI, no Chroma, no network.
+
+Gemini is replaced by app.llm.stub_client (hash-seeded embeddings, canned
+JSON, injected latency); everything else is the real app code:
+
+  ingest     NG12 PDF -> chunks -> embed -> upsert, then the numpy / BM25 /
+             symptom index exports (one full ingest per run)
+  retrieval  hybrid (numpy dense + BM25) queries under concurrent load
+  assess     POST /assess through the ASGI app, in-process
+  chat       POST /chat through the ASGI app, in-process (multi-turn sessions)
+
+Each scenario reports throughput and p50/p95/p99 latency, plus the mean of
+every stage recorded by app.metrics, and is compared with a stored baseline:
+
+  python -m app.bench                    # run + compare with benchmarks/baseline.json
+  python -m app.bench --save-baseline    # run + store as the new baseline
+
+Exit status 1 when a scenario regressed by more than --tolerance.
+Baselines are machine-specific: save one on the machine that compares.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import metrics
+from app.timing import percentile
+
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+
+CHAT_QUESTIONS = (
+    "When should I refer someone with dysphagia?",
+    "what about if they are over 55?",
+    "Which symptoms need an urgent chest X-ray?",
+    "Is unexplained weight loss enough for a referral?",
+    "What does NG12 say about rectal bleeding?",
+    "and for patients under 50?",
+)
+
+RETRIEVAL_QUERIES = (
+    "dysphagia upper gastrointestinal cancer referral",
+    "haemoptysis aged 40 and over lung cancer chest x-ray",
+    "rectal bleeding change in bowel habit colorectal",
+    "postmenopausal bleeding endometrial cancer",
+    "unexplained weight loss abdominal pain",
+    "breast lump aged 30 and over",
+    "visible haematuria bladder cancer",
+    "persistent hoarseness laryngeal cancer",
+)
+
+# higher is worse / lower is worse
+_LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+_THROUGHPUT_KEY = "throughput_per_s"
+
+
+# ==========================
+# In-process ASGI driver
+# ==========================
+async def asgi_request(app, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+    """One HTTP request straight into the ASGI app (middleware, routing, background tasks)."""
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode("ascii"))],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    sent = False
+    status = 0
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.sleep(3600)  # only reached by handlers waiting for a disconnect
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+# ==========================
+# Load generation / reporting
+# ==========================
+async def drive(op: Callable[[int], Awaitable[bool]], n: int, concurrency: int, warmup: int = 0) -> Dict[str, Any]:
+    """
+    Run op(0..n-1) with `concurrency` workers; op returns False (or raises) on
+    error. `warmup` unmeasured calls (op(-1), op(-2), ...) run first.
+    Latency percentiles cover successful requests only (a fast failure is not a fast answer).
+    """
+    for i in range(1, warmup + 1):
+        try:
+            await op(-i)
+        except Exception:
+            pass
+
+    latencies: List[float] = []
+    errors = 0
+    next_i = 0
+
+    async def _worker():
+        nonlocal next_i, errors
+        while next_i < n:
+            i = next_i
+            next_i += 1
+            t0 = time.perf_counter()
+            try:
+                ok = await op(i)
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+            else:
+                errors += 1
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(max(1, min(concurrency, n)))))
+    return summarize(latencies, errors, time.perf_counter() - t_start, concurrency)
+
+
+def summarize(latencies: List[float], errors: int, elapsed_s: float, concurrency: int = 1) -> Dict[str, Any]:
+    """`latencies` of the successful requests; throughput counts those too."""
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_per_s": round(len(latencies) / elapsed_s, 2) if elapsed_s > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def median_of(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-key median of repeated scenario runs (tail percentiles of one short run are noisy)."""
+    out = dict(runs[0])
+    for key, value in runs[0].items():
+        if isinstance(value, (int, float)) and key not in ("requests", "concurrency"):
+            out[key] = round(statistics.median(r[key] for r in runs), 2)
+    out["errors"] = sum(r["errors"] for r in runs)
+    out["repeats"] = len(runs)
+    return out
+
+
+def _stage_means() -> Dict[str, float]:
+    return {stage: s["mean_ms"] for stage, s in sorted(metrics.snapshot().items())}
+
+
+# ==========================
+# Scenarios
+# ==========================
+def bench_ingest(gem, pdf_path: str, workdir: str, runs: int, workers: int):
+    """Full ingests into an in-memory store; the last one is exported for the other scenarios."""
+    from app.llm.stub_client import StubVectorStore
+    from app.rag import symptom_index
+    from app.rag.bm25 import build_from_store
+    from app.rag.ingest_ng12 import ingest
+    from app.rag.numpy_store import export_index
+
+    latencies: List[float] = []
+    chunks = 0
+    store = None
+    t_start = time.perf_counter()
+    for _ in range(max(1, runs)):
+        store = StubVectorStore(n_chunks=0, dim=gem.dim)
+        t0 = time.perf_counter()
+        stats = ingest(pdf_path, store=store, gem=gem, workers=workers, full=True)
+        export_index(store, os.path.join(workdir, "numpy"))
+        build_from_store(store, os.path.join(workdir, "bm25.json"))
+        symptom_index.build_from_store(store, os.path.join(workdir, "symptoms.json"))
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        chunks += stats["chunks"]
+    elapsed = time.perf_counter() - t_start
+
+    report = summarize(latencies, 0, elapsed)
+    report["chunks_per_s"] = round(chunks / elapsed, 1) if elapsed > 0 else 0.0
+    report["chunks"] = len(store)
+    return report
+
+
+async def bench_retrieval(store, n: int, concurrency: int, dim: int, warmup: int = 0) -> Dict[str, Any]:
+    from app.llm.stub_client import stub_embedding
+
+    queries = [(q, stub_embedding(q, dim)) for q in RETRIEVAL_QUERIES]
+
+    async def _op(i: int) -> bool:
+        text, emb = queries[i % len(queries)]
+        res = await asyncio.to_thread(store.query, emb, settings.top_k, text)
+        return bool(res.get("ids", [[]])[0])
+
+    return await drive(_op, n, concurrency, warmup)
+
+
+async def bench_assess(app, patient_ids: List[str], n: int, concurrency: int, warmup: int = 0) -> Dict[str, Any]:
+    async def _op(i: int) -> bool:
+        status, _ = await asgi_request(app, "POST", "/assess", {"patient_id": patient_ids[i % len(patient_ids)]})
+        return status == 200
+
+    return await drive(_op, n, concurrency, warmup)
+
+
+async def bench_chat(app, n: int, concurrency: int, turns: int, warmup: int = 0) -> Dict[str, Any]:
+    # request i is turn i % turns of session i // turns; sessions interleave across workers
+    async def _op(i: int) -> bool:
+        body = {"session_id": f"bench-{i // turns}", "message": CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]}
+        status, _ = await asgi_request(app, "POST", "/chat", body)
+        return status == 200
+
+    return await drive(_op, n, concurrency, warmup)
+
+
+# ==========================
+# Wiring
+# ==========================
+def build_services(gem, agem, workdir: str, patients_path: str):
+    """Services over the exported bench index; result / answer caches off so every request does the work."""
+    from app.chat_store import MemoryChatStore
+    from app.llm.assessor import NG12Assessor
+    from app.llm.chat_agent import NG12ChatAgent
+    from app.patient_store import PatientStore
+    from app.rag.bm25 import BM25Index, HybridVectorStore
+    from app.rag.numpy_store import NumpyVectorStore
+    from app.rag.symptom_index import SymptomIndex
+    from app.services import Services
+
+    store = HybridVectorStore(
+        NumpyVectorStore(os.path.join(workdir, "numpy")),
+        BM25Index.load(os.path.join(workdir, "bm25.json")),
+        rrf_k=settings.rrf_k,
+        candidates=settings.hybrid_candidates,
+    )
+    with open(os.path.join(workdir, "symptoms.json"), "r", encoding="utf-8") as f:
+        symptoms = SymptomIndex(json.load(f))
+    chat_agent = NG12ChatAgent(gem=gem, agem=agem, vs=store)
+    chat_agent.answer_cache = None
+    return Services(
+        gem=gem,
+        agem=agem,
+        vector_store=store,
+        patient_store=PatientStore(path=patients_path),
+        chat_store=MemoryChatStore(),
+        assessor=NG12Assessor(
+            gem=gem, agem=agem, store=store, use_cache=False,
+            symptom_index=symptoms, use_symptom_index=settings.symptom_fast_path,
+        ),
+        chat_agent=chat_agent,
+    )
+
+
+def _op_latencies(pairs: List[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for pair in pairs:
+        kind, _, ms = pair.partition("=")
+        out[kind.strip()] = float(ms)
+    return out
+
+
+def run(args) -> Dict[str, Any]:
+    from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient
+    from app.patient_backends import iter_patient_rows
+    from app.services import set_services
+
+    gem = StubGeminiClient(
+        latency_ms=args.latency_ms, op_latency_ms=_op_latencies(args.op_latency),
+        jitter_ms=args.jitter_ms, seed=args.seed,
+    )
+    agem = AsyncStubGeminiClient(gem)
+    scenarios = set(args.scenarios)
+    results: Dict[str, Any] = {}
+    workdir = tempfile.mkdtemp(prefix="ng12-bench-")
+    try:
+        results["ingest"] = bench_ingest(gem, args.pdf, workdir, args.ingest_runs, args.ingest_workers)
+        if "ingest" not in scenarios:
+            del results["ingest"]  # still built: the other scenarios query its index
+
+        services = build_services(gem, agem, workdir, args.patients)
+        services.warmup()
+        set_services(services)
+        from app.main import app
+
+        patient_ids = [row["patient_id"] for row in iter_patient_rows(args.patients)]
+        loads = {
+            "retrieval": lambda: bench_retrieval(
+                services.get("vector_store"), args.requests, args.concurrency, gem.dim, args.warmup
+            ),
+            "assess": lambda: bench_assess(app, patient_ids, args.requests, args.concurrency, args.warmup),
+            "chat": lambda: bench_chat(app, args.requests, args.concurrency, args.chat_turns, args.warmup),
+        }
+
+
+        async def _all():
+            # one event loop for every scenario and repeat, like one server worker
+            for name, load in loads.items():
+                if name not in scenarios:
+                    continue
+                metrics.reset()
+                results[name] = median_of([await load() for _ in range(max(1, args.repeat))])
+                results[name]["stages_ms"] = _stage_means()  # all repeats, warmup calls included
+
+        asyncio.run(_all())
+        services.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency_ms,
+            "op_latency_ms": gem.op_latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "chat_turns": args.chat_turns,
+            "ingest_runs": args.ingest_runs,
+            "symptom_fast_path": settings.symptom_fast_path,
+        },
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": results,
+    }
+
+
+# ==========================
+# Baseline comparison
+# ==========================
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Tuple[List[str], List[str]]:
+    """
+    (regressions, notes). A scenario regresses when a latency percentile grows,
+    or throughput drops, by more than `tolerance` (fraction) against the baseline.
+    """
+    regressions: List[str] = []
+    notes: List[str] = []
+    if current.get("config") != baseline.get("config"):
+        notes.append("config differs from the baseline; numbers are not directly comparable")
+    for name, cur in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            notes.append(f"{name}: no baseline")
+            continue
+        for key in _LATENCY_KEYS:
+            if base.get(key) and cur[key] > base[key] * (1.0 + tolerance):
+                regressions.append(f"{name} {key}: {cur[key]} > {base[key]} (+{cur[key] / base[key] - 1.0:.0%})")
+        if base.get(_THROUGHPUT_KEY) and cur[_THROUGHPUT_KEY] < base[_THROUGHPUT_KEY] * (1.0 - tolerance):
+            regressions.append(
+                f"{name} {_THROUGHPUT_KEY}: {cur[_THROUGHPUT_KEY]} < {base[_THROUGHPUT_KEY]} "
+                f"({cur[_THROUGHPUT_KEY] / base[_THROUGHPUT_KEY] - 1.0:.0%})"
+            )
+        if cur["errors"]:
+            regressions.append(f"{name}: {cur['errors']} failed requests")
+    return regressions, notes
+
+
+def _table(report: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> str:
+    cols = ("requests", "errors", _THROUGHPUT_KEY) + _LATENCY_KEYS
+    lines = [f"{'scenario':<10} " + " ".join(f"{c:>16}" for c in cols)]
+    for name, cur in report["scenarios"].items():
+        base = (baseline or {}).get("scenarios", {}).get(name, {})
+        cells = []
+        for c in cols:
+            cell = f"{cur[c]}"
+            if c in base and c not in ("requests", "errors"):
+                cell += f" ({base[c]})"
+            cells.append(f"{cell:>16}")
+        lines.append(f"{name:<10} " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks (stub Gemini) with baseline comparison.")
+    parser.add_argument("--scenarios", nargs="+", choices=["ingest", "retrieval", "assess", "chat"],
+                        default=["ingest", "retrieval", "assess", "chat"])
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per load scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests before each load scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per load scenario; the median is reported")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="injected latency of every stub Gemini call")
+    parser.add_argument("--op-latency", action="append", default=[], metavar="KIND=MS",
+                        help="per call kind override (embed, tool_call, generate_json, generate); repeatable")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform 0..jitter latency per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chat-turns", type=int, default=3, help="messages per chat session")
+    parser.add_argument("--ingest-runs", type=int, default=1)
+    parser.add_argument("--ingest-workers", type=int, default=1, help="processes for PDF text extraction")
+    parser.add_argument("--pdf", default=os.path.join("Data", "ng12.pdf"))
+    parser.add_argument("--patients", default=os.path.join("Data", "patients.json"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression as a fraction")
+    parser.add_argument("--output", default="", help="also write the full JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(_table(report, baseline))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return
+    if baseline is None:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    regressions, notes = compare(report, baseline, args.tolerance)
+    for note in notes:
+        print(f"note: {note}")
+    for r in regressions:
+        print(f"REGRESSION: {r}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,399 @@
 # app/chat_store.py
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, List, Literal, Optional
+import os
+import sqlite3
+import threading
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Deque, List, Literal, Optional
+
+from app.config import settings
 
 Role = Literal["user", "assistant", "system"]
 
-@dataclass
+BACKENDS = ("memory", "sqlite")
+
+
 class ChatMessage:
-    role: Role
-    content: str
-    ts: float
+    __slots__ = ("role", "content", "ts")
+
+    def __init__(self, role: Role, content: str, ts: float):
+        self.role = role
+        self.content = content
+        self.ts = ts
+
+    def __repr__(self) -> str:
+        return f"ChatMessage(role={self.role!r}, content={self.content[:40]!r}, ts={self.ts})"
+
+
+class SessionMemory:
+    """
+    What the chat prompt needs from a session: the running summary of older
+    turns, how many messages it covers (`covered` of `total` ever added) and
+    the newest messages not folded into it yet.
+    """
+    __slots__ = ("summary", "topics", "covered", "total", "messages")
+
+    def __init__(self, summary: str, topics: str, covered: int, total: int, messages: List[ChatMessage]):
+        self.summary = summary
+        self.topics = topics
+        self.covered = covered
+        self.total = total
+        self.messages = messages
+
+    @property
+    def unsummarized(self) -> int:
+        return self.total - self.covered
+
 
-class ChatStore:
+class ChatStore(ABC):
     """
-    Simple in-memory conversation store.
-    Good enough for take-home. (Optionally replace with Redis/SQLite later.)
+    Conversation store interface.
+    Sessions keep at most `max_messages` (oldest dropped first) plus a running
+    summary of older turns (see app/llm/conversation_memory.py). A session
+    with no new message for `ttl_s` seconds is evicted (<= 0 = never), and
+    beyond `max_sessions` the least recently active sessions go first.
     """
-    def __init__(self):
-        self._sessions: Dict[str, List[ChatMessage]] = {}
 
+    @abstractmethod
     def add(self, session_id: str, role: Role, content: str) -> None:
-        self._sessions.setdefault(session_id, []).append(ChatMessage(role=role, content=content, ts=time.time()))
+        ...
 
+    @abstractmethod
     def get(self, session_id: str) -> List[ChatMessage]:
-        return self._sessions.get(session_id, [])
+        ...
 
+    @abstractmethod
+    def tail(self, session_id: str, k: int) -> List[ChatMessage]:
+        """Last k messages, oldest first."""
+
+    @abstractmethod
     def clear(self, session_id: str) -> None:
-        self._sessions.pop(session_id, None)
+        ...
+
+    @abstractmethod
+    def memory(self, session_id: str, k: int) -> SessionMemory:
+        """Summary + up to the last k messages it does not cover yet."""
+
+    @abstractmethod
+    def set_summary(self, session_id: str, summary: str, topics: str, covered: int, expected_covered: int) -> bool:
+        """
+        Store a new running summary covering the first `covered` messages.
+        Only applied while the stored summary still covers `expected_covered`
+        (another worker may have folded the same turns first). Returns whether it was stored.
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
 
     def to_openai_style(self, session_id: str, max_messages: int = 12) -> List[dict]:
         """
         Return last N messages in a generic {role, content} format.
         """
-        msgs = self.get(session_id)[-max_messages:]
-        return [{"role": m.role, "content": m.content} for m in msgs]
+        return [{"role": m.role, "content": m.content} for m in self.tail(session_id, max_messages)]
+
+    def close(self) -> None:
+        pass
+
+
+# ==========================
+# In-process (bounded, per worker)
+# ==========================
+class _Session:
+    __slots__ = ("messages", "last_used", "total", "summary", "topics", "covered")
+
+    def __init__(self, max_messages: int):
+        self.messages: Deque[ChatMessage] = deque(maxlen=max_messages)
+        self.last_used = 0.0
+        self.total = 0
+        self.summary = ""
+        self.topics = ""
+        self.covered = 0
+
+
+class MemoryChatStore(ChatStore):
+    """
+    Sessions in an OrderedDict kept in activity order, so idle / LRU eviction
+    only ever looks at the front. Each session is a bounded deque.
+    """
+
+    def __init__(self, max_messages: int = 50, max_sessions: int = 10000, ttl_s: float = 0.0):
+        self.max_messages = max(1, int(max_messages))
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl_s = float(ttl_s)
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self, now: float) -> None:
+        # caller holds the lock
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or (self.ttl_s > 0 and now - s.last_used > self.ttl_s):
+                del self._sessions[sid]
+                self.evictions += 1
+            else:
+                break
+
+    def _live(self, session_id: str) -> Optional[_Session]:
+        # caller holds the lock
+        s = self._sessions.get(session_id)
+        if s is not None and self.ttl_s > 0 and time.time() - s.last_used > self.ttl_s:
+            del self._sessions[session_id]
+            self.evictions += 1
+            return None
+        return s
+
+    def add(self, session_id: str, role: Role, content: str) -> None:
+        now = time.time()
+        with self._lock:
+            s = self._live(session_id)
+            if s is None:
+                s = self._sessions[session_id] = _Session(self.max_messages)
+            s.messages.append(ChatMessage(role, content, now))
+            s.total += 1
+            s.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def get(self, session_id: str) -> List[ChatMessage]:
+        with self._lock:
+            s = self._live(session_id)
+            return list(s.messages) if s is not None else []
+
+    def tail(self, session_id: str, k: int) -> List[ChatMessage]:
+        with self._lock:
+            s = self._live(session_id)
+            if s is None or k <= 0:
+                return []
+            out = list(islice(reversed(s.messages), k))
+        out.reverse()
+        return out
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def memory(self, session_id: str, k: int) -> SessionMemory:
+        with self._lock:
+            s = self._live(session_id)
+            if s is None:
+                return SessionMemory("", "", 0, 0, [])
+            n = min(k, s.total - s.covered)
+            recent = list(islice(reversed(s.messages), n)) if n > 0 else []
+            mem = SessionMemory(s.summary, s.topics, s.covered, s.total, recent)
+        recent.reverse()
+        return mem
+
+    def set_summary(self, session_id: str, summary: str, topics: str, covered: int, expected_covered: int) -> bool:
+        with self._lock:
+            s = self._live(session_id)
+            if s is None or s.covered != expected_covered:
+                return False
+            s.summary, s.topics, s.covered = summary, topics, covered
+            return True
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# ==========================
+# SQLite (WAL, shared by all workers on the host)
+# ==========================
+_SESSION_COLUMNS = (
+    ("total", "INTEGER NOT NULL DEFAULT 0"),
+    ("summary", "TEXT NOT NULL DEFAULT ''"),
+    ("topics", "TEXT NOT NULL DEFAULT ''"),
+    ("covered", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+
+class SqliteChatStore(ChatStore):
+    """
+    `chat_messages` rows indexed on (session_id, id), so a tail read is one
+    index range scan of k rows. `chat_sessions` tracks message count and last
+    activity for trimming and eviction; idle sessions are swept at most every
+    `sweep_interval_s`. One connection per thread.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_messages: int = 50,
+        max_sessions: int = 10000,
+        ttl_s: float = 0.0,
+        sweep_interval_s: float = 60.0,
+    ):
+        self.path = path
+        self.max_messages = max(1, int(max_messages))
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl_s = float(ttl_s)
+        self.sweep_interval_s = sweep_interval_s
+        self._next_sweep = 0.0
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                " session_id TEXT PRIMARY KEY, last_used REAL NOT NULL, n INTEGER NOT NULL DEFAULT 0)"
+            )
+            # running summary columns (added after the table first shipped)
+            have = {row[1] for row in conn.execute("PRAGMA table_info(chat_sessions)")}
+            for col, decl in _SESSION_COLUMNS:
+                if col not in have:
+                    conn.execute(f"ALTER TABLE chat_sessions ADD COLUMN {col} {decl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS chat_sessions_last_used ON chat_sessions (last_used)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,"
+                " role TEXT NOT NULL, content TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chat_messages_session ON chat_messages (session_id, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _live_clause(self):
+        if self.ttl_s > 0:
+            return " AND s.last_used >= ?", (time.time() - self.ttl_s,)
+        return "", ()
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        cutoff = now - self.ttl_s if self.ttl_s > 0 else None
+        overflow = conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0] - self.max_sessions
+        if overflow > 0:
+            row = conn.execute(
+                "SELECT last_used FROM chat_sessions ORDER BY last_used LIMIT 1 OFFSET ?", (overflow - 1,)
+            ).fetchone()
+            if row is not None:
+                cutoff = max(cutoff or row[0], row[0])
+        if cutoff is None:
+            return
+        conn.execute(
+            "DELETE FROM chat_messages WHERE session_id IN"
+            " (SELECT session_id FROM chat_sessions WHERE last_used <= ?)", (cutoff,)
+        )
+        conn.execute("DELETE FROM chat_sessions WHERE last_used <= ?", (cutoff,))
+
+    def add(self, session_id: str, role: Role, content: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            if self.ttl_s > 0:
+                # idle past the TTL but not swept yet: start over
+                stale = conn.execute(
+                    "SELECT 1 FROM chat_sessions WHERE session_id = ? AND last_used < ?",
+                    (session_id, now - self.ttl_s),
+                ).fetchone()
+                if stale:
+                    conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+                    conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "INSERT INTO chat_messages (session_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, now),
+            )
+            conn.execute(
+                "INSERT INTO chat_sessions (session_id, last_used, n, total) VALUES (?, ?, 1, 1)"
+                " ON CONFLICT(session_id) DO UPDATE SET last_used = excluded.last_used, n = n + 1, total = total + 1",
+                (session_id, now),
+            )
+            n = conn.execute("SELECT n FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+            if n > self.max_messages:
+                conn.execute(
+                    "DELETE FROM chat_messages WHERE session_id = ? AND id < ("
+                    " SELECT MIN(id) FROM (SELECT id FROM chat_messages WHERE session_id = ?"
+                    " ORDER BY id DESC LIMIT ?))",
+                    (session_id, session_id, self.max_messages),
+                )
+                conn.execute(
+                    "UPDATE chat_sessions SET n = ? WHERE session_id = ?", (self.max_messages, session_id)
+                )
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.sweep_interval_s
+                self._sweep(conn, now)
+
+    def _select(self, session_id: str, limit: Optional[int]) -> List[ChatMessage]:
+        clause, args = self._live_clause()
+        sql = (
+            "SELECT m.role, m.content, m.ts FROM chat_messages m"
+            " JOIN chat_sessions s ON s.session_id = m.session_id"
+            f" WHERE m.session_id = ?{clause} ORDER BY m.id DESC"
+        )
+        params = (session_id, *args)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        rows = self._conn().execute(sql, params).fetchall()
+        rows.reverse()
+        return [ChatMessage(r, c, ts) for r, c, ts in rows]
+
+    def get(self, session_id: str) -> List[ChatMessage]:
+        return self._select(session_id, None)
+
+    def tail(self, session_id: str, k: int) -> List[ChatMessage]:
+        return self._select(session_id, k) if k > 0 else []
+
+    def clear(self, session_id: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+
+    def memory(self, session_id: str, k: int) -> SessionMemory:
+        clause, args = self._live_clause()
+        conn = self._conn()
+        row = conn.execute(
+            f"SELECT summary, topics, covered, total FROM chat_sessions s WHERE session_id = ?{clause}",
+            (session_id, *args),
+        ).fetchone()
+        if row is None:
+            return SessionMemory("", "", 0, 0, [])
+        summary, topics, covered, total = row
+        n = min(k, total - covered)
+        recent = self._select(session_id, n) if n > 0 else []
+        return SessionMemory(summary, topics, covered, total, recent)
+
+    def set_summary(self, session_id: str, summary: str, topics: str, covered: int, expected_covered: int) -> bool:
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "UPDATE chat_sessions SET summary = ?, topics = ?, covered = ? WHERE session_id = ? AND covered = ?",
+                (summary, topics, covered, session_id, expected_covered),
+            )
+        return cur.rowcount > 0
+
+    def __len__(self) -> int:
+        clause, args = self._live_clause()
+        sql = "SELECT COUNT(*) FROM chat_sessions s WHERE 1 = 1" + clause
+        return self._conn().execute(sql, args).fetchone()[0]
+
+    def close(self) -> None:
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+
+def open_chat_store(kind: str = settings.chat_store, path: str = settings.chat_store_path) -> ChatStore:
+    if kind == "memory":
+        return MemoryChatStore(settings.chat_max_messages, settings.chat_max_sessions, settings.chat_session_ttl_s)
+    if kind == "sqlite":
+        return SqliteChatStore(
+            path, settings.chat_max_messages, settings.chat_max_sessions, settings.chat_session_ttl_s
+        )
+    raise ValueError(f"Unknown chat store: {kind!r} (expected one of {BACKENDS})")
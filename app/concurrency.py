@@ -0,0 +1,29 @@
+import asyncio
+import functools
+import weakref
+from typing import Any, Callable, TypeVar
+
+from app.config import settings
+
+T = TypeVar("T")
+
+_blocking_sems: "weakref.WeakKeyDictionary[Any, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _semaphore() -> asyncio.Semaphore:
+    # one per event loop (asyncio primitives are loop-bound; tests / benchmarks run several)
+    loop = asyncio.get_running_loop()
+    sem = _blocking_sems.get(loop)
+    if sem is None:
+        sem = _blocking_sems[loop] = asyncio.Semaphore(max(1, settings.blocking_concurrency))
+    return sem
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking call (Chroma, SQLite, file IO) in a worker thread.
+    At most BLOCKING_CONCURRENCY such calls run at once per event loop; the rest
+    wait on the semaphore instead of queueing up in the default threadpool.
+    """
+    async with _semaphore():
+        return await asyncio.to_thread(functools.partial(fn, *args, **kwargs))
@@ -17,8 +17,132 @@ class Settings(BaseModel):
     patients_path: str = os.getenv("PATIENTS_PATH", "data/patients.json")
     pdf_path: str = os.getenv("NG12_PDF_PATH", "data/ng12.pdf")
     chroma_dir: str = os.getenv("CHROMA_DIR", "data/chroma")
+    numpy_index_dir: str = os.getenv("NUMPY_INDEX_DIR", os.path.join(os.getenv("CHROMA_DIR", "data/chroma"), "numpy"))
+
+    # Retrieval backend: chroma | numpy (exported, memory-mapped exact search)
+    vector_backend: str = os.getenv("VECTOR_BACKEND", "chroma")
+
+    # dense | hybrid (dense + BM25 fused with reciprocal rank fusion; needs bm25 index from ingest)
+    retrieval_mode: str = os.getenv("RETRIEVAL_MODE", "hybrid")
+    bm25_path: str = os.getenv("BM25_PATH", os.path.join(os.getenv("CHROMA_DIR", "data/chroma"), "bm25.json"))
+    hybrid_candidates: int = int(os.getenv("HYBRID_CANDIDATES", "20"))
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+
+    # Patient store backend: auto (by file extension) | json | jsonl | sqlite
+    patient_backend: str = os.getenv("PATIENT_BACKEND", "auto")
+
+    # Patient store: how often (seconds) to check the patients file for changes.
+    # 0 = check on every lookup, negative = never reload.
+    patients_reload_interval_s: float = float(os.getenv("PATIENTS_RELOAD_INTERVAL_S", "2.0"))
+
+    # Build clients / indexes in a background thread at startup (else on first request);
+    # GET /ready reports when they are up
+    warmup_on_start: bool = os.getenv("WARMUP_ON_START", "True").lower() == "true"
+
+    # Prometheus-style /metrics (stage histograms, token / byte / cache / error counts).
+    # DEBUG_TIMINGS adds the per-request stage breakdown to /assess debug.timings_ms
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    debug_timings: bool = os.getenv("DEBUG_TIMINGS", "True").lower() == "true"
+
+    # Max blocking calls (Chroma, SQLite, file IO) run off the event loop at once
+    blocking_concurrency: int = int(os.getenv("BLOCKING_CONCURRENCY", "16"))
+
+    # /assess get_patient tool call: serial | parallel | off
+    assess_tool_call: str = os.getenv("ASSESS_TOOL_CALL", "parallel")
+
+    # /assess/batch: max concurrent generate calls per batch request
+    assess_batch_concurrency: int = int(os.getenv("ASSESS_BATCH_CONCURRENCY", "8"))
+
+    # Chat sessions: memory (per worker) | sqlite (WAL file shared by all workers)
+    chat_store: str = os.getenv("CHAT_STORE", "memory")
+    chat_store_path: str = os.getenv("CHAT_STORE_PATH", "data/chat_sessions.db")
+    chat_max_messages: int = int(os.getenv("CHAT_MAX_MESSAGES", "50"))
+    chat_max_sessions: int = int(os.getenv("CHAT_MAX_SESSIONS", "10000"))
+    # sessions idle this long are dropped (<= 0 = keep until evicted by CHAT_MAX_SESSIONS)
+    chat_session_ttl_s: float = float(os.getenv("CHAT_SESSION_TTL_S", "86400"))
+
+    # Rolling summary: once CHAT_SUMMARY_TRIGGER messages are not covered by the
+    # session summary, all but the newest CHAT_RECENT_MESSAGES are folded into it
+    # (summary capped at CHAT_SUMMARY_TOKENS). CHAT_SUMMARY_TRIGGER=0 disables.
+    chat_summary_trigger: int = int(os.getenv("CHAT_SUMMARY_TRIGGER", "12"))
+    chat_recent_messages: int = int(os.getenv("CHAT_RECENT_MESSAGES", "6"))
+    chat_summary_tokens: int = int(os.getenv("CHAT_SUMMARY_TOKENS", "200"))
+
+    # Semantic answer cache for first-turn chat questions (CHAT_CACHE_SIZE=0 disables):
+    # a question whose query embedding has cosine >= CHAT_CACHE_THRESHOLD with a
+    # cached one gets that answer without retrieval or generation
+    chat_cache_size: int = int(os.getenv("CHAT_CACHE_SIZE", "512"))
+    chat_cache_threshold: float = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.95"))
+    chat_cache_ttl_s: float = float(os.getenv("CHAT_CACHE_TTL_S", "86400"))
 
     # RAG defaults
     top_k: int = int(os.getenv("TOP_K", "5"))
 
+    # Prompt packing (estimated tokens): evidence is deduped then trimmed to the
+    # most query-relevant sentences; chat history keeps the newest turns. 0 = no limit.
+    evidence_token_budget: int = int(os.getenv("EVIDENCE_TOKEN_BUDGET", "1200"))
+    history_token_budget: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+
+    # Ingestion chunker: structured (NG12 recommendation / table boundaries) | fixed (1200-char windows)
+    chunker: str = os.getenv("CHUNKER", "structured")
+
+    # Symptom -> recommendation index built at ingest: known symptoms skip embed + vector query
+    symptom_fast_path: bool = os.getenv("SYMPTOM_FAST_PATH", "True").lower() == "true"
+    symptom_index_path: str = os.getenv(
+        "SYMPTOM_INDEX_PATH", os.path.join(os.getenv("CHROMA_DIR", "data/chroma"), "symptom_index.json")
+    )
+
+    # Query-embedding cache (EMBED_CACHE_PATH="" keeps it in memory only)
+    embed_cache_size: int = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+    embed_cache_ttl_s: float = float(os.getenv("EMBED_CACHE_TTL_S", "604800"))
+    embed_cache_path: str = os.getenv("EMBED_CACHE_PATH", "")
+
+    # Assessment result cache (ASSESS_CACHE_SIZE=0 disables, ASSESS_CACHE_PATH="" = memory only)
+    assess_cache_size: int = int(os.getenv("ASSESS_CACHE_SIZE", "1024"))
+    assess_cache_ttl_s: float = float(os.getenv("ASSESS_CACHE_TTL_S", "86400"))
+    assess_cache_path: str = os.getenv("ASSESS_CACHE_PATH", "")
+
+    # Embedding micro-batching: concurrent query embeds are collected for up to
+    # EMBED_BATCH_WINDOW_MS and sent as one call. EMBED_BATCH_MAX=1 disables batching.
+    embed_batch_window_ms: float = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+    embed_batch_max: int = int(os.getenv("EMBED_BATCH_MAX", "32"))
+
+    # Gemini call policy (app/llm/call_policy.py), per call: attempts time out after
+    # GEMINI_TIMEOUT_S (embeddings: GEMINI_EMBED_TIMEOUT_S), retryable errors are retried
+    # with jittered exponential backoff until GEMINI_DEADLINE_S, a duplicate request is
+    # sent when an attempt is slower than GEMINI_HEDGE_AFTER_MS (0 = no hedging), at most
+    # GEMINI_MAX_CONCURRENCY calls are in flight, and GEMINI_BREAKER_FAILURES consecutive
+    # failures open the circuit (calls fail fast) for GEMINI_BREAKER_RESET_S
+    gemini_timeout_s: float = float(os.getenv("GEMINI_TIMEOUT_S", "30"))
+    gemini_embed_timeout_s: float = float(os.getenv("GEMINI_EMBED_TIMEOUT_S", "10"))
+    gemini_deadline_s: float = float(os.getenv("GEMINI_DEADLINE_S", "60"))
+    gemini_max_attempts: int = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+    gemini_backoff_ms: float = float(os.getenv("GEMINI_BACKOFF_MS", "200"))
+    gemini_backoff_max_ms: float = float(os.getenv("GEMINI_BACKOFF_MAX_MS", "5000"))
+    gemini_hedge_after_ms: float = float(os.getenv("GEMINI_HEDGE_AFTER_MS", "0"))
+    gemini_max_concurrency: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+    gemini_breaker_failures: int = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+    gemini_breaker_reset_s: float = float(os.getenv("GEMINI_BREAKER_RESET_S", "30"))
+
+    # JSON outputs (assessments, chat answers; app/llm/structured.py): with STRUCTURED_OUTPUT
+    # the response schema and system prompt go in the request config instead of the prompt
+    # text; output that still fails to parse or validate gets at most JSON_REPAIR_ATTEMPTS
+    # repair calls before it is reported as an error
+    structured_output: bool = os.getenv("STRUCTURED_OUTPUT", "True").lower() == "true"
+    json_repair_attempts: int = int(os.getenv("JSON_REPAIR_ATTEMPTS", "1"))
+
+    # Gemini context caching (app/llm/context_cache.py, needs STRUCTURED_OUTPUT): system prompt +
+    # evidence prefixes of at least CONTEXT_CACHE_MIN_TOKENS, seen CONTEXT_CACHE_MIN_USES times,
+    # are registered with caches.create for CONTEXT_CACHE_TTL_S and reused by later calls; a handle
+    # with less than CONTEXT_CACHE_REFRESH_S left is extended on use. At most
+    # CONTEXT_CACHE_MAX_ENTRIES caches per process; calls fall back to the full prompt on any failure.
+    # create / update calls get CONTEXT_CACHE_TIMEOUT_S, one attempt and their own circuit breaker
+    context_cache: bool = os.getenv("CONTEXT_CACHE", "True").lower() == "true"
+    context_cache_ttl_s: float = float(os.getenv("CONTEXT_CACHE_TTL_S", "3600"))
+    context_cache_refresh_s: float = float(os.getenv("CONTEXT_CACHE_REFRESH_S", "1800"))
+    context_cache_min_tokens: int = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+    context_cache_min_uses: int = int(os.getenv("CONTEXT_CACHE_MIN_USES", "2"))
+    context_cache_max_entries: int = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "64"))
+    context_cache_timeout_s: float = float(os.getenv("CONTEXT_CACHE_TIMEOUT_S", "5"))
+
 settings = Settings()
@@ -0,0 +1,26 @@
+import argparse
+import os
+
+from app.config import settings
+from app.patient_backends import iter_json_patients, write_jsonl, write_sqlite
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a patients.json array into a JSONL or SQLite patient backend."
+    )
+    parser.add_argument("--src", default=settings.patients_path, help="Source JSON array file")
+    parser.add_argument("--to", choices=["jsonl", "sqlite"], required=True)
+    parser.add_argument("--dest", default="", help="Output path (default: next to --src)")
+    args = parser.parse_args()
+
+    dest = args.dest or os.path.splitext(args.src)[0] + (".jsonl" if args.to == "jsonl" else ".db")
+    rows = iter_json_patients(args.src)
+    n = write_jsonl(rows, dest) if args.to == "jsonl" else write_sqlite(rows, dest)
+
+    print(f"✅ Wrote {n} patients to {dest}")
+    print(f"   Use it with: PATIENTS_PATH={dest} PATIENT_BACKEND={args.to}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import cache_collector, metrics
+
+
+class _Entry:
+    __slots__ = ("question", "top_k", "created", "answer", "citations")
+
+    def __init__(self, question: str, top_k: int, created: float, answer: str, citations: List[dict]):
+        self.question = question
+        self.top_k = top_k
+        self.created = created
+        self.answer = answer
+        self.citations = citations
+
+
+class SemanticAnswerCache:
+    """
+    Chat answers for first-turn questions, looked up by cosine similarity of
+    the query embedding the agent already computed for retrieval
+    ("when to refer for dysphagia" ~ "when should I refer someone with dysphagia").
+
+    Embeddings live in one preallocated float32 matrix (`max_entries` rows,
+    L2-normalized; free rows are zero), so a lookup is a single mat-vec.
+    Least recently used entries are evicted when full; entries expire after
+    `ttl_s` (<= 0 disables expiry). A lookup with a new `version` (index
+    re-ingested or generation model changed) drops everything.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.95, ttl_s: float = 0.0):
+        self.max_entries = max(1, int(max_entries))
+        self.threshold = float(threshold)
+        self.ttl_s = float(ttl_s)
+        self._lock = threading.Lock()
+        self._vecs: Optional[np.ndarray] = None
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # row -> entry, LRU order
+        self._free: List[int] = []
+        self._version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _reset(self, dim: int) -> None:
+        # caller holds the lock
+        self._vecs = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._entries.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _check(self, version: str, dim: int) -> None:
+        # caller holds the lock
+        if self._vecs is None or self._vecs.shape[1] != dim:
+            self._reset(dim)
+        elif version != self._version and self._version is not None:
+            self._reset(dim)
+            self.invalidations += 1
+        self._version = version
+
+    def _drop(self, row: int) -> None:
+        # caller holds the lock
+        del self._entries[row]
+        self._vecs[row] = 0.0
+        self._free.append(row)
+
+    @staticmethod
+    def _unit(vec: List[float]) -> np.ndarray:
+        q = np.asarray(vec, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(q))
+        return q / norm if norm else q
+
+    def get(self, q_emb: List[float], top_k: int, version: str) -> Optional[Tuple[str, List[dict], Dict[str, Any]]]:
+        """(answer, citations, {"similarity", "question"}) of the closest cached question, or None."""
+        q = self._unit(q_emb)
+        now = time.time()
+        with self._lock:
+            self._check(version, q.shape[0])
+            if self._entries:
+                scores = self._vecs @ q
+                close = np.flatnonzero(scores >= self.threshold)
+                for row in close[np.argsort(-scores[close])]:
+                    score = float(scores[row])
+                    e = self._entries.get(int(row))
+                    if e is None or e.top_k != top_k:
+                        continue
+                    if self.ttl_s > 0 and now - e.created > self.ttl_s:
+                        self._drop(int(row))
+                        continue
+                    self._entries.move_to_end(int(row))
+                    self.hits += 1
+                    info = {"similarity": round(score, 4), "question": e.question}
+                    return e.answer, [dict(c) for c in e.citations], info
+            self.misses += 1
+            return None
+
+    def put(
+        self, q_emb: List[float], question: str, top_k: int, version: str, answer: str, citations: List[dict]
+    ) -> None:
+        q = self._unit(q_emb)
+        with self._lock:
+            self._check(version, q.shape[0])
+            if not self._free:
+                row, _ = self._entries.popitem(last=False)
+                self._vecs[row] = 0.0
+                self._free.append(row)
+                self.evictions += 1
+            row = self._free.pop()
+            self._vecs[row] = q
+            self._entries[row] = _Entry(question, top_k, time.time(), answer, [dict(c) for c in citations])
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._vecs is not None:
+                self._reset(self._vecs.shape[1])
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_shared_cache: Optional[SemanticAnswerCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Process-wide chat answer cache, or None when CHAT_CACHE_SIZE=0."""
+    global _shared_cache
+    if settings.chat_cache_size <= 0:
+        return None
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = SemanticAnswerCache(
+                    max_entries=settings.chat_cache_size,
+                    threshold=settings.chat_cache_threshold,
+                    ttl_s=settings.chat_cache_ttl_s,
+                )
+                metrics.add_collector("chat_answer_cache", cache_collector("chat_answer", _shared_cache))
+    return _shared_cache
@@ -1,11 +1,20 @@
 # app/llm/assessor.py
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterable, Tuple
 
 from app.models import Patient, AssessmentResponse, Citation
+from app.concurrency import run_blocking
 from app.config import settings
-from app.rag.vector_store import VectorStore
-from app.llm.gemini_client import GeminiClient
+from app.rag.vector_store import make_vector_store
+from app.llm.gemini_client import GeminiClient, AsyncGeminiClient
 from app.llm.prompts import ASSESSOR_SYSTEM_PROMPT
+from app.llm.structured import ASSESSMENT_SCHEMA
+from app.llm.context_cache import with_context
+from app.llm.evidence_packer import pack_evidence, prompt_token_stats
+from app.llm.result_cache import AssessmentCache, assessment_key, get_assessment_cache
+from app.rag.symptom_index import SymptomIndex, get_symptom_index
+from app.timing import StageTimer, maybe_stage
+from app.metrics import instrumented
 
 
 def build_query(patient: Patient) -> str:
@@ -16,6 +25,11 @@ def build_query(patient: Patient) -> str:
     )
 
 
+def build_lexical_query(patient: Patient) -> str:
+    # BM25 side of hybrid retrieval: symptom keywords only, no boilerplate
+    return " ".join(patient.symptoms)
+
+
 def format_evidence(rows: List[Dict[str, Any]]) -> str:
     lines = []
     for r in rows:
@@ -102,79 +116,347 @@ def merge_dedupe_citations(
     return merged
 
 
-class NG12Assessor:
-    def __init__(self):
-        self.gem = GeminiClient()
-        self.store = VectorStore()
-
-    def retrieve(self, query: str, top_k: int) -> List[Dict[str, Any]]:
-        q_emb = self.gem.embed_texts([query])[0]
-        res = self.store.query(q_emb, top_k=top_k)
-
-        docs = res.get("documents", [[]])[0]
-        metas = res.get("metadatas", [[]])[0]
-        ids = res.get("ids", [[]])[0]
-
-        rows: List[Dict[str, Any]] = []
-        for i in range(min(len(docs), len(metas))):
-            m = metas[i] or {}
-            rows.append(
-                {
-                    "text": docs[i],
-                    "page": m.get("page", -1),
-                    "chunk_id": m.get("chunk_id", ids[i] if i < len(ids) else ""),
-                    "source": m.get("source", "NG12 PDF"),
-                }
-            )
-        return rows
+def rows_from_query_result(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+    docs = res.get("documents", [[]])[0]
+    metas = res.get("metadatas", [[]])[0]
+    ids = res.get("ids", [[]])[0]
 
-    def assess(self, patient: Patient, top_k: int = None) -> AssessmentResponse:
-        k = int(top_k or settings.top_k)
-        query = build_query(patient)
+    rows: List[Dict[str, Any]] = []
+    for i in range(min(len(docs), len(metas))):
+        m = metas[i] or {}
+        rows.append(
+            {
+                "text": docs[i],
+                "page": m.get("page", -1),
+                "chunk_id": m.get("chunk_id", ids[i] if i < len(ids) else ""),
+                "source": m.get("source", "NG12 PDF"),
+            }
+        )
+    return rows
 
-        # RAG retrieval (k chunks)
-        evidence_rows = self.retrieve(query, k)
 
-        user_prompt = f"""
-PATIENT:
-{patient.model_dump_json(indent=2)}
+def merge_evidence(index_rows: List[Dict[str, Any]], rag_rows: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Interleave symptom-index and RAG rows (index first), dedupe by chunk_id, cap at k."""
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for i in range(max(len(index_rows), len(rag_rows))):
+        for rows in (index_rows, rag_rows):
+            if i < len(rows) and rows[i].get("chunk_id") not in seen:
+                seen.add(rows[i].get("chunk_id"))
+                out.append(rows[i])
+    return out[:k]
+
 
+def build_evidence_context(evidence_rows: List[Dict[str, Any]]) -> str:
+    # first in the prompt: with the system prompt it is the prefix the context cache serves
+    return f"""
 NG12 EVIDENCE SNIPPETS:
 {format_evidence(evidence_rows)}
 """.strip()
 
-        # LLM output (dict)
-        raw = self.gem.generate_json(ASSESSOR_SYSTEM_PROMPT, user_prompt)
-        if not isinstance(raw, dict):
-            raw = {"raw": str(raw)}
 
-        # --- IMPORTANT: ALWAYS ensure citations are present and are up to k ---
-        rag_cits = to_rag_citations(evidence_rows, limit=k)
-        model_cits = normalize_model_citations(raw.get("citations"))
-        merged_cits = merge_dedupe_citations(model_cits, rag_cits, limit=k)
-        raw["citations"] = merged_cits
+def build_patient_prompt(patient: Patient) -> str:
+    return f"""
+PATIENT:
+{patient.model_dump_json(indent=2)}
+""".strip()
 
-        # Build pydantic output
-        citations: List[Citation] = []
-        for c in raw.get("citations", []):
-            try:
-                citations.append(Citation(**c))
-            except Exception:
-                # skip malformed citation
-                pass
-
-        return AssessmentResponse(
-            patient_id=raw.get("patient_id", patient.patient_id),
-            decision=raw.get("decision", "INSUFFICIENT_EVIDENCE"),
-            confidence=float(raw.get("confidence", 0.5) or 0.5),
-            summary=raw.get("summary", ""),
-            reasoning=raw.get("reasoning", ""),
-            citations=citations,
-            debug={
-                "rag_query": query,
-                "model": settings.gen_model,
-                "embed_model": settings.embed_model,
-                "top_k": k,
-                "retrieved_chunks": len(evidence_rows),
-            },
+
+def build_user_prompt(patient: Patient, evidence_rows: List[Dict[str, Any]]) -> str:
+    return with_context(build_evidence_context(evidence_rows), build_patient_prompt(patient))
+
+
+def build_packed_prompt(patient: Patient, evidence_rows: List[Dict[str, Any]]) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    (evidence context, patient prompt) with evidence packed to EVIDENCE_TOKEN_BUDGET,
+    plus token stats for debug.
+    """
+    packed, evidence_stats = pack_evidence(
+        evidence_rows, build_lexical_query(patient), settings.evidence_token_budget
+    )
+    context, user = build_evidence_context(packed), build_patient_prompt(patient)
+    return context, user, prompt_token_stats(ASSESSOR_SYSTEM_PROMPT + with_context(context, user), evidence_stats)
+
+
+def build_response(
+    patient: Patient,
+    query: str,
+    k: int,
+    evidence_rows: List[Dict[str, Any]],
+    raw: Any,
+    timer: Optional[StageTimer] = None,
+    evidence_source: str = "rag",
+    prompt_stats: Optional[Dict[str, Any]] = None,
+) -> AssessmentResponse:
+    if not isinstance(raw, dict):
+        raw = {"raw": str(raw)}
+
+    # --- IMPORTANT: ALWAYS ensure citations are present and are up to k ---
+    rag_cits = to_rag_citations(evidence_rows, limit=k)
+    model_cits = normalize_model_citations(raw.get("citations"))
+    merged_cits = merge_dedupe_citations(model_cits, rag_cits, limit=k)
+    raw["citations"] = merged_cits
+
+    # Build pydantic output
+    citations: List[Citation] = []
+    for c in raw.get("citations", []):
+        try:
+            citations.append(Citation(**c))
+        except Exception:
+            # skip malformed citation
+            pass
+
+    debug = {
+        "rag_query": query,
+        "model": settings.gen_model,
+        "embed_model": settings.embed_model,
+        "top_k": k,
+        "retrieved_chunks": len(evidence_rows),
+        "evidence_source": evidence_source,
+    }
+    if prompt_stats is not None:
+        debug["tokens"] = prompt_stats
+    if "error" in raw:
+        debug["output_error"] = raw["error"]
+    if timer is not None:
+        debug["timings_ms"] = timer.as_dict()
+
+    return AssessmentResponse(
+        patient_id=patient.patient_id,
+        decision=raw.get("decision", "INSUFFICIENT_EVIDENCE"),
+        confidence=float(raw.get("confidence", 0.5) or 0.5),
+        summary=raw.get("summary", ""),
+        reasoning=raw.get("reasoning", ""),
+        citations=citations,
+        debug=debug,
+    )
+
+
+class NG12Assessor:
+    def __init__(
+        self,
+        gem=None,
+        agem=None,
+        store=None,
+        cache: Optional[AssessmentCache] = None,
+        use_cache: bool = True,
+        symptom_index: Optional[SymptomIndex] = None,
+        use_symptom_index: bool = True,
+    ):
+        """
+        Dependencies default to the real Vertex AI / Chroma clients; pass
+        `gem`/`agem`/`store` to swap in other backends (e.g. app.llm.stub_client).
+        Without `symptom_index` the shared one built at ingest is used (if any).
+        """
+        self.gem = gem or GeminiClient()
+        self.agem = agem or AsyncGeminiClient(client=self.gem.client)
+        self.store = store or make_vector_store()
+        if not use_cache:
+            self.cache = None
+        else:
+            self.cache = cache if cache is not None else get_assessment_cache()
+        self.symptom_index = symptom_index
+        self.use_symptom_index = use_symptom_index
+
+    def _cache_lookup(self, patient: Patient, k: int):
+        """Returns (key, version, cached response or None); key is None when caching is off."""
+        if self.cache is None:
+            return None, None, None
+        version = self.store.index_version()
+        key = assessment_key(patient, k, settings.gen_model, version)
+        return key, version, self.cache.get(key, version)
+
+    def _cache_result(self, key, version, res: AssessmentResponse, raw: Any) -> AssessmentResponse:
+        if key is None:
+            return res
+        if res.debug is not None:
+            res.debug["cache"] = "miss"
+        # don't pin a failed generation (unparseable model output)
+        if isinstance(raw, dict) and "error" not in raw:
+            self.cache.put(key, version, res)
+        return res
+
+    async def _cache_lookup_async(self, patient: Patient, k: int):
+        # index_version() reads the version file (or counts the collection) and a
+        # persistent cache queries SQLite: both stay off the event loop
+        if self.cache is None:
+            return None, None, None
+        return await run_blocking(self._cache_lookup, patient, k)
+
+    async def _cache_result_async(self, key, version, res: AssessmentResponse, raw: Any) -> AssessmentResponse:
+        if key is None:
+            return res
+        return await run_blocking(self._cache_result, key, version, res, raw)
+
+    @staticmethod
+    def _cache_hit(res: AssessmentResponse, timer: Optional[StageTimer]) -> AssessmentResponse:
+        debug = dict(res.debug or {})
+        debug["cache"] = "hit"
+        if timer is not None:
+            debug["timings_ms"] = timer.as_dict()
+        res.debug = debug
+        return res
+
+    def _index_evidence(
+        self, patient: Patient, k: int, timer: Optional[StageTimer] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[Patient]]:
+        """
+        Symptom-index rows, plus the patient to run RAG for: None when every
+        symptom is known, the patient restricted to its unknown symptoms when
+        only some are, the whole patient when the index knows none (or is off).
+        """
+        index = None
+        if self.use_symptom_index:
+            index = self.symptom_index if self.symptom_index is not None else get_symptom_index()
+        if index is None or not patient.symptoms:
+            return [], patient
+        with maybe_stage(timer, "symptom_lookup"):
+            rows, unknown = index.lookup(patient.symptoms, patient.age, k)
+        if not rows:
+            return [], patient
+        if not unknown:
+            return rows, None
+        return rows, patient.model_copy(update={"symptoms": unknown})
+
+    @staticmethod
+    def _evidence_source(index_rows: List[Dict[str, Any]], rag_patient: Optional[Patient]) -> str:
+        if not index_rows:
+            return "rag"
+        return "symptom_index" if rag_patient is None else "symptom_index+rag"
+
+    def retrieve(
+        self, query: str, top_k: int, timer: Optional[StageTimer] = None, lexical_query: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        with maybe_stage(timer, "embed"):
+            q_emb = self.gem.embed_query(query)
+        with maybe_stage(timer, "vector_query"):
+            res = self.store.query(q_emb, top_k=top_k, query_text=lexical_query or query)
+        return rows_from_query_result(res)
+
+    async def retrieve_async(
+        self, query: str, top_k: int, timer: Optional[StageTimer] = None, lexical_query: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        with maybe_stage(timer, "embed"):
+            q_emb = await self.agem.embed_query(query)
+        with maybe_stage(timer, "vector_query"):
+            res = await self.store.query_async(q_emb, top_k=top_k, query_text=lexical_query or query)
+        return rows_from_query_result(res)
+
+    @instrumented("assessor.assess")
+    def assess(self, patient: Patient, top_k: int = None, timer: Optional[StageTimer] = None) -> AssessmentResponse:
+        k = int(top_k or settings.top_k)
+
+        with maybe_stage(timer, "cache_lookup"):
+            key, version, cached = self._cache_lookup(patient, k)
+        if cached is not None:
+            return self._cache_hit(cached, timer)
+
+        # known symptoms: evidence straight from the symptom index, no embed / vector query
+        index_rows, rag_patient = self._index_evidence(patient, k, timer)
+
+        # RAG retrieval (k chunks) for whatever the index does not cover
+        query, evidence_rows = "", index_rows
+        if rag_patient is not None:
+            query = build_query(rag_patient)
+            rag_rows = self.retrieve(query, k, timer, lexical_query=build_lexical_query(rag_patient))
+            evidence_rows = merge_evidence(index_rows, rag_rows, k)
+
+        # LLM output (dict); citations still come from the unpacked rows
+        context, user_prompt, prompt_stats = build_packed_prompt(patient, evidence_rows)
+        with maybe_stage(timer, "generate"):
+            raw = self.gem.generate_json(ASSESSOR_SYSTEM_PROMPT, user_prompt, ASSESSMENT_SCHEMA, context=context)
+
+        res = build_response(
+            patient, query, k, evidence_rows, raw, timer, self._evidence_source(index_rows, rag_patient), prompt_stats
+        )
+        return self._cache_result(key, version, res, raw)
+
+    @instrumented("assessor.assess")
+    async def assess_async(
+        self, patient: Patient, top_k: int = None, timer: Optional[StageTimer] = None
+    ) -> AssessmentResponse:
+        k = int(top_k or settings.top_k)
+
+        with maybe_stage(timer, "cache_lookup"):
+            key, version, cached = await self._cache_lookup_async(patient, k)
+        if cached is not None:
+            return self._cache_hit(cached, timer)
+
+        index_rows, rag_patient = self._index_evidence(patient, k, timer)
+
+        query, evidence_rows = "", index_rows
+        if rag_patient is not None:
+            query = build_query(rag_patient)
+            rag_rows = await self.retrieve_async(query, k, timer, lexical_query=build_lexical_query(rag_patient))
+            evidence_rows = merge_evidence(index_rows, rag_rows, k)
+
+        context, user_prompt, prompt_stats = build_packed_prompt(patient, evidence_rows)
+        with maybe_stage(timer, "generate"):
+            raw = await self.agem.generate_json(ASSESSOR_SYSTEM_PROMPT, user_prompt, ASSESSMENT_SCHEMA, context=context)
+
+        res = build_response(
+            patient, query, k, evidence_rows, raw, timer, self._evidence_source(index_rows, rag_patient), prompt_stats
         )
+        return await self._cache_result_async(key, version, res, raw)
+
+    async def assess_many(
+        self,
+        patients: Iterable[Patient],
+        top_k: int = None,
+        concurrency: int = None,
+    ) -> AsyncIterator[Tuple[str, Optional[AssessmentResponse], Optional[str]]]:
+        """
+        Assess a cohort. Yields (patient_id, response, error) as each patient completes.
+
+        Patients whose symptoms are all in the symptom index skip retrieval;
+        the rest with the same `build_query` string share one embed + retrieval.
+        At most `concurrency` generate calls run at once. A failure only affects
+        its own patient (response=None, error=message).
+        """
+        k = int(top_k or settings.top_k)
+        llm_sem = asyncio.Semaphore(max(1, int(concurrency or settings.assess_batch_concurrency)))
+        retrievals: Dict[str, asyncio.Task] = {}
+
+        async def _one(patient: Patient) -> AssessmentResponse:
+            key, version, cached = await self._cache_lookup_async(patient, k)
+            if cached is not None:
+                return self._cache_hit(cached, None)
+
+            index_rows, rag_patient = self._index_evidence(patient, k)
+            query, evidence_rows = "", index_rows
+            if rag_patient is not None:
+                query = build_query(rag_patient)
+                task = retrievals.get(query)
+                if task is None:
+                    task = retrievals[query] = asyncio.ensure_future(
+                        self.retrieve_async(query, k, lexical_query=build_lexical_query(rag_patient))
+                    )
+                # shield: a cancelled patient must not cancel retrieval shared with others
+                evidence_rows = merge_evidence(index_rows, await asyncio.shield(task), k)
+
+            context, user_prompt, prompt_stats = build_packed_prompt(patient, evidence_rows)
+            async with llm_sem:
+                raw = await self.agem.generate_json(
+                    ASSESSOR_SYSTEM_PROMPT, user_prompt, ASSESSMENT_SCHEMA, context=context
+                )
+
+            res = build_response(
+                patient, query, k, evidence_rows, raw,
+                evidence_source=self._evidence_source(index_rows, rag_patient), prompt_stats=prompt_stats,
+            )
+            return await self._cache_result_async(key, version, res, raw)
+
+        async def _guarded(patient: Patient):
+            try:
+                return patient.patient_id, await _one(patient), None
+            except Exception as e:
+                return patient.patient_id, None, f"{type(e).__name__}: {e}"
+
+        tasks = [asyncio.ensure_future(_guarded(p)) for p in patients]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks + list(retrievals.values()):
+                if not t.done():
+                    t.cancel()
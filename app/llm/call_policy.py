@@ -0,0 +1,546 @@
+"""
+Resilience policy for Gemini calls (sync and async):
+
+  deadline      every attempt times out after `timeout_s`; retries stop at `deadline_s`
+  retries       retryable errors (timeouts, connection errors, HTTP 408/429/5xx)
+                back off exponentially with full jitter, up to `max_attempts`
+  hedging       an attempt still running after `hedge_after_s` gets one duplicate
+                request when a concurrency slot is free; the first success wins
+  concurrency   at most `max_concurrency` calls in flight per policy
+  breaker       `breaker_failures` consecutive failures open the circuit: calls fail
+                fast with CircuitOpenError for `breaker_reset_s`, then one probe
+                call decides between closing it again and reopening it
+
+One policy per backend (`get_call_policy("gemini.generate")`), shared by the
+sync and async clients. `python -m app.llm.call_policy demo` runs it against
+the stub client with injected faults.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from app.config import settings
+from app.metrics import metrics
+
+T = TypeVar("T")
+
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend failed repeatedly; calls are rejected until the breaker resets."""
+
+    def __init__(self, policy: str, retry_after_s: float):
+        super().__init__(f"{policy}: circuit open, retry in {retry_after_s:.1f}s")
+        self.policy = policy
+        self.retry_after_s = retry_after_s
+
+
+class DeadlineExceeded(TimeoutError):
+    """No attempt succeeded within the call deadline."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    # google.genai.errors.APIError (and the stub's faults) carry the HTTP status as `code`
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in _RETRYABLE_CODES
+    # TimeoutError covers asyncio / concurrent.futures timeouts; requests errors are OSErrors
+    return isinstance(exc, (TimeoutError, ConnectionError, OSError))
+
+
+# ==========================
+# Circuit breaker
+# ==========================
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = 5, reset_s: float = 30.0):
+        self.name = name
+        self.threshold = max(0, int(failures))  # 0 disables the breaker
+        self.reset_s = max(0.0, reset_s)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_s:
+                return HALF_OPEN
+            return self._state
+
+    def before(self) -> None:
+        """Raises CircuitOpenError unless a call may go out now."""
+        if not self.threshold:
+            return
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if self._state == OPEN and waited >= self.reset_s:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True  # exactly one probe call at a time
+                return
+            raise CircuitOpenError(self.name, max(0.0, self.reset_s - waited))
+
+    def success(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def failure(self) -> None:
+        if not self.threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self) -> None:
+        """The call ended without a verdict (deadline, cancellation): let another probe through."""
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self) -> Iterator[Callable[[], None]]:
+        """
+        Breaker bookkeeping for calls the policy cannot wrap (streams):
+        `before()` on entry, then success on a clean exit, failure on a retryable
+        error, and the probe slot released in every case. The yielded callable
+        reports success early (first chunk received); later errors then no
+        longer count against the backend.
+        """
+        self.before()
+        decided = False
+
+        def succeeded() -> None:
+            nonlocal decided
+            if not decided:
+                decided = True
+                self.success()
+
+        try:
+            yield succeeded
+        except Exception as e:
+            if not decided:
+                decided = True
+                if is_retryable(e):
+                    self.failure()
+                else:
+                    self.success()  # the backend answered; the request itself was bad
+            raise
+        else:
+            succeeded()
+        finally:
+            self.release_probe()
+
+
+# ==========================
+# Policy
+# ==========================
+class CallPolicy:
+    def __init__(
+        self,
+        name: str,
+        timeout_s: float = 30.0,
+        deadline_s: float = 60.0,
+        max_attempts: int = 3,
+        backoff_s: float = 0.2,
+        backoff_max_s: float = 5.0,
+        hedge_after_s: float = 0.0,
+        max_concurrency: int = 32,
+        breaker_failures: int = 5,
+        breaker_reset_s: float = 30.0,
+        seed: Optional[int] = None,
+    ):
+        self.name = name
+        self.timeout_s = max(0.0, timeout_s)  # 0 = no per-attempt timeout
+        self.deadline_s = max(self.timeout_s, deadline_s)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_s = max(0.0, backoff_s)
+        self.backoff_max_s = max(self.backoff_s, backoff_max_s)
+        self.hedge_after_s = max(0.0, hedge_after_s)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset_s)
+        self._rng = random.Random(seed)
+
+        self._sem = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_sems: "weakref.WeakKeyDictionary[Any, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._inflight = 0
+        self._count_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, name: str, timeout_s: Optional[float] = None) -> "CallPolicy":
+        return cls(
+            name,
+            timeout_s=settings.gemini_timeout_s if timeout_s is None else timeout_s,
+            deadline_s=settings.gemini_deadline_s,
+            max_attempts=settings.gemini_max_attempts,
+            backoff_s=settings.gemini_backoff_ms / 1000.0,
+            backoff_max_s=settings.gemini_backoff_max_ms / 1000.0,
+            hedge_after_s=settings.gemini_hedge_after_ms / 1000.0,
+            max_concurrency=settings.gemini_max_concurrency,
+            breaker_failures=settings.gemini_breaker_failures,
+            breaker_reset_s=settings.gemini_breaker_reset_s,
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter": uniform(0, min(cap, base * 2^attempt))
+        return self._rng.uniform(0.0, min(self.backoff_max_s, self.backoff_s * (2 ** attempt)))
+
+    def _count(self, delta: int) -> None:
+        with self._count_lock:
+            self._inflight += delta
+
+    def _outcome(self, exc: Optional[BaseException]) -> bool:
+        """Records an attempt; True when the error is worth retrying."""
+        if exc is None:
+            self.breaker.success()
+            metrics.inc("ng12_call_attempts_total", policy=self.name, outcome="ok")
+            return False
+        retryable = is_retryable(exc)
+        # client errors (bad request, auth) still mean the backend answered
+        if retryable:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        outcome = "timeout" if isinstance(exc, TimeoutError) else "error"
+        metrics.inc("ng12_call_attempts_total", policy=self.name, outcome=outcome)
+        return retryable
+
+    def _retry_delay(self, attempt: int, deadline: float) -> Optional[float]:
+        """Sleep before the next attempt, or None when out of attempts / time."""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        metrics.inc("ng12_call_retries_total", policy=self.name)
+        return delay
+
+    def _attempt_timeout(self, deadline: float) -> Optional[float]:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name}: deadline of {self.deadline_s}s exceeded")
+        return min(self.timeout_s, remaining) if self.timeout_s else remaining
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.breaker.state, "inflight": self._inflight, "opened": self.breaker.opened}
+
+    # ==========================
+    # Sync
+    # ==========================
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # room for every slot + its hedge; stuck threads are freed by the transport timeout
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency * 2, thread_name_prefix=f"call-{self.name}"
+                    )
+        return self._pool
+
+    def _submit(self, fn: Callable[..., T], args, kwargs) -> Future:
+        # the caller acquired a slot; it is released when the call really ends, not when we stop waiting
+        self._count(1)
+        fut = self._executor().submit(fn, *args, **kwargs)
+
+        def _done(_):
+            self._count(-1)
+            self._sem.release()
+
+        fut.add_done_callback(_done)
+        return fut
+
+    def _attempt(self, fn: Callable[..., T], args, kwargs, timeout: float) -> T:
+        if not self._sem.acquire(timeout=timeout):
+            raise DeadlineExceeded(f"{self.name}: no free call slot within {timeout:.2f}s")
+        t_end = time.monotonic() + timeout
+        futures = [self._submit(fn, args, kwargs)]
+        if self.hedge_after_s and self.hedge_after_s < timeout:
+            done, _ = wait(futures, timeout=self.hedge_after_s)
+            if not done and self._sem.acquire(blocking=False):
+                futures.append(self._submit(fn, args, kwargs))
+                metrics.inc("ng12_call_hedges_total", policy=self.name)
+
+        error: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, t_end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for fut in done:
+                if fut.exception() is None:
+                    return fut.result()
+                error = fut.exception()
+        raise error or TimeoutError(f"{self.name}: attempt timed out after {timeout:.2f}s")
+
+    def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        self.breaker.before()
+        try:
+            return self._call(fn, args, kwargs)
+        finally:
+            self.breaker.release_probe()
+
+    def _call(self, fn: Callable[..., T], args, kwargs) -> T:
+        deadline = time.monotonic() + self.deadline_s
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(fn, args, kwargs, self._attempt_timeout(deadline))
+            except DeadlineExceeded:
+                metrics.inc("ng12_call_rejected_total", policy=self.name, reason="deadline")
+                raise
+            except Exception as e:
+                delay = self._retry_delay(attempt, deadline) if self._outcome(e) else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                self.breaker.before()
+                continue
+            self._outcome(None)
+            return result
+
+    # ==========================
+    # Async
+    # ==========================
+    def _async_sem(self) -> asyncio.Semaphore:
+        # one per event loop (asyncio primitives are loop-bound)
+        loop = asyncio.get_running_loop()
+        sem = self._async_sems.get(loop)
+        if sem is None:
+            sem = self._async_sems[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    def _spawn(self, sem: asyncio.Semaphore, fn: Callable[..., Awaitable[T]], args, kwargs) -> asyncio.Task:
+        # slot already acquired by the caller; freed when the task ends, however it ends
+        self._count(1)
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+
+        def _done(_):
+            self._count(-1)
+            sem.release()
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _attempt_async(self, fn: Callable[..., Awaitable[T]], args, kwargs, timeout: float) -> T:
+        sem = self._async_sem()
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{self.name}: no free call slot within {timeout:.2f}s") from None
+        t_end = time.monotonic() + timeout
+        tasks: List[asyncio.Task] = [self._spawn(sem, fn, args, kwargs)]
+        try:
+            if self.hedge_after_s and self.hedge_after_s < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after_s)
+                if not done and not sem.locked():
+                    await sem.acquire()
+                    tasks.append(self._spawn(sem, fn, args, kwargs))
+                    metrics.inc("ng12_call_hedges_total", policy=self.name)
+
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, t_end - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error or TimeoutError(f"{self.name}: attempt timed out after {timeout:.2f}s")
+        finally:
+            # losers / timed-out attempts are cancelled, which also frees their slots
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def acall(self, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        self.breaker.before()
+        try:
+            return await self._acall(fn, args, kwargs)
+        finally:
+            self.breaker.release_probe()
+
+    async def _acall(self, fn: Callable[..., Awaitable[T]], args, kwargs) -> T:
+        deadline = time.monotonic() + self.deadline_s
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt_async(fn, args, kwargs, self._attempt_timeout(deadline))
+            except DeadlineExceeded:
+                metrics.inc("ng12_call_rejected_total", policy=self.name, reason="deadline")
+                raise
+            except Exception as e:
+                delay = self._retry_delay(attempt, deadline) if self._outcome(e) else None
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                self.breaker.before()
+                continue
+            self._outcome(None)
+            return result
+
+
+_policies: Dict[str, CallPolicy] = {}
+_policies_lock = threading.Lock()
+
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _collect() -> List[tuple]:
+    rows = []
+    for name, policy in list(_policies.items()):
+        st = policy.stats()
+        labels = {"policy": name}
+        rows.append(("ng12_circuit_state", "gauge", labels, float(_STATE_VALUE[st["state"]])))
+        rows.append(("ng12_call_inflight", "gauge", labels, float(st["inflight"])))
+        rows.append(("ng12_circuit_opened_total", "counter", labels, float(st["opened"])))
+    return rows
+
+
+metrics.add_collector("call_policies", _collect)
+metrics.describe("ng12_call_attempts_total", "Gemini call attempts by outcome (ok / error / timeout).")
+metrics.describe("ng12_call_retries_total", "Gemini call retries after a retryable error.")
+metrics.describe("ng12_call_hedges_total", "Duplicate (hedged) Gemini requests sent.")
+metrics.describe("ng12_call_rejected_total", "Gemini calls rejected by the call deadline.")
+
+
+def get_call_policy(name: str) -> CallPolicy:
+    """
+    Process-wide policy per backend: "gemini.embed" (GEMINI_EMBED_TIMEOUT_S),
+    "gemini.generate" (GEMINI_TIMEOUT_S) or "gemini.caches" (context cache
+    create / update: CONTEXT_CACHE_TIMEOUT_S, one attempt, no hedging, since a
+    duplicate create is a second billed cache), shared by every Gemini client.
+    """
+    policy = _policies.get(name)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(name)
+            if policy is None:
+                if name.endswith(".caches"):
+                    policy = CallPolicy(
+                        name,
+                        timeout_s=settings.context_cache_timeout_s,
+                        deadline_s=settings.context_cache_timeout_s,
+                        max_attempts=1,
+                        max_concurrency=settings.gemini_max_concurrency,
+                        breaker_failures=settings.gemini_breaker_failures,
+                        breaker_reset_s=settings.gemini_breaker_reset_s,
+                    )
+                else:
+                    timeout = settings.gemini_embed_timeout_s if name.endswith(".embed") else None
+                    policy = CallPolicy.from_settings(name, timeout_s=timeout)
+                _policies[name] = policy
+    return policy
+
+
+# ==========================
+# Fault-injection demo
+# ==========================
+def _demo(args) -> Dict[str, Any]:
+    from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient
+    from app.timing import percentile
+
+    def _run(policy: Optional[CallPolicy]) -> Dict[str, Any]:
+        gem = StubGeminiClient(
+            latency_ms=args.latency_ms, error_rate=args.error_rate,
+            slow_rate=args.slow_rate, slow_ms=args.slow_ms, seed=args.seed,
+        )
+        agem = AsyncStubGeminiClient(gem)
+
+        async def _one() -> Optional[float]:
+            t0 = time.perf_counter()
+            try:
+                if policy is None:
+                    await agem.generate("demo")
+                else:
+                    await policy.acall(agem.generate, "demo")
+            except Exception:
+                return None
+            return (time.perf_counter() - t0) * 1000.0
+
+        async def _all():
+            sem = asyncio.Semaphore(args.concurrency)
+
+            async def _bounded():
+                async with sem:
+                    return await _one()
+
+            return await asyncio.gather(*(_bounded() for _ in range(args.calls)))
+
+        t0 = time.perf_counter()
+        results = asyncio.run(_all())
+        ok = [r for r in results if r is not None]
+        return {
+            "ok": len(ok),
+            "failed": len(results) - len(ok),
+            "elapsed_s": round(time.perf_counter() - t0, 3),
+            "p50_ms": round(percentile(ok, 50), 2),
+            "p99_ms": round(percentile(ok, 99), 2),
+            "backend_calls": gem.calls["generate"],
+        }
+
+    policy = CallPolicy(
+        "demo",
+        timeout_s=args.timeout_ms / 1000.0,
+        deadline_s=args.deadline_ms / 1000.0,
+        max_attempts=args.attempts,
+        backoff_s=0.01,
+        backoff_max_s=0.1,
+        hedge_after_s=args.hedge_after_ms / 1000.0,
+        max_concurrency=args.concurrency * 2,
+        breaker_failures=0,  # a demo with a fixed fault rate would only measure the breaker
+        seed=args.seed,
+    )
+    return {"no_policy": _run(None), "policy": _run(policy)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini call policy utilities.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    demo = sub.add_parser("demo", help="stub calls with injected faults, without vs with the policy")
+    demo.add_argument("--calls", type=int, default=500)
+    demo.add_argument("--concurrency", type=int, default=16)
+    demo.add_argument("--latency-ms", type=float, default=20.0)
+    demo.add_argument("--error-rate", type=float, default=0.1, help="fraction of calls failing with a 503")
+    demo.add_argument("--slow-rate", type=float, default=0.05, help="fraction of calls stalling for --slow-ms")
+    demo.add_argument("--slow-ms", type=float, default=1000.0)
+    demo.add_argument("--timeout-ms", type=float, default=300.0)
+    demo.add_argument("--deadline-ms", type=float, default=2000.0)
+    demo.add_argument("--attempts", type=int, default=3)
+    demo.add_argument("--hedge-after-ms", type=float, default=60.0)
+    demo.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(_demo(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
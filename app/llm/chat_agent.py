@@ -1,9 +1,17 @@
 from __future__ import annotations
-from typing import List, Tuple
-import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+import re
 
-from app.rag.vector_store import VectorStore
-from app.llm.gemini_client import GeminiClient
+from app.concurrency import run_blocking
+from app.config import settings
+from app.rag.vector_store import make_vector_store
+from app.llm.gemini_client import GeminiClient, AsyncGeminiClient
+from app.llm.evidence_packer import estimate_tokens, pack_evidence, pack_history, prompt_token_stats
+from app.llm.conversation_memory import standalone_query, summary_block
+from app.llm.answer_cache import SemanticAnswerCache, get_answer_cache
+from app.llm.structured import CHAT_ANSWER_SCHEMA, parse_json_output
+from app.llm.context_cache import with_context
+from app.metrics import instrumented, metrics
 
 
 CHAT_SYSTEM_PROMPT = """You are a clinical guideline assistant for NICE NG12.
@@ -13,14 +21,6 @@ RULES:
 - If excerpts do not contain enough evidence, say evidence is insufficient.
 - NEVER invent thresholds or referral criteria.
 - When making clinical pathway statements, ALWAYS cite excerpt sources.
-
-Output format (STRICT JSON ONLY):
-{
-  "answer": "...",
-  "citations": [
-    {"page": 123, "chunk_id": "ng12_0123_04", "excerpt": "..."}
-  ]
-}
 """
 
 
@@ -48,121 +48,360 @@ def _extract_hits(query_result: dict) -> List[dict]:
     return hits
 
 
+NO_EVIDENCE_ANSWER = (
+    "I couldn’t find support in the NG12 guideline excerpts for this question. "
+    "Please refine the symptom or cancer type."
+)
+
+
+def _no_evidence(hits: List[dict]) -> bool:
+    return not hits or all((h["text"] or "").strip() == "" for h in hits)
+
+
+def _build_prompt(message: str, history: List[dict], hits: List[dict], summary: str = "") -> Tuple[str, str]:
+    """(evidence context, conversation + question); the context goes first so it can be a cached prefix."""
+
+    # 3️⃣ Build Evidence Block
+    evidence = "\n\n".join(
+        [f"[{h['chunk_id']} | p.{h['page']}] {h['text']}" for h in hits]
+    )
+
+    # 4️⃣ Include Short Conversation Context
+    convo = "\n".join([
+        f"{m['role'].upper()}: {m['content']}"
+        for m in history[-8:]
+    ])
+
+    # 5️⃣ Construct Prompt (CHAT_SYSTEM_PROMPT and the output schema go in the request config)
+    context = f"""NG12 excerpts:
+{evidence}"""
+    return context, f"""{summary_block(summary)}Conversation so far:
+{convo}
+
+User question:
+{message}
+"""
+
+
+def _packed_prompt(
+    message: str, history: List[dict], hits: List[dict], query: str, summary: str = ""
+) -> Tuple[str, str, Dict[str, Any]]:
+    # Evidence and history trimmed to their token budgets; hits stay whole for citations
+    packed_hits, evidence_stats = pack_evidence(hits, query, settings.evidence_token_budget)
+    turns, history_tokens = pack_history(history, settings.history_token_budget)
+    context, prompt = _build_prompt(message, turns, packed_hits, summary)
+    stats = prompt_token_stats(
+        CHAT_SYSTEM_PROMPT + with_context(context, prompt), evidence_stats,
+        history_tokens=history_tokens, history_turns=len(turns), summary_tokens=estimate_tokens(summary),
+    )
+    return context, prompt, stats
+
+
+def _debug(stats: Dict[str, Any], message: str, query: str) -> Dict[str, Any]:
+    debug: Dict[str, Any] = {"tokens": stats}
+    if query != message:
+        debug["retrieval_query"] = query
+    return debug
+
+
+def _parse_answer(raw: Union[str, Dict[str, Any]], hits: List[dict]) -> Tuple[str, List[dict], bool]:
+    """
+    `raw` is the model output text, or the dict `generate_json` returned.
+    Returns (answer, citations, cacheable); only a valid JSON answer with its
+    own citations is cacheable, never an error, an empty answer or fallback citations.
+    """
+
+    obj = parse_json_output(raw) if isinstance(raw, str) else raw
+    failed = not isinstance(obj, dict) or "error" in obj
+    if isinstance(obj, dict) and "error" in obj and "answer" not in obj:
+        obj = parse_json_output(obj.get("raw", "")) or obj.get("raw", "")
+
+    if isinstance(obj, dict):
+        answer = str(obj.get("answer", "")).strip()
+        citations = obj.get("citations", []) or []
+    else:
+        # Fallback if model returns plain text
+        answer = (obj if isinstance(obj, str) else str(raw)).replace("```json", "").replace("```", "").strip()
+        citations = []
+
+    # --------------------------
+    # ⭐ Normalize Citations
+    # --------------------------
+    norm_citations = []
+
+    for c in citations[:5]:
+        try:
+            norm_citations.append({
+                "source": "NG12 PDF",
+                "page": int(c.get("page", -1)),
+                "chunk_id": c.get("chunk_id", ""),
+                "excerpt": (c.get("excerpt", "") or "")[:500]
+            })
+        except Exception:
+            pass
+
+    # If model forgot citations → attach fallback
+    cacheable = bool(answer) and bool(norm_citations) and not failed
+    if not norm_citations:
+        norm_citations = [
+            {
+                "source": "NG12 PDF",
+                "page": h["page"],
+                "chunk_id": h["chunk_id"],
+                "excerpt": h["text"][:500]
+            }
+            for h in hits[:3]
+        ]
+
+    return answer, norm_citations, cacheable
+
+
+# ==========================
+# Streaming: incremental "answer" field parser
+# ==========================
+_ANSWER_KEY = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class AnswerStreamParser:
+    """
+    Feed raw model output as it streams in; get back the decoded text of the
+    JSON "answer" string so far. Handles escapes split across pieces and
+    ```json fences. If the model answers in plain text instead of JSON, the
+    text is passed through unchanged. `_parse_answer` on the full output
+    stays the source of truth for the final answer and citations.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self._pos = 0
+        self._mode = "start"  # start | seek | answer | plain | done
+
+    def feed(self, piece: str) -> str:
+        self.raw += piece
+        out: List[str] = []
+
+        if self._mode == "start":
+            head = self.raw.lstrip()
+            if head and "```".startswith(head):
+                return ""  # could still become a fence
+            if head.startswith("```"):
+                if "\n" not in head:
+                    return ""  # fence line not complete yet
+                head = head.split("\n", 1)[1].lstrip()
+            if not head:
+                return ""
+            if head[0] == "{":
+                self._mode = "seek"
+            else:
+                self._mode = "plain"
+                self._pos = len(self.raw) - len(head)
+
+        if self._mode == "plain":
+            text = self.raw[self._pos:]
+            self._pos = len(self.raw)
+            return text.replace("```", "")
+
+        if self._mode == "seek":
+            m = _ANSWER_KEY.search(self.raw, self._pos)
+            if m is None:
+                return ""
+            self._pos = m.end()
+            self._mode = "answer"
+
+        if self._mode == "answer":
+            raw, i = self.raw, self._pos
+            while i < len(raw):
+                ch = raw[i]
+                if ch == '"':
+                    self._mode = "done"
+                    i += 1
+                    break
+                if ch != "\\":
+                    out.append(ch)
+                    i += 1
+                    continue
+                if i + 1 >= len(raw):
+                    break  # escape split across pieces
+                esc = raw[i + 1]
+                if esc == "u":
+                    if i + 6 > len(raw):
+                        break
+                    try:
+                        out.append(chr(int(raw[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                else:
+                    out.append(_ESCAPES.get(esc, esc))
+                    i += 2
+            self._pos = i
+
+        return "".join(out)
+
+
 # ==========================
 # Chat Agent
 # ==========================
 class NG12ChatAgent:
 
-    def __init__(self):
-        self.vs = VectorStore()
-        self.gem = GeminiClient()
+    def __init__(self, gem=None, agem=None, vs=None, answer_cache: Optional[SemanticAnswerCache] = None):
+        """
+        Dependencies default to the real Vertex AI / Chroma clients; pass
+        `gem`/`agem`/`vs` to share them (app.services) or swap in other backends.
+        """
+        self.vs = vs or make_vector_store()
+        self.gem = gem or GeminiClient()
+        self.agem = agem or AsyncGeminiClient(client=self.gem.client)
+        self.answer_cache = answer_cache if answer_cache is not None else get_answer_cache()
 
     # --------------------------
-    # Main Chat Method
+    # Semantic answer cache (first-turn questions only)
     # --------------------------
-    def chat(self, message: str, history: List[dict], top_k: int = 5) -> Tuple[str, List[dict]]:
+    def _cacheable_turn(self, history: List[dict], summary: str) -> bool:
+        return self.answer_cache is not None and not summary and len(history) <= 1
+
+    def _cache_lookup(self, q_emb: List[float], history: List[dict], summary: str, top_k: int):
+        """Returns (version, hit); version is None when the question is not cacheable."""
+        if not self._cacheable_turn(history, summary):
+            return None, None
+        version = f"{self.vs.index_version()}|{self.gem.gen_model}"
+        return version, self.answer_cache.get(q_emb, top_k, version)
+
+    async def _cache_lookup_async(self, q_emb: List[float], history: List[dict], summary: str, top_k: int):
+        # index_version() reads the version file: off the event loop
+        if not self._cacheable_turn(history, summary):
+            return None, None
+        return await run_blocking(self._cache_lookup, q_emb, history, summary, top_k)
+
+    @staticmethod
+    def _hit_debug(info: Dict[str, Any]) -> Dict[str, Any]:
+        return {"cache": "hit", "cache_similarity": info["similarity"], "cached_question": info["question"]}
+
+    def _cache_answer(
+        self, version: Optional[str], q_emb: List[float], query: str, top_k: int,
+        answer: str, citations: List[dict], cacheable: bool, debug: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        if version is not None:
+            debug["cache"] = "miss"
+            # don't serve a failed generation to every similar question
+            if cacheable:
+                self.answer_cache.put(q_emb, query, top_k, version, answer, citations)
+        return debug
 
-        # 1️⃣ Embed user question
-        q_emb = self.gem.embed_texts([message])[0]
+    # --------------------------
+    # Main Chat Method
+    # --------------------------
+    @instrumented("chat.answer")
+    def chat(
+        self, message: str, history: List[dict], top_k: int = 5, summary: str = "", topics: str = ""
+    ) -> Tuple[str, List[dict], Dict[str, Any]]:
+        """
+        Returns (answer, citations, debug); debug carries the prompt token counts.
+        `history` is the recent turns not covered by the session `summary`; follow-up
+        questions are retrieved with a standalone query built from them + `topics`.
+        """
+
+        # 1️⃣ Embed user question (condensed with the conversation context for follow-ups)
+        query = standalone_query(message, history, topics)
+        with metrics.timed("chat.embed"):
+            q_emb = self.gem.embed_query(query)
+
+        version, hit = self._cache_lookup(q_emb, history, summary, top_k)
+        if hit is not None:
+            return hit[0], hit[1], self._hit_debug(hit[2])
 
         # 2️⃣ Retrieve guideline chunks
-        qr = self.vs.query(q_emb, top_k=top_k)
+        with metrics.timed("chat.vector_query"):
+            qr = self.vs.query(q_emb, top_k=top_k, query_text=query)
         hits = _extract_hits(qr)
 
         # Guardrail: no evidence
-        if not hits or all((h["text"] or "").strip() == "" for h in hits):
-            return (
-                "I couldn’t find support in the NG12 guideline excerpts for this question. "
-                "Please refine the symptom or cancer type.",
-                []
-            )
-
-        # 3️⃣ Build Evidence Block
-        evidence = "\n\n".join(
-            [f"[{h['chunk_id']} | p.{h['page']}] {h['text']}" for h in hits]
-        )
+        if _no_evidence(hits):
+            return NO_EVIDENCE_ANSWER, [], {}
 
-        # 4️⃣ Include Short Conversation Context
-        convo = "\n".join([
-            f"{m['role'].upper()}: {m['content']}"
-            for m in history[-8:]
-        ])
-
-        # 5️⃣ Construct Prompt
-        prompt = f"""{CHAT_SYSTEM_PROMPT}
-
-Conversation so far:
-{convo}
+        # 6️⃣ Call Gemini
+        context, prompt, stats = _packed_prompt(message, history, hits, query, summary)
+        raw = self.gem.generate_json(
+            CHAT_SYSTEM_PROMPT, prompt, CHAT_ANSWER_SCHEMA, temperature=0.2, context=context
+        )
 
-User question:
-{message}
+        answer, citations, cacheable = _parse_answer(raw, hits)
+        debug = self._cache_answer(
+            version, q_emb, query, top_k, answer, citations, cacheable, _debug(stats, message, query)
+        )
+        return answer, citations, debug
 
-NG12 excerpts:
-{evidence}
+    @instrumented("chat.answer")
+    async def chat_async(
+        self, message: str, history: List[dict], top_k: int = 5, summary: str = "", topics: str = ""
+    ) -> Tuple[str, List[dict], Dict[str, Any]]:
 
-Return ONLY valid JSON. No markdown.
-"""
+        query = standalone_query(message, history, topics)
+        with metrics.timed("chat.embed"):
+            q_emb = await self.agem.embed_query(query)
 
-        # 6️⃣ Call Gemini
-        raw = self.gem.generate(prompt)
+        version, hit = await self._cache_lookup_async(q_emb, history, summary, top_k)
+        if hit is not None:
+            return hit[0], hit[1], self._hit_debug(hit[2])
 
-        # --------------------------
-        # ⭐ CLEAN Markdown JSON
-        # --------------------------
-        clean_raw = raw.strip()
+        with metrics.timed("chat.vector_query"):
+            qr = await self.vs.query_async(q_emb, top_k=top_k, query_text=query)
+        hits = _extract_hits(qr)
 
-        if clean_raw.startswith("```"):
-            clean_raw = clean_raw.replace("```json", "")
-            clean_raw = clean_raw.replace("```", "")
-            clean_raw = clean_raw.strip()
+        if _no_evidence(hits):
+            return NO_EVIDENCE_ANSWER, [], {}
 
-        # --------------------------
-        # ⭐ Parse JSON Safely
-        # --------------------------
-        try:
-            obj = json.loads(clean_raw)
+        context, prompt, stats = _packed_prompt(message, history, hits, query, summary)
+        raw = await self.agem.generate_json(
+            CHAT_SYSTEM_PROMPT, prompt, CHAT_ANSWER_SCHEMA, temperature=0.2, context=context
+        )
 
-            answer = obj.get("answer", "").strip()
-            citations = obj.get("citations", [])
+        answer, citations, cacheable = _parse_answer(raw, hits)
+        debug = self._cache_answer(
+            version, q_emb, query, top_k, answer, citations, cacheable, _debug(stats, message, query)
+        )
+        return answer, citations, debug
+
+    @instrumented("chat.stream")
+    async def chat_stream(
+        self, message: str, history: List[dict], top_k: int = 5, summary: str = "", topics: str = ""
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Yields ("token", text) as the answer streams in, then one
+        ("final", {"answer", "citations", "debug"}) parsed from the full output.
+        """
+
+        query = standalone_query(message, history, topics)
+        with metrics.timed("chat.embed"):
+            q_emb = await self.agem.embed_query(query)
+
+        version, hit = await self._cache_lookup_async(q_emb, history, summary, top_k)
+        if hit is not None:
+            yield "token", hit[0]
+            yield "final", {"answer": hit[0], "citations": hit[1], "debug": self._hit_debug(hit[2])}
+            return
+
+        with metrics.timed("chat.vector_query"):
+            qr = await self.vs.query_async(q_emb, top_k=top_k, query_text=query)
+        hits = _extract_hits(qr)
 
-        except Exception:
-            # Fallback if model returns plain text
-            answer = clean_raw
-            citations = [
-                {
-                    "page": h["page"],
-                    "chunk_id": h["chunk_id"],
-                    "excerpt": h["text"][:400]
-                }
-                for h in hits[:3]
-            ]
-
-        # --------------------------
-        # ⭐ Normalize Citations
-        # --------------------------
-        norm_citations = []
-
-        for c in citations[:5]:
-            try:
-                norm_citations.append({
-                    "source": "NG12 PDF",
-                    "page": int(c.get("page", -1)),
-                    "chunk_id": c.get("chunk_id", ""),
-                    "excerpt": (c.get("excerpt", "") or "")[:500]
-                })
-            except Exception:
-                pass
-
-        # If model forgot citations → attach fallback
-        if not norm_citations:
-            norm_citations = [
-                {
-                    "source": "NG12 PDF",
-                    "page": h["page"],
-                    "chunk_id": h["chunk_id"],
-                    "excerpt": h["text"][:500]
-                }
-                for h in hits[:3]
-            ]
-
-        return answer, norm_citations
+        if _no_evidence(hits):
+            yield "token", NO_EVIDENCE_ANSWER
+            yield "final", {"answer": NO_EVIDENCE_ANSWER, "citations": [], "debug": {}}
+            return
+
+        context, prompt, stats = _packed_prompt(message, history, hits, query, summary)
+        parser = AnswerStreamParser()
+        async for piece in self.agem.generate_stream(
+            prompt, system=CHAT_SYSTEM_PROMPT, schema=CHAT_ANSWER_SCHEMA, context=context
+        ):
+            text = parser.feed(piece)
+            if text:
+                yield "token", text
+
+        answer, citations, cacheable = _parse_answer(parser.raw, hits)
+        debug = self._cache_answer(
+            version, q_emb, query, top_k, answer, citations, cacheable, _debug(stats, message, query)
+        )
+        yield "final", {"answer": answer, "citations": citations, "debug": debug}
@@ -0,0 +1,417 @@
+"""
+Gemini context caching for the static prompt prefixes.
+
+A prefix is a system prompt plus, optionally, an evidence bundle (the NG12
+snippets an assessment or chat answer is grounded on). ContextCacheManager
+registers a prefix once with `caches.create` and hands out the cache name
+(`cached_content` in GenerateContentConfig), so later calls send only the
+per-request part and the prefix tokens are billed at the cached rate.
+
+  * a prefix is cached only when it is large enough for the API
+    (CONTEXT_CACHE_MIN_TOKENS) and, for evidence bundles, once it has been
+    seen CONTEXT_CACHE_MIN_USES times (a popular bundle)
+  * a handle with less than CONTEXT_CACHE_REFRESH_S left (default: half the
+    TTL) has its TTL extended (`caches.update`) on its next use, so a prefix
+    used at least that often never expires mid-batch; unused caches just expire
+  * create / update go through their own call policy ("gemini.caches": short
+    timeout, one attempt, circuit breaker), so a slow cache endpoint costs a
+    request at most CONTEXT_CACHE_TIMEOUT_S
+  * failures never fail the call: a failed create backs the prefix off, and
+    repeated failures (caching unavailable for the model / project) switch
+    the manager off for one TTL; callers then send the full prompt. While the
+    breaker is open, prefixes are skipped without counting as failures
+
+`python -m app.llm.context_cache demo` runs a batch-like workload against
+the in-memory stand-in (app.llm.stub_client.StubCaches).
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.llm.call_policy import CallPolicy, CircuitOpenError, DeadlineExceeded, get_call_policy, is_retryable
+from app.llm.evidence_packer import estimate_tokens
+from app.metrics import cache_collector, metrics
+
+_DOWN_AFTER_FAILURES = 3
+
+
+def with_context(context: Optional[str], user: str) -> str:
+    """The full prompt text when the context is not served from a cache."""
+    return f"{context}\n\n{user}" if context else user
+
+
+def is_stale_handle_error(exc: BaseException) -> bool:
+    """A request rejected because of its cached_content (expired / deleted / not allowed)."""
+    if isinstance(exc, (CircuitOpenError, DeadlineExceeded)) or is_retryable(exc):
+        return False
+    return getattr(exc, "code", None) in (400, 403, 404)
+
+
+class _Entry:
+    __slots__ = ("name", "expires", "tokens")
+
+    def __init__(self, name: str, expires: float, tokens: int):
+        self.name = name
+        self.expires = expires
+        self.tokens = tokens
+
+
+class ContextCacheManager:
+    """
+    Cache handles for prompt prefixes, keyed by (model, system, context).
+    `caches` / `acaches` are `client.caches` / `client.aio.caches` (or stand-ins
+    with the same create / update / delete methods); `policy` bounds the create /
+    update calls; `clock` is injectable for tests.
+    """
+
+    def __init__(
+        self,
+        caches: Any,
+        model: str,
+        acaches: Any = None,
+        ttl_s: float = 3600.0,
+        refresh_s: float = 1800.0,
+        min_tokens: int = 1024,
+        min_uses: int = 2,
+        max_entries: int = 64,
+        clock: Callable[[], float] = time.monotonic,
+        policy: Optional[CallPolicy] = None,
+    ):
+        self.caches = caches
+        self.acaches = acaches
+        self.model = model
+        self.ttl_s = float(ttl_s)
+        self.refresh_s = min(float(refresh_s), self.ttl_s)
+        self.min_tokens = int(min_tokens)
+        self.min_uses = max(1, int(min_uses))
+        self.max_entries = max(1, int(max_entries))
+        self.clock = clock
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # LRU order
+        self._seen: "OrderedDict[str, int]" = OrderedDict()
+        self._pending: set = set()
+        self._backoff: Dict[str, float] = {}
+        self._failures = 0
+        self._down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.created = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.cached_tokens = 0
+
+    @classmethod
+    def from_client(cls, client: Any, model: str) -> "ContextCacheManager":
+        return cls(
+            client.caches,
+            model,
+            acaches=client.aio.caches,
+            ttl_s=settings.context_cache_ttl_s,
+            refresh_s=settings.context_cache_refresh_s,
+            min_tokens=settings.context_cache_min_tokens,
+            min_uses=settings.context_cache_min_uses,
+            max_entries=settings.context_cache_max_entries,
+            policy=get_call_policy("gemini.caches"),
+        )
+
+    def _key(self, system: str, context: Optional[str]) -> str:
+        h = hashlib.sha256()
+        for part in (self.model, system, context or ""):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def _create_config(self, system: str, context: Optional[str]) -> Dict[str, Any]:
+        config: Dict[str, Any] = {
+            "system_instruction": system,
+            "ttl": f"{int(self.ttl_s)}s",
+            "display_name": "ng12-prefix",
+        }
+        if context:
+            config["contents"] = [context]
+        return config
+
+    # ==========================
+    # Planning (under the lock) / IO (outside it)
+    # ==========================
+    def _plan(self, system: str, context: Optional[str]) -> Tuple[str, str, Any]:
+        """("use" | "refresh", key, entry), ("create", key, tokens) or ("skip", key, None)."""
+        key = self._key(system, context)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now >= entry.expires:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.cached_tokens += entry.tokens
+                if entry.expires - now <= self.refresh_s and key not in self._pending:
+                    self._pending.add(key)
+                    return "refresh", key, entry
+                return "use", key, entry
+            self.misses += 1
+            if now < self._down_until or key in self._pending or now < self._backoff.get(key, 0.0):
+                return "skip", key, None
+            tokens = estimate_tokens(system) + estimate_tokens(context or "")
+            if tokens < self.min_tokens:
+                return "skip", key, None
+            if context:
+                uses = self._seen.pop(key, 0) + 1
+                self._seen[key] = uses
+                while len(self._seen) > 4 * self.max_entries:
+                    self._seen.popitem(last=False)
+                if uses < self.min_uses:
+                    return "skip", key, None
+            self._pending.add(key)
+            return "create", key, tokens
+
+    def _created(self, key: str, name: str, tokens: int) -> Optional[str]:
+        """Stores the new handle; returns the name of an evicted remote cache to delete."""
+        with self._lock:
+            self._pending.discard(key)
+            self._seen.pop(key, None)
+            self._failures = 0
+            self.created += 1
+            self._entries[key] = _Entry(name, self.clock() + self.ttl_s, tokens)
+            if len(self._entries) > self.max_entries:
+                _, old = self._entries.popitem(last=False)
+                self.evictions += 1
+                return old.name
+        return None
+
+    def _refreshed(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            self._pending.discard(key)
+            entry.expires = self.clock() + self.ttl_s
+            self.refreshed += 1
+
+    def _released(self, key: str) -> None:
+        # the breaker rejected the call: no verdict on the prefix, try again later
+        with self._lock:
+            self._pending.discard(key)
+
+    def _failed(self, key: str, refresh: bool) -> None:
+        now = self.clock()
+        with self._lock:
+            self._pending.discard(key)
+            self.failed += 1
+            if refresh:
+                self._entries.pop(key, None)
+                return
+            self._backoff[key] = now + min(self.ttl_s, 300.0)
+            self._failures += 1
+            if self._failures >= _DOWN_AFTER_FAILURES:
+                self._down_until = now + self.ttl_s
+                self._failures = 0
+                self._backoff.clear()
+
+    def _call(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        return fn(**kwargs) if self.policy is None else self.policy.call(fn, **kwargs)
+
+    async def _acall(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        return await (fn(**kwargs) if self.policy is None else self.policy.acall(fn, **kwargs))
+
+    # ==========================
+    # Public API
+    # ==========================
+    def handle(self, system: str, context: Optional[str] = None) -> Optional[str]:
+        """Cache name for this prefix, or None when the full prompt should be sent."""
+        action, key, arg = self._plan(system, context)
+        if action == "use":
+            return arg.name
+        if action == "refresh":
+            try:
+                self._call(self.caches.update, name=arg.name, config={"ttl": f"{int(self.ttl_s)}s"})
+                self._refreshed(key, arg)
+                metrics.inc("ng12_context_cache_total", outcome="refreshed")
+                return arg.name
+            except CircuitOpenError:
+                self._released(key)
+                return arg.name  # still valid until it expires
+            except Exception:
+                self._failed(key, refresh=True)
+                metrics.inc("ng12_context_cache_total", outcome="failed")
+                return None
+        if action == "create":
+            try:
+                cache = self._call(self.caches.create, model=self.model, config=self._create_config(system, context))
+            except CircuitOpenError:
+                self._released(key)
+                return None
+            except Exception:
+                self._failed(key, refresh=False)
+                metrics.inc("ng12_context_cache_total", outcome="failed")
+                return None
+            evicted = self._created(key, cache.name, arg)
+            metrics.inc("ng12_context_cache_total", outcome="created")
+            if evicted is not None:
+                try:
+                    self.caches.delete(name=evicted)
+                except Exception:
+                    pass  # expires on its own
+            return cache.name
+        return None
+
+    async def ahandle(self, system: str, context: Optional[str] = None) -> Optional[str]:
+        if self.acaches is None:
+            return self.handle(system, context)
+        action, key, arg = self._plan(system, context)
+        if action == "use":
+            return arg.name
+        if action == "refresh":
+            try:
+                await self._acall(self.acaches.update, name=arg.name, config={"ttl": f"{int(self.ttl_s)}s"})
+                self._refreshed(key, arg)
+                metrics.inc("ng12_context_cache_total", outcome="refreshed")
+                return arg.name
+            except CircuitOpenError:
+                self._released(key)
+                return arg.name
+            except Exception:
+                self._failed(key, refresh=True)
+                metrics.inc("ng12_context_cache_total", outcome="failed")
+                return None
+        if action == "create":
+            try:
+                cache = await self._acall(
+                    self.acaches.create, model=self.model, config=self._create_config(system, context)
+                )
+            except CircuitOpenError:
+                self._released(key)
+                return None
+            except Exception:
+                self._failed(key, refresh=False)
+                metrics.inc("ng12_context_cache_total", outcome="failed")
+                return None
+            evicted = self._created(key, cache.name, arg)
+            metrics.inc("ng12_context_cache_total", outcome="created")
+            if evicted is not None:
+                try:
+                    await self.acaches.delete(name=evicted)
+                except Exception:
+                    pass
+            return cache.name
+        return None
+
+    def invalidate(self, name: str) -> None:
+        """Forget a handle the API rejected; the prefix is recreated on a later call."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    del self._entries[key]
+                    self.invalidations += 1
+        metrics.inc("ng12_context_cache_total", outcome="fallback")
+
+    def clear(self) -> None:
+        """Delete every remote cache this manager created (best effort)."""
+        with self._lock:
+            names = [e.name for e in self._entries.values()]
+            self._entries.clear()
+            self._seen.clear()
+        for name in names:
+            try:
+                self.caches.delete(name=name)
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "cached_tokens": self.cached_tokens,
+                "available": self.clock() >= self._down_until,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+metrics.describe("ng12_context_cache_total", "Context cache handle operations by outcome.")
+
+_shared_manager: Optional[ContextCacheManager] = None
+_shared_lock = threading.Lock()
+
+
+def get_context_cache(client: Any, model: Optional[str] = None) -> Optional[ContextCacheManager]:
+    """Process-wide context cache manager (built from the first client), or None when CONTEXT_CACHE=False."""
+    global _shared_manager
+    if not settings.context_cache or getattr(client, "caches", None) is None:
+        return None
+    if _shared_manager is None:
+        with _shared_lock:
+            if _shared_manager is None:
+                _shared_manager = ContextCacheManager.from_client(client, model or settings.gen_model)
+                metrics.add_collector("context_cache", cache_collector("context", _shared_manager))
+    return _shared_manager
+
+
+# ==========================
+# CLI
+# ==========================
+def _demo(args) -> Dict[str, Any]:
+    from app.llm.stub_client import StubCaches
+
+    now = [0.0]
+    caches = StubCaches(min_tokens=args.min_tokens, clock=lambda: now[0], fail=args.unavailable)
+    mgr = ContextCacheManager(
+        caches, "stub-gen", ttl_s=args.ttl_s, refresh_s=args.refresh_s,
+        min_tokens=args.min_tokens, min_uses=args.min_uses, clock=lambda: now[0],
+    )
+    system = "You are the NG12 Cancer Risk Assessor. " * 8
+    bundles = [f"NG12 EVIDENCE SNIPPETS (bundle {b}):\n" + ("guideline text " * args.bundle_words)
+               for b in range(args.bundles)]
+    sent = full = 0
+    for i in range(args.calls):
+        now[0] = i * args.gap_s
+        context = bundles[(i * 7) % len(bundles)] if i % 5 else bundles[0]  # bundle 0 is hot
+        name = mgr.handle(system, context)
+        prompt_tokens = estimate_tokens(system) + estimate_tokens(context) + 60
+        full += prompt_tokens
+        sent += 60 if name else prompt_tokens
+    return {
+        "calls": args.calls,
+        "input_tokens_full": full,
+        "input_tokens_uncached": sent,
+        "uncached_share": round(sent / full, 3) if full else 0.0,
+        "manager": mgr.stats(),
+        "backend": caches.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini context cache utilities.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    demo = sub.add_parser("demo", help="batch-like workload against the in-memory cache stand-in")
+    demo.add_argument("--calls", type=int, default=500)
+    demo.add_argument("--bundles", type=int, default=20, help="distinct evidence bundles")
+    demo.add_argument("--bundle-words", type=int, default=600)
+    demo.add_argument("--gap-s", type=float, default=10.0, help="simulated seconds between calls")
+    demo.add_argument("--ttl-s", type=float, default=600.0)
+    demo.add_argument("--refresh-s", type=float, default=300.0)
+    demo.add_argument("--min-tokens", type=int, default=1024)
+    demo.add_argument("--min-uses", type=int, default=2)
+    demo.add_argument("--unavailable", action="store_true", help="every create fails (fallback path)")
+    args = parser.parse_args()
+
+    print(json.dumps(_demo(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
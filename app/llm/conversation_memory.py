@@ -0,0 +1,145 @@
+"""
+Rolling conversation memory for chat sessions.
+
+Once a session has CHAT_SUMMARY_TRIGGER messages not covered by its summary,
+all but the newest CHAT_RECENT_MESSAGES are folded into a running summary
+(one extra generate call, run after the reply is sent). The chat prompt is
+then summary + recent turns + evidence, each with a fixed budget, so it stops
+growing with the session.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from app.chat_store import ChatMessage, ChatStore
+from app.concurrency import run_blocking
+from app.config import settings
+from app.llm.evidence_packer import CHARS_PER_TOKEN
+from app.llm.structured import parse_json_output
+
+SUMMARY_HEADER = "Conversation summary so far:"
+
+SUMMARY_PROMPT = """You maintain the running memory of a conversation about the NICE NG12 guideline
+(suspected cancer recognition and referral).
+
+Merge the earlier summary and the new turns into ONE updated summary:
+- keep patient details the user gave (age, sex, symptoms, durations, test results)
+- keep which cancers / recommendations were discussed and any conclusions
+- drop pleasantries and anything repeated
+- at most {max_words} words
+
+Output format (STRICT JSON ONLY):
+{{"summary": "...", "topics": "short comma-separated retrieval keywords (symptoms, cancer sites, ages)"}}
+"""
+
+# "what about over 60s?", "and for women?", "is that urgent?" -- only meaningful with earlier turns
+_CONTINUATION = re.compile(
+    r"^\s*(and|also|but|so|then|or|plus|for|over|under|aged|what about|how about|what if|same)\b",
+    re.IGNORECASE,
+)
+# a message naming a cancer site, symptom or test stands on its own
+_CLINICAL_TERM = re.compile(
+    r"\b(cancer|carcinoma|tumou?r|malignan|lymphoma|leuka?emia|myeloma|melanoma|sarcoma|blastoma|glioma"
+    r"|mesothelioma|lung|breast|bowel|colo|rect|anal|anus|prostat|bladder|renal|kidney|oesophag|esophag"
+    r"|stomach|gastr|pancrea|liver|ovar|endometri|uter|cervi|vulva|vagin|penis|penile|testic|thyroid|laryn"
+    r"|mouth|oral|tongue|brain|skin|bone|blood|bleed|haem|hem|dysphag|dyspeps|reflux|cough|hoarse|lump|mass"
+    r"|swelling|pain|ache|weight|fatigue|fever|sweat|bruis|petechia|anaemi|anemi|jaundice|nausea|vomit"
+    r"|diarrh|constipat|ulcer|mole|lesion|rash|itch|prurit|breath|dyspnoea|chest|abdom|pelvi|urin|menopaus"
+    r"|discharge|nipple|x-?ray|ultrasound|scan|mri|endoscop|colonoscop|psa|ca125|fit|biops|smok|asbestos)",
+    re.IGNORECASE,
+)
+_MAX_FOLLOW_UP_WORDS = 10
+_MAX_CONTEXT_CHARS = 240
+
+
+def is_follow_up(message: str) -> bool:
+    """
+    Short messages that continue the conversation: they start with a
+    continuation marker or name no clinical term of their own. A new,
+    self-contained question ("what suggests that lung cancer needs referral?")
+    is never one, whatever pronouns it uses.
+    """
+    if len(message.split()) > _MAX_FOLLOW_UP_WORDS:
+        return False
+    return bool(_CONTINUATION.search(message)) or not _CLINICAL_TERM.search(message)
+
+
+def standalone_query(message: str, history: List[dict], topics: str = "") -> str:
+    """
+    Retrieval query for `message`: the message itself, or for a follow-up the
+    message plus the previous user question and the session's summary topics.
+    No model call; the result is at most ~_MAX_CONTEXT_CHARS longer than the message.
+    """
+    if not is_follow_up(message):
+        return message
+    previous = ""
+    for m in reversed(history):
+        content = (m.get("content") or "").strip()
+        if m.get("role") == "user" and content and content != message.strip():
+            previous = content
+            break
+    context = "; ".join(p for p in (previous, topics.strip()) if p)[:_MAX_CONTEXT_CHARS]
+    return f"{message} (context: {context})" if context else message
+
+
+def summary_block(summary: str) -> str:
+    return f"{SUMMARY_HEADER}\n{summary}\n\n" if summary else ""
+
+
+def build_fold_prompt(summary: str, turns: List[ChatMessage], max_words: int) -> str:
+    convo = "\n".join(f"{m.role.upper()}: {m.content}" for m in turns)
+    return f"""{SUMMARY_PROMPT.format(max_words=max_words)}
+{SUMMARY_HEADER}
+{summary or "(none)"}
+
+New turns:
+{convo}
+
+Return ONLY valid JSON. No markdown.
+"""
+
+
+def parse_fold(raw: str, previous_topics: str = "") -> Tuple[str, str]:
+    """(summary, topics); plain-text output is taken as the summary."""
+    obj = parse_json_output(raw)
+    if isinstance(obj, dict):
+        return str(obj.get("summary", "")).strip(), str(obj.get("topics", previous_topics)).strip()
+    return raw.strip().replace("```json", "").replace("```", "").strip(), previous_topics
+
+
+def _clip(text: str, budget_tokens: int) -> str:
+    limit = int(budget_tokens * CHARS_PER_TOKEN)
+    if budget_tokens <= 0 or len(text) <= limit:
+        return text
+    return text[:limit - 1].rsplit(" ", 1)[0] + "…"
+
+
+async def fold_session(
+    store: ChatStore,
+    agem,
+    session_id: str,
+    trigger: Optional[int] = None,
+    keep_recent: Optional[int] = None,
+) -> bool:
+    """
+    Fold the session's older turns into its summary when it has `trigger` or
+    more unsummarized messages. Returns True when a new summary was stored.
+    """
+    trigger = settings.chat_summary_trigger if trigger is None else trigger
+    keep_recent = settings.chat_recent_messages if keep_recent is None else keep_recent
+    if trigger <= 0:
+        return False
+
+    mem = await run_blocking(store.memory, session_id, settings.chat_max_messages)
+    if mem.unsummarized < trigger:
+        return False
+    fold = mem.messages[:max(0, len(mem.messages) - keep_recent)]
+    if not fold:
+        return False
+
+    raw = await agem.generate(build_fold_prompt(mem.summary, fold, int(settings.chat_summary_tokens * 0.75)))
+    summary, topics = parse_fold(raw, mem.topics)
+    if not summary:
+        return False
+    summary = _clip(summary, settings.chat_summary_tokens)
+    covered = mem.total - (len(mem.messages) - len(fold))
+    return await run_blocking(store.set_summary, session_id, summary, topics[:_MAX_CONTEXT_CHARS], covered, mem.covered)
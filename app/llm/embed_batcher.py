@@ -0,0 +1,154 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from app.config import settings
+
+EmbedFn = Callable[[List[str]], List[List[float]]]
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embed requests into batched calls.
+
+    Callers `submit(text)` and get a Future. A background thread collects pending
+    texts for up to `window_ms` (or until `max_batch` texts are waiting), sends one
+    `embed_fn(texts)` call and resolves each caller's Future with its vector.
+    Identical texts that are already pending or in flight share a single Future.
+
+    `embed_fn` is any `List[str] -> List[List[float]]` callable, e.g.
+    `GeminiClient.embed_texts` or a fake that counts calls. Each Gemini client
+    owns one (or is handed one), so batches always go out through the client
+    and model their callers asked for.
+    """
+
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        window_ms: float = 5.0,
+        max_batch: int = 32,
+        max_inflight_batches: int = 4,
+    ):
+        self.embed_fn = embed_fn
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.max_inflight_batches = max(1, int(max_inflight_batches))
+
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Future] = {}   # waiting for the next batch (insertion ordered)
+        self._inflight: Dict[str, Future] = {}  # sent, not yet resolved
+        self._first_pending_at = 0.0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+        self.requests = 0
+        self.deduped = 0
+        self.batches = 0
+        self.texts_sent = 0
+
+    @classmethod
+    def from_settings(cls, embed_fn: EmbedFn) -> "EmbeddingBatcher":
+        return cls(embed_fn, window_ms=settings.embed_batch_window_ms, max_batch=settings.embed_batch_max)
+
+    def _start(self) -> None:
+        # caller holds the condition; started lazily so forked workers get their own thread
+        if self._thread is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_inflight_batches, thread_name_prefix="embed-batch"
+            )
+            self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self.requests += 1
+
+            fut = self._pending.get(text) or self._inflight.get(text)
+            if fut is not None:
+                self.deduped += 1
+                return fut
+
+            fut = Future()
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending[text] = fut
+            self._start()
+            self._cond.notify()
+            return fut
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        return self.submit(text).result(timeout)
+
+    def _take_batch(self) -> Dict[str, Future]:
+        # caller holds the condition
+        batch: Dict[str, Future] = {}
+        for text in list(self._pending)[: self.max_batch]:
+            batch[text] = self._pending.pop(text)
+        self._inflight.update(batch)
+        if self._pending:
+            self._first_pending_at = time.monotonic()
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                # wait for the window to fill unless the batch is already full
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = self._first_pending_at + self.window_s - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+                self.batches += 1
+                self.texts_sent += len(batch)
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: Dict[str, Future]) -> None:
+        texts = list(batch)
+        try:
+            vectors = self.embed_fn(texts)
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"embed_fn returned {len(vectors)} vectors for {len(texts)} texts")
+        except BaseException as e:
+            with self._cond:
+                for text in texts:
+                    self._inflight.pop(text, None)
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        with self._cond:
+            for text in texts:
+                self._inflight.pop(text, None)
+        for text, vec in zip(texts, vectors):
+            fut = batch[text]
+            if not fut.done():
+                fut.set_result(vec)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "deduped": self.deduped,
+                "batches": self.batches,
+                "texts_sent": self.texts_sent,
+                "avg_batch_size": (self.texts_sent / self.batches) if self.batches else 0.0,
+            }
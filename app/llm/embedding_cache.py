@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import cache_collector, metrics
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache keyed on (embed model, normalized text).
+
+    - in-memory LRU bounded by `max_entries`
+    - entries older than `ttl_s` are treated as misses (ttl_s <= 0 disables expiry)
+    - optional SQLite file (`path`) so embeddings survive restarts; memory misses
+      fall through to it and hits are promoted back into the LRU
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_s: float = 0.0, path: str = ""):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._mem: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, created REAL NOT NULL, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @property
+    def persistent(self) -> bool:
+        """True when lookups may hit SQLite (async callers run them off the event loop)."""
+        return self._db is not None
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_s > 0 and now - created > self.ttl_s
+
+    def _remember(self, key: str, created: float, vec: List[float]) -> None:
+        # caller holds the lock
+        self._mem[key] = (created, vec)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if not self._expired(item[0], now):
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, vec FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    vec = array("f", row[1]).tolist()
+                    self._remember(key, row[0], vec)
+                    self.hits += 1
+                    return vec
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vec: List[float]) -> None:
+        key = cache_key(model, text)
+        now = time.time()
+        vec = list(vec)
+        with self._lock:
+            self._remember(key, now, vec)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, created, vec) VALUES (?, ?, ?, ?)",
+                    (key, model, now, array("f", vec).tobytes()),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._mem),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache shared by every GeminiClient."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = EmbeddingCache(
+                    max_entries=settings.embed_cache_size,
+                    ttl_s=settings.embed_cache_ttl_s,
+                    path=settings.embed_cache_path,
+                )
+                metrics.add_collector("embedding_cache", cache_collector("embedding", _shared_cache))
+    return _shared_cache
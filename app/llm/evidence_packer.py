@@ -0,0 +1,213 @@
+"""
+Token-budgeted prompt packing for the assess / chat LLM calls.
+
+Token counts are estimates (~4 characters per token for English text with
+Gemini tokenizers); close enough for budgeting without a count_tokens round trip.
+"""
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.rag.bm25 import tokenize
+
+CHARS_PER_TOKEN = 4.0
+ELLIPSIS = "[…]"
+
+_SENTENCE = re.compile(r"(?<=[.;!?\]])\s+(?=[A-Z0-9•－\[(])")
+_CHUNK_ID = re.compile(r"^(.*)_(\d+)$")
+_REC_NO = re.compile(r"\b1\.\d{1,2}\.\d{1,2}\b")
+_MIN_DEDUPE_CHARS = 40  # shorter units ("[2015]", "are aged 40 and over") are not worth the risk
+
+
+def estimate_tokens(text: str) -> int:
+    return int(math.ceil(len(text or "") / CHARS_PER_TOKEN))
+
+
+def _sentences(text: str) -> List[str]:
+    # one unit per list item / line, long lines split further into sentences
+    out: List[str] = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line:
+            out.extend(s for s in _SENTENCE.split(line) if s)
+    return out
+
+
+def _overlap(prev: str, text: str, max_overlap: int = 400, min_overlap: int = 20) -> int:
+    """Length of the longest prefix of `text` that is a suffix of `prev`."""
+    for n in range(min(max_overlap, len(prev), len(text)), min_overlap - 1, -1):
+        if prev.endswith(text[:n]):
+            return n
+    return 0
+
+
+def _adjacent(a: str, b: str) -> bool:
+    """ng12_0012_03 -> ng12_0012_04 (fixed chunks overlap their predecessor)."""
+    ma, mb = _CHUNK_ID.match(a or ""), _CHUNK_ID.match(b or "")
+    return bool(ma and mb and ma.group(1) == mb.group(1) and int(mb.group(2)) == int(ma.group(2)) + 1)
+
+
+def dedupe_overlap(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Strip text a chunk repeats from its neighbour in the same result set; returns (rows, chars removed)."""
+    by_id = {r.get("chunk_id"): r for r in rows}
+    removed = 0
+    out = []
+    for r in rows:
+        text = r.get("text") or ""
+        for cid, other in by_id.items():
+            if other is not r and _adjacent(cid, r.get("chunk_id")):
+                n = _overlap(other.get("text") or "", text)
+                if n:
+                    text = text[n:].lstrip()
+                    removed += n
+                break
+        out.append({**r, "text": text} if text != r.get("text") else r)
+    return out, removed
+
+
+def _dedupe_sentences(rows: List[Dict[str, Any]], units: List[List[str]]) -> Tuple[List[List[str]], int]:
+    """
+    Drop sentences a higher-ranked chunk of the same recommendation(s) already
+    carries. Chunks citing different recommendation numbers are never touched:
+    NG12 repeats identical criteria bullets across recommendations.
+    """
+    seen: Dict[Tuple[frozenset, str], bool] = {}
+    duplicates = 0
+    out: List[List[str]] = []
+    for r, sents in zip(rows, units):
+        recs = frozenset(_REC_NO.findall(r.get("text") or ""))
+        if not recs:
+            out.append(sents)
+            continue
+        kept = []
+        for s in sents:
+            key = (recs, " ".join(s.lower().split()))
+            if len(key[1]) >= _MIN_DEDUPE_CHARS and key in seen:
+                duplicates += 1
+                continue
+            seen[key] = True
+            kept.append(s)
+        out.append(kept)
+    return out, duplicates
+
+
+def pack_evidence(
+    rows: List[Dict[str, Any]], query: str, budget_tokens: int
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Fit retrieved rows (best first) into `budget_tokens`:
+      1. drop the overlap between adjacent fixed chunks (always)
+      2. if over budget, drop sentences repeated within the same recommendation
+      3. if still over budget, keep per chunk its first sentence (recommendation number /
+         lead-in) and its sentences most relevant to `query`, in original order, marking cuts
+    Rows keep chunk_id / page, so citations still resolve. budget_tokens <= 0 disables trimming.
+    """
+    tokens_in = sum(estimate_tokens(r.get("text") or "") for r in rows)
+    rows, overlap_chars = dedupe_overlap(rows)
+
+    units: List[List[str]] = [_sentences(r.get("text") or "") for r in rows]
+    counts = [len(sents) for sents in units]
+    duplicates = 0
+
+    def _total() -> int:
+        return sum(estimate_tokens(s) + 1 for sents in units for s in sents)
+
+    over = budget_tokens > 0 and _total() > budget_tokens
+    if over:
+        units, duplicates = _dedupe_sentences(rows, units)
+        over = _total() > budget_tokens
+    intact = [len(sents) == n for sents, n in zip(units, counts)]
+
+    keep: List[set] = [set(range(len(sents))) for sents in units]
+    if over:
+        q = set(tokenize(query))
+        scored = [
+            (len(q.intersection(tokenize(s))), ci, si)
+            for ci, sents in enumerate(units)
+            for si, s in enumerate(sents)
+        ]
+        best = {}
+        for score, ci, si in scored:
+            if ci not in best or score > best[ci][0]:
+                best[ci] = (score, si)
+
+        # every chunk gets its lead-in + best sentence first, in rank order; then by relevance
+        order = []
+        for ci, sents in enumerate(units):
+            if sents:
+                order.append((ci, 0))
+                if best[ci][1] != 0:
+                    order.append((ci, best[ci][1]))
+        order.extend((ci, si) for _, ci, si in sorted(scored, key=lambda x: (-x[0], x[1], x[2])))
+
+        keep = [set() for _ in units]
+        used = 0
+        for ci, si in order:
+            if si in keep[ci]:
+                continue
+            cost = estimate_tokens(units[ci][si]) + 1
+            if used + cost > budget_tokens:
+                continue
+            keep[ci].add(si)
+            used += cost
+
+    packed: List[Dict[str, Any]] = []
+    for r, sents, kept, whole in zip(rows, units, keep, intact):
+        if not kept:
+            continue
+        if whole and len(kept) == len(sents):
+            packed.append(r)  # untouched: keep the original line layout
+            continue
+        parts = []
+        for si in sorted(kept):
+            if parts and si - 1 not in kept:
+                parts.append(ELLIPSIS)
+            parts.append(sents[si])
+        if max(kept) < len(sents) - 1:
+            parts.append(ELLIPSIS)
+        packed.append({**r, "text": "\n".join(parts)})
+
+    stats = {
+        "budget_tokens": budget_tokens,
+        "evidence_tokens_in": tokens_in,
+        "evidence_tokens": sum(estimate_tokens(r["text"]) for r in packed),
+        "chunks_in": len(rows),
+        "chunks_packed": len(packed),
+        "overlap_chars_removed": overlap_chars,
+        "duplicate_sentences": duplicates,
+        "sentences_dropped": sum(len(s) for s in units) - sum(len(k) for k in keep),
+    }
+    return packed, stats
+
+
+def pack_history(
+    history: List[Dict[str, Any]], budget_tokens: int, max_turns: int = 8
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Most recent turns that fit the budget (oldest dropped first); a turn that
+    only partly fits is cut from the front. Returns (turns, tokens used).
+    """
+    out: List[Dict[str, Any]] = []
+    used = 0
+    for m in reversed(history[-max_turns:] if max_turns > 0 else []):
+        content = m.get("content") or ""
+        cost = estimate_tokens(content) + 2  # role label
+        if budget_tokens > 0 and used + cost > budget_tokens:
+            room = int((budget_tokens - used - 2) * CHARS_PER_TOKEN) - 1
+            if room >= 80:
+                out.append({**m, "content": "…" + content[-room:]})
+                used += estimate_tokens(out[-1]["content"]) + 2
+            break
+        out.append(m)
+        used += cost
+    out.reverse()
+    return out, used
+
+
+def prompt_token_stats(prompt: str, evidence: Optional[Dict[str, int]] = None, **extra: int) -> Dict[str, Any]:
+    """debug payload: estimated prompt size plus the packer's evidence stats."""
+    stats: Dict[str, Any] = {"prompt_tokens": estimate_tokens(prompt)}
+    stats.update(extra)
+    if evidence is not None:
+        stats["evidence"] = evidence
+    return stats
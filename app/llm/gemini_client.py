@@ -1,5 +1,5 @@
-import json
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple
 
 from google import genai
 from google.genai.types import (
@@ -10,12 +10,161 @@ from google.genai.types import (
     GenerateContentConfig,
 )
 
+from app.concurrency import run_blocking
 from app.config import settings
+from app.llm.embedding_cache import EmbeddingCache, get_embedding_cache
+from app.llm.embed_batcher import EmbeddingBatcher
+from app.llm.call_policy import CallPolicy, get_call_policy
+from app.llm.structured import agenerate_validated, generate_validated, parse_json_output, schema_hint
+from app.llm.context_cache import ContextCacheManager, get_context_cache, is_stale_handle_error, with_context
+from app.metrics import instrumented, record_text, record_usage
+
+
+# ==========================
+# Request / response helpers (shared by sync + async clients)
+# ==========================
+def _tool_call_request(patient_id: str, tool_func_name: str) -> Tuple[str, GenerateContentConfig]:
+    fd = FunctionDeclaration(
+        name=tool_func_name,
+        description="Fetch patient record by patient_id",
+        parameters=Schema(
+            type=Type.OBJECT,
+            properties={
+                "patient_id": Schema(
+                    type=Type.STRING,
+                    description="Patient ID like PT-101"
+                ),
+            },
+            required=["patient_id"],
+        ),
+    )
+
+    tools = [Tool(function_declarations=[fd])]
+
+    prompt = f"""
+You are a clinical decision support agent.
+You must retrieve the patient record first by calling `{tool_func_name}`.
+
+Patient ID: {patient_id}
+
+Call the tool now.
+""".strip()
+
+    return prompt, GenerateContentConfig(tools=tools)
+
+
+def _parse_tool_call(resp, patient_id: str, tool_func_name: str) -> Dict[str, Any]:
+    # Extract function call safely
+    cand = resp.candidates[0]
+    parts = cand.content.parts
+
+    for p in parts:
+        if getattr(p, "function_call", None):
+            return {
+                "name": p.function_call.name,
+                "args": dict(p.function_call.args or {})
+            }
+
+    # fallback
+    return {"name": tool_func_name, "args": {"patient_id": patient_id}}
+
+
+def _json_prompt(system: str, user: str) -> str:
+    return f"""
+SYSTEM:
+{system}
+
+USER:
+{user}
+"""
+
+
+def _json_request(
+    system: str,
+    user: str,
+    schema: Optional[Dict[str, Any]],
+    temperature: Optional[float],
+    context: Optional[str] = None,
+    cached: Optional[str] = None,
+) -> Tuple[str, Optional[GenerateContentConfig]]:
+    """
+    (contents, config) for a JSON call. With STRUCTURED_OUTPUT the system prompt
+    goes in `system_instruction` and the API enforces `schema`; otherwise both
+    are folded into the prompt text. `context` (evidence) precedes `user`, or is
+    served from the `cached` context cache together with the system prompt.
+    """
+    if settings.structured_output:
+        if cached is not None:
+            return user, GenerateContentConfig(
+                cached_content=cached,
+                response_mime_type="application/json",
+                response_schema=schema,
+                temperature=temperature,
+            )
+        return with_context(context, user), GenerateContentConfig(
+            system_instruction=system,
+            response_mime_type="application/json",
+            response_schema=schema,
+            temperature=temperature,
+        )
+    if schema is not None:
+        system = f"{system}\n\n{schema_hint(schema)}"
+    config = GenerateContentConfig(temperature=temperature) if temperature is not None else None
+    return _json_prompt(system, with_context(context, user)), config
+
+
+def _stream_request(
+    prompt: str,
+    system: Optional[str],
+    schema: Optional[Dict[str, Any]],
+    context: Optional[str] = None,
+    cached: Optional[str] = None,
+) -> Tuple[str, GenerateContentConfig]:
+    if system is None and schema is None:
+        return with_context(context, prompt), _TEXT_CONFIG
+    return _json_request(system or "", prompt, schema, _TEXT_CONFIG.temperature, context, cached)
+
+
+def _sent_text(contents: str, config: Optional[GenerateContentConfig]) -> str:
+    # what the prompt-size metrics should count: system instruction + contents
+    # (a cached prefix is not sent)
+    system = config.system_instruction if config is not None else None
+    return f"{system}\n{contents}" if isinstance(system, str) else contents
+
+
+def parse_json_text(text: str) -> Dict[str, Any]:
+    obj = parse_json_output(text)
+    if isinstance(obj, dict):
+        return obj
+    return {
+        "error": "Model did not return valid JSON",
+        "raw": text
+    }
+
+
+_TEXT_CONFIG = GenerateContentConfig(temperature=0.2)
+
+
+def make_genai_client() -> genai.Client:
+    """
+    genai.Client whose HTTP timeout matches the call policy, so a hung
+    connection also frees the thread the policy stopped waiting on.
+    """
+    timeout_s = max(settings.gemini_timeout_s, settings.gemini_embed_timeout_s)
+    return genai.Client(http_options={"timeout": int(timeout_s * 1000)} if timeout_s > 0 else None)
 
 
 class GeminiClient:
 
-    def __init__(self):
+    def __init__(
+        self,
+        embed_cache: Optional[EmbeddingCache] = None,
+        client: Optional[genai.Client] = None,
+        embed_policy: Optional[CallPolicy] = None,
+        gen_policy: Optional[CallPolicy] = None,
+        context_cache: Optional[ContextCacheManager] = None,
+        embed_batcher: Optional[EmbeddingBatcher] = None,
+    ):
         """
         Vertex AI Gemini client wrapper.
 
@@ -23,139 +172,351 @@ class GeminiClient:
         GOOGLE_GENAI_USE_VERTEXAI=True
         GOOGLE_CLOUD_PROJECT=<project-id>
         GOOGLE_CLOUD_LOCATION=<region>
+
+        Every call goes through the shared call policies (timeouts, retries,
+        hedging, concurrency limit, circuit breaker; see app/llm/call_policy.py).
+        Static prompt prefixes are served from the shared context cache
+        (app/llm/context_cache.py) when CONTEXT_CACHE is on. Concurrent
+        `embed_query` misses are coalesced by this client's `embed_batcher`.
         """
-        self.client = genai.Client()
+        self.client = client or make_genai_client()
         self.gen_model = settings.gen_model
         self.embed_model = settings.embed_model
+        self.embed_cache = embed_cache or get_embedding_cache()
+        self.embed_policy = embed_policy or get_call_policy("gemini.embed")
+        self.gen_policy = gen_policy or get_call_policy("gemini.generate")
+        self.context_cache = context_cache if context_cache is not None else get_context_cache(self.client)
+        self.embed_batcher = embed_batcher or EmbeddingBatcher.from_settings(self.embed_texts)
 
     # ==========================
     # Embeddings
     # ==========================
+    @instrumented("gemini.embed_texts")
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """
         Generate embeddings using Vertex AI embedding model.
         """
 
-        res = self.client.models.embed_content(
+        res = self.embed_policy.call(
+            self.client.models.embed_content,
             model=self.embed_model,
             contents=texts
         )
 
         return [e.values for e in res.embeddings]
 
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single retrieval query, going through the shared embedding cache.
+        Cache misses are coalesced with other in-flight queries by the micro-batcher.
+        """
+
+        vec = self.embed_cache.get(self.embed_model, text)
+        if vec is None:
+            if settings.embed_batch_max > 1:
+                vec = self.embed_batcher.embed(text)
+            else:
+                vec = self.embed_texts([text])[0]
+            self.embed_cache.put(self.embed_model, text, vec)
+        return vec
+
     # ==========================
     # Tool Calling
     # ==========================
+    @instrumented("gemini.tool_call")
     def tool_call_get_patient(self, patient_id: str, tool_func_name: str = "get_patient") -> Dict[str, Any]:
         """
         Ask Gemini to call the get_patient tool.
         """
 
-        fd = FunctionDeclaration(
-            name=tool_func_name,
-            description="Fetch patient record by patient_id",
-            parameters=Schema(
-                type=Type.OBJECT,
-                properties={
-                    "patient_id": Schema(
-                        type=Type.STRING,
-                        description="Patient ID like PT-101"
-                    ),
-                },
-                required=["patient_id"],
-            ),
-        )
+        prompt, config = _tool_call_request(patient_id, tool_func_name)
 
-        tools = [Tool(function_declarations=[fd])]
-
-        prompt = f"""
-You are a clinical decision support agent.
-You must retrieve the patient record first by calling `{tool_func_name}`.
+        resp = self.gen_policy.call(
+            self.client.models.generate_content,
+            model=self.gen_model,
+            contents=prompt,
+            config=config,
+        )
+        record_usage("tool_call", resp)
 
-Patient ID: {patient_id}
+        return _parse_tool_call(resp, patient_id, tool_func_name)
 
-Call the tool now.
-""".strip()
+    # ==========================
+    # JSON Generation
+    # ==========================
+    def _cached_prefix(self, system: Optional[str], context: Optional[str]) -> Optional[str]:
+        if system is None or self.context_cache is None or not settings.structured_output:
+            return None
+        return self.context_cache.handle(system, context)
 
-        resp = self.client.models.generate_content(
+    def _generate_content(self, contents: str, config: Optional[GenerateContentConfig]):
+        return self.gen_policy.call(
+            self.client.models.generate_content,
             model=self.gen_model,
-            contents=prompt,
-            config=GenerateContentConfig(tools=tools),
+            contents=contents,
+            config=config
         )
 
-        # Extract function call safely
-        cand = resp.candidates[0]
-        parts = cand.content.parts
+    @instrumented("gemini.generate_json")
+    def generate_json(
+        self,
+        system: str,
+        user: str,
+        schema: Optional[Dict[str, Any]] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Force Gemini to return JSON (matching `schema`, see app/llm/structured.py).
+        Unparseable or off-schema output gets a bounded repair call; after that
+        the result is {"error", "raw"}. `context` is the evidence block sent
+        before `user`; system + context is the prefix the context cache can serve.
+        """
 
-        for p in parts:
-            if getattr(p, "function_call", None):
-                return {
-                    "name": p.function_call.name,
-                    "args": dict(p.function_call.args or {})
-                }
+        def _call(sys_prompt: str, user_prompt: str) -> str:
+            first = sys_prompt == system  # repair calls carry their own input, uncached
+            ctx = context if first else None
+            cached = self._cached_prefix(sys_prompt, ctx) if first else None
+            contents, config = _json_request(sys_prompt, user_prompt, schema, temperature, ctx, cached)
+            try:
+                resp = self._generate_content(contents, config)
+            except Exception as e:
+                if cached is None or not is_stale_handle_error(e):
+                    raise
+                self.context_cache.invalidate(cached)
+                contents, config = _json_request(sys_prompt, user_prompt, schema, temperature, ctx)
+                resp = self._generate_content(contents, config)
+            record_usage("generate_json", resp)
+            record_text("generate_json", _sent_text(contents, config), resp.text or "")
+            return resp.text or ""
 
-        # fallback
-        return {"name": tool_func_name, "args": {"patient_id": patient_id}}
+        return generate_validated(_call, system, user, schema)
 
     # ==========================
-    # JSON Generation
+    # ⭐ NEW — TEXT GENERATION
     # ==========================
-    def generate_json(self, system: str, user: str) -> Dict[str, Any]:
+    @instrumented("gemini.generate")
+    def generate(self, prompt: str) -> str:
         """
-        Force Gemini to return JSON.
+        Generic text generation helper.
+        Used by Chat Agent & Reasoning Agent.
         """
 
-        content = f"""
-SYSTEM:
-{system}
+        resp = self.gen_policy.call(
+            self.client.models.generate_content,
+            model=self.gen_model,
+            contents=prompt,
+            config=_TEXT_CONFIG
+        )
+        record_usage("generate", resp)
+        record_text("generate", prompt, resp.text or "")
 
-USER:
-{user}
-"""
+        return resp.text or ""
 
-        resp = self.client.models.generate_content(
+    def _stream(self, contents: str, config: GenerateContentConfig) -> Iterator[str]:
+        for chunk in self.client.models.generate_content_stream(
             model=self.gen_model,
-            contents=content
-        )
+            contents=contents,
+            config=config
+        ):
+            if chunk.text:
+                yield chunk.text
 
-        text = resp.text or ""
+    @instrumented("gemini.generate_stream")
+    def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        context: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Same as `generate`, yielding text deltas as the model produces them;
+        with `system`/`schema` the stream is structured JSON like `generate_json`.
+        Only the circuit breaker applies (`breaker.guard`): a stream cannot be
+        retried once it has yielded, and its length has no sensible deadline.
+        """
+        cached = self._cached_prefix(system, context)
+        with self.gen_policy.breaker.guard() as succeeded:
+            started = False
+            try:
+                for text in self._stream(*_stream_request(prompt, system, schema, context, cached)):
+                    if not started:
+                        started = True
+                        succeeded()
+                    yield text
+            except Exception as e:
+                if started or cached is None or not is_stale_handle_error(e):
+                    raise
+                self.context_cache.invalidate(cached)
+                yield from self._stream(*_stream_request(prompt, system, schema, context))
 
-        # Strict JSON parse
-        try:
-            return json.loads(text)
-        except Exception:
-            pass
 
-        # Extract JSON block
-        start = text.find("{")
-        end = text.rfind("}")
+class AsyncGeminiClient:
+    """
+    Async twin of GeminiClient built on `client.aio`.
+    Same method names and return shapes, but every call is awaitable and does
+    not hold a threadpool thread while waiting on Vertex AI.
+    """
 
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start:end + 1])
-            except Exception:
-                pass
+    def __init__(
+        self,
+        embed_cache: Optional[EmbeddingCache] = None,
+        client: Optional[genai.Client] = None,
+        embed_policy: Optional[CallPolicy] = None,
+        gen_policy: Optional[CallPolicy] = None,
+        context_cache: Optional[ContextCacheManager] = None,
+        embed_batcher: Optional[EmbeddingBatcher] = None,
+    ):
+        self.client = client or make_genai_client()
+        self.gen_model = settings.gen_model
+        self.embed_model = settings.embed_model
+        self.embed_cache = embed_cache or get_embedding_cache()
+        self.embed_policy = embed_policy or get_call_policy("gemini.embed")
+        self.gen_policy = gen_policy or get_call_policy("gemini.generate")
+        self.context_cache = context_cache if context_cache is not None else get_context_cache(self.client)
+        self.embed_batcher = embed_batcher or EmbeddingBatcher.from_settings(self._embed_texts_sync)
 
-        return {
-            "error": "Model did not return valid JSON",
-            "raw": text
-        }
+    @instrumented("gemini.embed_texts")
+    def _embed_texts_sync(self, texts: List[str]) -> List[List[float]]:
+        # runs on the batcher's dispatch threads
+        res = self.embed_policy.call(self.client.models.embed_content, model=self.embed_model, contents=texts)
+        return [e.values for e in res.embeddings]
 
     # ==========================
-    # ⭐ NEW — TEXT GENERATION
+    # Embeddings
     # ==========================
-    def generate(self, prompt: str) -> str:
-        """
-        Generic text generation helper.
-        Used by Chat Agent & Reasoning Agent.
-        """
+    @instrumented("gemini.embed_texts")
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        res = await self.embed_policy.acall(
+            self.client.aio.models.embed_content,
+            model=self.embed_model,
+            contents=texts
+        )
+        return [e.values for e in res.embeddings]
+
+    async def embed_query(self, text: str) -> List[float]:
+        # a persistent cache is SQLite I/O: keep it off the event loop
+        offload = self.embed_cache.persistent
+        if offload:
+            vec = await run_blocking(self.embed_cache.get, self.embed_model, text)
+        else:
+            vec = self.embed_cache.get(self.embed_model, text)
+        if vec is None:
+            if settings.embed_batch_max > 1:
+                # shield so one cancelled request does not cancel the Future
+                # other (deduped) callers wait on
+                fut = self.embed_batcher.submit(text)
+                vec = await asyncio.shield(asyncio.wrap_future(fut))
+            else:
+                vec = (await self.embed_texts([text]))[0]
+            if offload:
+                await run_blocking(self.embed_cache.put, self.embed_model, text, vec)
+            else:
+                self.embed_cache.put(self.embed_model, text, vec)
+        return vec
 
-        resp = self.client.models.generate_content(
+    # ==========================
+    # Tool Calling
+    # ==========================
+    @instrumented("gemini.tool_call")
+    async def tool_call_get_patient(self, patient_id: str, tool_func_name: str = "get_patient") -> Dict[str, Any]:
+        prompt, config = _tool_call_request(patient_id, tool_func_name)
+        resp = await self.gen_policy.acall(
+            self.client.aio.models.generate_content,
             model=self.gen_model,
             contents=prompt,
-            config=GenerateContentConfig(
-                temperature=0.2
-            )
+            config=config,
+        )
+        record_usage("tool_call", resp)
+        return _parse_tool_call(resp, patient_id, tool_func_name)
+
+    # ==========================
+    # Generation
+    # ==========================
+    async def _cached_prefix(self, system: Optional[str], context: Optional[str]) -> Optional[str]:
+        if system is None or self.context_cache is None or not settings.structured_output:
+            return None
+        return await self.context_cache.ahandle(system, context)
+
+    async def _generate_content(self, contents: str, config: Optional[GenerateContentConfig]):
+        return await self.gen_policy.acall(
+            self.client.aio.models.generate_content,
+            model=self.gen_model,
+            contents=contents,
+            config=config
         )
 
+    @instrumented("gemini.generate_json")
+    async def generate_json(
+        self,
+        system: str,
+        user: str,
+        schema: Optional[Dict[str, Any]] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        async def _call(sys_prompt: str, user_prompt: str) -> str:
+            first = sys_prompt == system
+            ctx = context if first else None
+            cached = await self._cached_prefix(sys_prompt, ctx) if first else None
+            contents, config = _json_request(sys_prompt, user_prompt, schema, temperature, ctx, cached)
+            try:
+                resp = await self._generate_content(contents, config)
+            except Exception as e:
+                if cached is None or not is_stale_handle_error(e):
+                    raise
+                self.context_cache.invalidate(cached)
+                contents, config = _json_request(sys_prompt, user_prompt, schema, temperature, ctx)
+                resp = await self._generate_content(contents, config)
+            record_usage("generate_json", resp)
+            record_text("generate_json", _sent_text(contents, config), resp.text or "")
+            return resp.text or ""
+
+        return await agenerate_validated(_call, system, user, schema)
+
+    @instrumented("gemini.generate")
+    async def generate(self, prompt: str) -> str:
+        resp = await self.gen_policy.acall(
+            self.client.aio.models.generate_content,
+            model=self.gen_model,
+            contents=prompt,
+            config=_TEXT_CONFIG
+        )
+        record_usage("generate", resp)
+        record_text("generate", prompt, resp.text or "")
         return resp.text or ""
+
+    async def _stream(self, contents: str, config: GenerateContentConfig) -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.gen_model,
+            contents=contents,
+            config=config
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+    @instrumented("gemini.generate_stream")
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        cached = await self._cached_prefix(system, context)
+        with self.gen_policy.breaker.guard() as succeeded:
+            started = False
+            try:
+                async for text in self._stream(*_stream_request(prompt, system, schema, context, cached)):
+                    if not started:
+                        started = True
+                        succeeded()
+                    yield text
+            except Exception as e:
+                if started or cached is None or not is_stale_handle_error(e):
+                    raise
+                self.context_cache.invalidate(cached)
+                async for text in self._stream(*_stream_request(prompt, system, schema, context)):
+                    yield text
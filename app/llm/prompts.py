@@ -6,16 +6,4 @@ Your job:
 - If evidence is weak or missing, choose INSUFFICIENT_EVIDENCE.
 - Do not invent thresholds, durations, ages, tests, or criteria.
 - Always attach citations pointing to the evidence snippets by page and chunk_id.
-
-Return STRICT JSON in this schema:
-{
-  "patient_id": "...",
-  "decision": "URGENT_REFERRAL|URGENT_INVESTIGATION|NOT_MET|INSUFFICIENT_EVIDENCE",
-  "confidence": 0.0-1.0,
-  "summary": "1-2 lines",
-  "reasoning": "Short human explanation",
-  "citations": [
-    {"source":"NG12 PDF","page":123,"chunk_id":"ng12_0123_04","excerpt":"..."}
-  ]
-}
 """.strip()
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+from app.metrics import cache_collector, metrics
+from app.models import AssessmentResponse, Patient
+
+
+def assessment_key(patient: Patient, top_k: int, model: str, index_version: str) -> str:
+    h = hashlib.sha256()
+    for part in (patient.model_dump_json(), str(top_k), model, index_version):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class AssessmentCache:
+    """
+    Cache of final AssessmentResponses keyed on
+    (patient content, top_k, generation model, NG12 index version).
+
+    Two tiers: an in-memory LRU (`max_entries`) and an optional SQLite file
+    (`path`) shared across workers/restarts. Entries expire after `ttl_s`
+    (<= 0 disables expiry). When a lookup arrives with a new index version
+    (the guideline was re-ingested) every entry built on an older index is dropped.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 0.0, path: str = ""):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS assessments ("
+                " key TEXT PRIMARY KEY, index_version TEXT NOT NULL, created REAL NOT NULL, body TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_s > 0 and now - created > self.ttl_s
+
+    def _check_version(self, index_version: str) -> None:
+        # caller holds the lock
+        if index_version == self._version:
+            return
+        if self._version is not None:
+            self._mem.clear()
+            self.invalidations += 1
+        if self._db is not None:
+            self._db.execute("DELETE FROM assessments WHERE index_version != ?", (index_version,))
+            self._db.commit()
+        self._version = index_version
+
+    def _remember(self, key: str, created: float, body: str) -> None:
+        # caller holds the lock
+        self._mem[key] = (created, body)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str, index_version: str) -> Optional[AssessmentResponse]:
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+
+            item = self._mem.get(key)
+            if item is not None and self._expired(item[0], now):
+                del self._mem[key]
+                item = None
+            if item is not None:
+                self._mem.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, body FROM assessments WHERE key = ? AND index_version = ?",
+                    (key, index_version),
+                ).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    item = (row[0], row[1])
+                    self._remember(key, row[0], row[1])
+
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            body = item[1]
+
+        # fresh object per hit so callers can annotate debug freely
+        return AssessmentResponse.model_validate_json(body)
+
+    def put(self, key: str, index_version: str, response: AssessmentResponse) -> None:
+        debug = dict(response.debug or {})
+        debug.pop("timings_ms", None)
+        body = response.model_copy(update={"debug": debug}).model_dump_json()
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            self._remember(key, now, body)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO assessments (key, index_version, created, body) VALUES (?, ?, ?, ?)",
+                    (key, index_version, now, body),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM assessments")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._mem),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_shared_cache: Optional[AssessmentCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_assessment_cache() -> Optional[AssessmentCache]:
+    """Process-wide assessment cache, or None when ASSESS_CACHE_SIZE=0."""
+    global _shared_cache
+    if settings.assess_cache_size <= 0:
+        return None
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = AssessmentCache(
+                    max_entries=settings.assess_cache_size,
+                    ttl_s=settings.assess_cache_ttl_s,
+                    path=settings.assess_cache_path,
+                )
+                metrics.add_collector("assessment_cache", cache_collector("assessment", _shared_cache))
+    return _shared_cache
@@ -0,0 +1,225 @@
+"""
+Structured (JSON) model output shared by the assessor and the chat agent.
+
+  response_schema   Gemini response schema derived from a pydantic model
+                    (AssessmentResponse, ChatResponse): required fields only, so
+                    server-side fields (debug, patient_id, session_id, source) cost no output tokens
+  parse_json_output one fast parser: json.loads, then fenced / embedded-object fallbacks
+  generate_validated  parse + check against the schema; on failure at most
+                    JSON_REPAIR_ATTEMPTS cheap repair calls instead of a silent fallback
+
+With STRUCTURED_OUTPUT=True (default) the schema is enforced by the API
+(`response_schema` + `system_instruction`); otherwise a compact schema hint is
+appended to the system prompt.
+"""
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Type
+
+from pydantic import BaseModel
+
+from app.config import settings
+from app.metrics import metrics
+from app.models import AssessmentResponse
+from app.models_chat import ChatResponse
+
+_TYPES = {"string": "STRING", "number": "NUMBER", "integer": "INTEGER", "boolean": "BOOLEAN",
+          "array": "ARRAY", "object": "OBJECT"}
+
+REPAIR_SYSTEM_PROMPT = """You repair model output that should have been JSON.
+Keep the content; fix the syntax and add any missing required field.
+Return ONLY the corrected JSON object."""
+
+_REPAIR_RAW_CHARS = 6000
+
+
+# ==========================
+# Schemas
+# ==========================
+def _convert(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in node:
+        node = defs[node["$ref"].rsplit("/", 1)[-1]]
+    out: Dict[str, Any] = {"type": _TYPES[node.get("type", "string")]}
+    if "enum" in node:
+        out["enum"] = list(node["enum"])
+    for key in ("minimum", "maximum"):
+        if key in node:
+            out[key] = node[key]
+    if out["type"] == "ARRAY":
+        out["items"] = _convert(node.get("items", {}), defs)
+    if out["type"] == "OBJECT" and "properties" in node:
+        required = [name for name in node["properties"] if name in node.get("required", [])]
+        out["properties"] = {name: _convert(node["properties"][name], defs) for name in required}
+        out["required"] = required
+        out["property_ordering"] = required
+    return out
+
+
+def response_schema(model: Type[BaseModel], exclude: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Gemini response schema (dict form of google.genai.types.Schema) for the
+    model's required fields, nested models inlined, `exclude` dropped at the top level.
+    """
+    js = model.model_json_schema()
+    schema = _convert(js, js.get("$defs", {}))
+    keep = [name for name in schema["required"] if name not in exclude]
+    schema["properties"] = {name: schema["properties"][name] for name in keep}
+    schema["required"] = keep
+    schema["property_ordering"] = keep
+    return schema
+
+
+# patient_id is known server-side: the model starts with the decision
+ASSESSMENT_SCHEMA = response_schema(AssessmentResponse, exclude=("patient_id",))
+CHAT_ANSWER_SCHEMA = response_schema(ChatResponse, exclude=("session_id",))
+
+
+def _example(schema: Dict[str, Any]) -> Any:
+    kind = schema["type"]
+    if kind == "OBJECT":
+        return {name: _example(sub) for name, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [_example(schema["items"])]
+    if "enum" in schema:
+        return "|".join(schema["enum"])
+    if "minimum" in schema or "maximum" in schema:
+        return f"{kind.lower()} {schema.get('minimum', '')}-{schema.get('maximum', '')}"
+    return kind.lower()
+
+
+def schema_hint(schema: Dict[str, Any]) -> str:
+    """Prompt text for backends without schema enforcement."""
+    return "Return STRICT JSON ONLY (no markdown) in this shape:\n" + json.dumps(_example(schema))
+
+
+def schema_errors(obj: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Type / required / enum / range violations (first few), [] when `obj` fits."""
+    kind = schema["type"]
+    if kind == "OBJECT":
+        if not isinstance(obj, dict):
+            return [f"{path}: expected an object"]
+        errors = [f"{path}.{name}: missing" for name in schema.get("required", []) if name not in obj]
+        for name, sub in schema.get("properties", {}).items():
+            if name in obj:
+                errors += schema_errors(obj[name], sub, f"{path}.{name}")
+        return errors[:5]
+    if kind == "ARRAY":
+        if not isinstance(obj, list):
+            return [f"{path}: expected an array"]
+        errors: List[str] = []
+        for i, item in enumerate(obj):
+            errors += schema_errors(item, schema["items"], f"{path}[{i}]")
+        return errors[:5]
+    if kind in ("NUMBER", "INTEGER"):
+        if isinstance(obj, bool) or not isinstance(obj, (int, float)):
+            return [f"{path}: expected a number"]
+        if obj < schema.get("minimum", obj) or obj > schema.get("maximum", obj):
+            return [f"{path}: {obj} out of range"]
+        return []
+    if kind == "BOOLEAN":
+        return [] if isinstance(obj, bool) else [f"{path}: expected a boolean"]
+    if not isinstance(obj, str):
+        return [f"{path}: expected a string"]
+    if "enum" in schema and obj not in schema["enum"]:
+        return [f"{path}: {obj!r} not one of {schema['enum']}"]
+    return []
+
+
+# ==========================
+# Parsing
+# ==========================
+def parse_json_output(text: str) -> Optional[Any]:
+    """The JSON value in a model reply, or None. Tolerates ```json fences and prose around one object."""
+    clean = (text or "").strip()
+    try:
+        return json.loads(clean)
+    except ValueError:
+        pass
+    if clean.startswith("```"):
+        clean = clean.split("\n", 1)[-1] if "\n" in clean else clean[3:]
+        clean = clean.rsplit("```", 1)[0].strip()
+        try:
+            return json.loads(clean)
+        except ValueError:
+            pass
+    start, end = clean.find("{"), clean.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return json.loads(clean[start:end + 1])
+        except ValueError:
+            pass
+    return None
+
+
+def _check(raw: str, schema: Optional[Dict[str, Any]]):
+    obj = parse_json_output(raw)
+    if obj is None:
+        return None, ["not valid JSON"]
+    if schema is None:
+        return (obj, []) if isinstance(obj, dict) else (None, ["expected a JSON object"])
+    return obj, schema_errors(obj, schema)
+
+
+def _repair_prompt(raw: str, errors: List[str]) -> str:
+    return f"Problems: {'; '.join(errors)}\n\nOutput to repair:\n{raw[:_REPAIR_RAW_CHARS]}"
+
+
+def _failed(op: str, raw: str, errors: List[str]) -> Dict[str, Any]:
+    metrics.inc("ng12_json_outputs_total", op=op, outcome="failed")
+    return {"error": f"Model did not return valid JSON ({'; '.join(errors)})", "raw": raw}
+
+
+def generate_validated(
+    call: Callable[[str, str], str],
+    system: str,
+    user: str,
+    schema: Optional[Dict[str, Any]] = None,
+    op: str = "generate_json",
+    repair_attempts: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    `call(system, user) -> raw text`, parsed and checked against `schema`.
+    Returns the object, or {"error", "raw"} once the repair attempts are used up.
+    """
+    attempts = settings.json_repair_attempts if repair_attempts is None else repair_attempts
+    raw = call(system, user)
+    obj, errors = _check(raw, schema)
+    for _ in range(max(0, attempts)):
+        if not errors:
+            break
+        raw = call(REPAIR_SYSTEM_PROMPT, _repair_prompt(raw, errors))
+        obj, errors = _check(raw, schema)
+        if not errors:
+            metrics.inc("ng12_json_outputs_total", op=op, outcome="repaired")
+            return obj
+    if errors:
+        return _failed(op, raw, errors)
+    metrics.inc("ng12_json_outputs_total", op=op, outcome="ok")
+    return obj
+
+
+async def agenerate_validated(
+    call: Callable[[str, str], Awaitable[str]],
+    system: str,
+    user: str,
+    schema: Optional[Dict[str, Any]] = None,
+    op: str = "generate_json",
+    repair_attempts: Optional[int] = None,
+) -> Dict[str, Any]:
+    attempts = settings.json_repair_attempts if repair_attempts is None else repair_attempts
+    raw = await call(system, user)
+    obj, errors = _check(raw, schema)
+    for _ in range(max(0, attempts)):
+        if not errors:
+            break
+        raw = await call(REPAIR_SYSTEM_PROMPT, _repair_prompt(raw, errors))
+        obj, errors = _check(raw, schema)
+        if not errors:
+            metrics.inc("ng12_json_outputs_total", op=op, outcome="repaired")
+            return obj
+    if errors:
+        return _failed(op, raw, errors)
+    metrics.inc("ng12_json_outputs_total", op=op, outcome="ok")
+    return obj
+
+
+metrics.describe("ng12_json_outputs_total", "Structured model outputs by outcome (ok / repaired / failed).")
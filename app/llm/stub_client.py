@@ -0,0 +1,430 @@
+"""
+Offline stand-ins for GeminiClient / VectorStore.
+
+Deterministic, dependency-free and network-free, so batch runs and benchmarks
+(app/bench.py) can exercise ingestion and the full assess/chat pipeline without
+Vertex AI or a Chroma index.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from app.llm.context_cache import with_context
+from app.llm.structured import agenerate_validated, generate_validated
+
+_CHUNK_REF = re.compile(r"\[(ng12_\d{4}_\d{2}) \| p\.(-?\d+)\]")
+_PATIENT_ID = re.compile(r'"patient_id"\s*:\s*"([^"]+)"')
+_TURN = re.compile(r"^(USER|ASSISTANT): (.*)$", re.MULTILINE)
+_DECISIONS = ("URGENT_REFERRAL", "URGENT_INVESTIGATION", "NOT_MET", "INSUFFICIENT_EVIDENCE")
+
+
+def stub_embedding(text: str, dim: int = 64) -> List[float]:
+    """Unit vector seeded from the text hash: same text -> same vector."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class StubServiceError(Exception):
+    """Injected backend fault; `code` mirrors google.genai.errors.APIError (503 = retryable)."""
+
+    def __init__(self, kind: str, code: int = 503):
+        super().__init__(f"{code} stub fault in {kind}")
+        self.code = code
+
+
+def _digest_int(text: str) -> int:
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "big")
+
+
+class StubGeminiClient:
+    """
+    GeminiClient-compatible fake: hash-seeded embeddings, canned JSON answers
+    that cite the evidence found in the prompt, injected latency per call.
+
+    `latency_ms` applies to every call kind unless `op_latency_ms` overrides it
+    (e.g. {"generate_json": 400, "embed": 40}); `jitter_ms` adds a uniform
+    0..jitter delay drawn from a `seed`ed RNG.
+
+    Fault injection: a fraction `error_rate` of calls raise StubServiceError
+    (HTTP 503) after their latency; a fraction `slow_rate` stall for an extra
+    `slow_ms` (a hung backend, for deadlines / hedging). A fraction
+    `malformed_rate` of JSON replies come back fenced and truncated, which
+    exercises the structured-output repair path (app/llm/structured.py).
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        dim: int = 64,
+        op_latency_ms: Optional[Dict[str, float]] = None,
+        jitter_ms: float = 0.0,
+        seed: int = 0,
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        malformed_rate: float = 0.0,
+    ):
+        self.latency_ms = max(0.0, latency_ms)
+        self.op_latency_ms = {k: max(0.0, v) for k, v in (op_latency_ms or {}).items()}
+        self.jitter_ms = max(0.0, jitter_ms)
+        self._rng = random.Random(seed)
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = max(0.0, slow_ms)
+        self.malformed_rate = malformed_rate
+        self.faults = 0
+        self.malformed = 0
+        self.dim = dim
+        self.gen_model = "stub-gen"
+        self.embed_model = "stub-embed"
+        self.calls: Dict[str, int] = {"embed": 0, "tool_call": 0, "generate_json": 0, "generate": 0}
+
+    def delay_s(self, kind: str) -> float:
+        """Counts the call and returns the latency to inject for it."""
+        self.calls[kind] += 1
+        ms = self.op_latency_ms.get(kind, self.latency_ms)
+        if self.jitter_ms:
+            ms += self._rng.uniform(0.0, self.jitter_ms)
+        if self.slow_rate and self._rng.random() < self.slow_rate:
+            ms += self.slow_ms
+        return ms / 1000.0
+
+    def check_fault(self, kind: str) -> None:
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.faults += 1
+            raise StubServiceError(kind)
+
+    def json_text(self, user: str, schema: Optional[Dict[str, Any]]) -> str:
+        """Raw model text for a JSON call (repair calls included: ids are re-read from the broken output)."""
+        text = json.dumps(canned_json(user, schema))
+        if self.malformed_rate and self._rng.random() < self.malformed_rate:
+            self.malformed += 1
+            return "```json\n" + text[:len(text) // 2]
+        return text
+
+    def _wait(self, kind: str) -> None:
+        delay = self.delay_s(kind)
+        if delay:
+            time.sleep(delay)
+        self.check_fault(kind)
+
+    # ---- embeddings
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        self._wait("embed")
+        return [stub_embedding(t, self.dim) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_texts([text])[0]
+
+    # ---- tool calling
+    def tool_call_get_patient(self, patient_id: str, tool_func_name: str = "get_patient") -> Dict[str, Any]:
+        self._wait("tool_call")
+        return {"name": tool_func_name, "args": {"patient_id": patient_id}}
+
+    # ---- generation
+    def generate_json(
+        self,
+        system: str,
+        user: str,
+        schema: Optional[Dict[str, Any]] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        def _call(sys_prompt: str, user_prompt: str) -> str:
+            self._wait("generate_json")
+            prompt = with_context(context, user_prompt) if sys_prompt == system else user_prompt
+            return self.json_text(prompt, schema)
+
+        return generate_validated(_call, system, user, schema)
+
+    def generate(self, prompt: str) -> str:
+        self._wait("generate")
+        return json.dumps(canned_text(prompt))
+
+    def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        context: Optional[str] = None,
+    ) -> Iterator[str]:
+        # latency is paid once, before the first piece (time to first token)
+        self._wait("generate")
+        yield from _pieces(json.dumps(canned_chat_answer(with_context(context, prompt))))
+
+
+class AsyncStubGeminiClient:
+    """Async twin of StubGeminiClient (latency via asyncio.sleep)."""
+
+    def __init__(self, sync: StubGeminiClient):
+        self.sync = sync
+        self.gen_model = sync.gen_model
+        self.embed_model = sync.embed_model
+
+    async def _wait(self, kind: str) -> None:
+        delay = self.sync.delay_s(kind)
+        if delay:
+            await asyncio.sleep(delay)
+        self.sync.check_fault(kind)
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        await self._wait("embed")
+        return [stub_embedding(t, self.sync.dim) for t in texts]
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed_texts([text]))[0]
+
+    async def tool_call_get_patient(self, patient_id: str, tool_func_name: str = "get_patient") -> Dict[str, Any]:
+        await self._wait("tool_call")
+        return {"name": tool_func_name, "args": {"patient_id": patient_id}}
+
+    async def generate_json(
+        self,
+        system: str,
+        user: str,
+        schema: Optional[Dict[str, Any]] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        async def _call(sys_prompt: str, user_prompt: str) -> str:
+            await self._wait("generate_json")
+            prompt = with_context(context, user_prompt) if sys_prompt == system else user_prompt
+            return self.sync.json_text(prompt, schema)
+
+        return await agenerate_validated(_call, system, user, schema)
+
+    async def generate(self, prompt: str) -> str:
+        await self._wait("generate")
+        return json.dumps(canned_text(prompt))
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        await self._wait("generate")
+        for piece in _pieces(json.dumps(canned_chat_answer(with_context(context, prompt)))):
+            await asyncio.sleep(0)
+            yield piece
+
+
+def _pieces(text: str, size: int = 7) -> List[str]:
+    """Small fixed-size slices, so stream consumers see escapes / keys split across pieces."""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _cited_chunks(prompt: str, limit: int = 2) -> List[Dict[str, Any]]:
+    return [
+        {"source": "NG12 PDF", "page": int(page), "chunk_id": cid, "excerpt": ""}
+        for cid, page in _CHUNK_REF.findall(prompt)[:limit]
+    ]
+
+
+def canned_assessment(user_prompt: str) -> Dict[str, Any]:
+    m = _PATIENT_ID.search(user_prompt)
+    pid = m.group(1) if m else ""
+    h = _digest_int(user_prompt)
+    return {
+        "patient_id": pid,
+        "decision": _DECISIONS[h % len(_DECISIONS)],
+        "confidence": round(0.5 + (h % 50) / 100.0, 2),
+        "summary": "Stub assessment (offline backend).",
+        "reasoning": "Deterministic stub output; not a clinical decision.",
+        "citations": _cited_chunks(user_prompt),
+    }
+
+
+def canned_summary(prompt: str) -> Dict[str, Any]:
+    users = [text for role, text in _TURN.findall(prompt) if role == "USER"]
+    return {
+        "summary": f"Stub summary ({len(users)} user turns folded): " + " / ".join(u[:60] for u in users),
+        "topics": ", ".join(u[:30] for u in users[-2:]),
+    }
+
+
+def canned_text(prompt: str) -> Dict[str, Any]:
+    # conversation-memory fold requests (app.llm.conversation_memory) vs chat questions
+    return canned_summary(prompt) if "\nNew turns:\n" in prompt else canned_chat_answer(prompt)
+
+
+def canned_json(prompt: str, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # chat answers (CHAT_ANSWER_SCHEMA) vs assessments
+    if schema is not None and "answer" in schema.get("properties", {}):
+        return canned_chat_answer(prompt)
+    return canned_assessment(prompt)
+
+
+def canned_chat_answer(prompt: str) -> Dict[str, Any]:
+    return {
+        "answer": "Stub answer (offline backend); see cited excerpts.",
+        "citations": _cited_chunks(prompt),
+    }
+
+
+class _StubCache:
+    def __init__(self, name: str, model: str, expire_time: float):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+
+
+class StubCaches:
+    """
+    In-memory stand-in for `client.caches` (create / update / get / delete) with
+    Vertex-like rules: a prefix under `min_tokens` (~4 chars per token) is
+    rejected with a 400, expired caches are gone (404), and `fail=True` rejects
+    every create (caching unavailable). `aio` is the async twin (`client.aio.caches`).
+    """
+
+    def __init__(self, min_tokens: int = 1024, clock=time.monotonic, fail: bool = False):
+        self.min_tokens = min_tokens
+        self.clock = clock
+        self.fail = fail
+        self.items: Dict[str, _StubCache] = {}
+        self.calls: Dict[str, int] = {"create": 0, "update": 0, "get": 0, "delete": 0}
+        self._seq = 0
+        self.aio = _AsyncStubCaches(self)
+
+    @staticmethod
+    def _ttl_s(config: Dict[str, Any]) -> float:
+        return float(str(config.get("ttl", "3600s")).rstrip("s"))
+
+    def _live(self, name: str) -> _StubCache:
+        cache = self.items.get(name)
+        if cache is None or self.clock() >= cache.expire_time:
+            self.items.pop(name, None)
+            raise StubServiceError("caches", code=404)
+        return cache
+
+    def create(self, model: str, config: Dict[str, Any]) -> _StubCache:
+        self.calls["create"] += 1
+        chars = len(config.get("system_instruction") or "") + sum(len(c) for c in config.get("contents") or [])
+        if self.fail or chars / 4 < self.min_tokens:
+            raise StubServiceError("caches", code=400)
+        self._seq += 1
+        cache = _StubCache(f"cachedContents/stub-{self._seq}", model, self.clock() + self._ttl_s(config))
+        self.items[cache.name] = cache
+        return cache
+
+    def update(self, name: str, config: Dict[str, Any]) -> _StubCache:
+        self.calls["update"] += 1
+        cache = self._live(name)
+        cache.expire_time = self.clock() + self._ttl_s(config)
+        return cache
+
+    def get(self, name: str) -> _StubCache:
+        self.calls["get"] += 1
+        return self._live(name)
+
+    def delete(self, name: str) -> None:
+        self.calls["delete"] += 1
+        self.items.pop(name, None)
+
+
+class _AsyncStubCaches:
+    def __init__(self, sync: StubCaches):
+        self.sync = sync
+
+    async def create(self, model: str, config: Dict[str, Any]) -> _StubCache:
+        return self.sync.create(model=model, config=config)
+
+    async def update(self, name: str, config: Dict[str, Any]) -> _StubCache:
+        return self.sync.update(name=name, config=config)
+
+    async def get(self, name: str) -> _StubCache:
+        return self.sync.get(name=name)
+
+    async def delete(self, name: str) -> None:
+        self.sync.delete(name=name)
+
+
+class StubVectorStore:
+    """
+    VectorStore-compatible fake over a small synthetic corpus (`n_chunks=0`
+    starts empty, e.g. as an ingest target). Exact cosine search in pure
+    Python; returns Chroma-shaped query results. `col` exposes the subset of
+    the Chroma collection API used by the numpy / BM25 / symptom index builders.
+    """
+
+    def __init__(self, n_chunks: int = 200, dim: int = 64):
+        self.ids: List[str] = []
+        self.docs: List[str] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.embs: List[List[float]] = []
+        self._version = ""
+        for i in range(n_chunks):
+            page = 1 + i // 4
+            cid = f"ng12_{page:04d}_{i % 4:02d}"
+            doc = f"Synthetic NG12 excerpt {i} (page {page}) for offline runs."
+            self.ids.append(cid)
+            self.docs.append(doc)
+            self.metas.append({"page": page, "chunk_id": cid, "source": "NG12 PDF"})
+            self.embs.append(stub_embedding(doc, dim))
+
+    # ---- ingest API (app.rag.ingest_ng12)
+    def upsert(self, ids: List[str], documents: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]):
+        pos = {cid: i for i, cid in enumerate(self.ids)}
+        for cid, doc, emb, meta in zip(ids, documents, embeddings, metadatas):
+            i = pos.get(cid)
+            if i is None:
+                pos[cid] = len(self.ids)
+                self.ids.append(cid)
+                self.docs.append(doc)
+                self.metas.append(dict(meta))
+                self.embs.append(list(emb))
+            else:
+                self.docs[i], self.metas[i], self.embs[i] = doc, dict(meta), list(emb)
+
+    def delete(self, ids: List[str]):
+        drop = set(ids)
+        keep = [i for i, cid in enumerate(self.ids) if cid not in drop]
+        self.ids = [self.ids[i] for i in keep]
+        self.docs = [self.docs[i] for i in keep]
+        self.metas = [self.metas[i] for i in keep]
+        self.embs = [self.embs[i] for i in keep]
+
+    def get_content_hashes(self) -> Dict[str, str]:
+        return {cid: m.get("content_hash", "") for cid, m in zip(self.ids, self.metas)}
+
+    def write_index_version(self, version: str) -> None:
+        self._version = version
+
+    @property
+    def col(self) -> "StubVectorStore":
+        return self
+
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {"ids": list(self.ids), "documents": list(self.docs),
+                "metadatas": list(self.metas), "embeddings": list(self.embs)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        scored = sorted(
+            ((sum(a * b for a, b in zip(query_embedding, e)), i) for i, e in enumerate(self.embs)),
+            reverse=True,
+        )[:top_k]
+        idx = [i for _, i in scored]
+        return {
+            "ids": [[self.ids[i] for i in idx]],
+            "documents": [[self.docs[i] for i in idx]],
+            "metadatas": [[self.metas[i] for i in idx]],
+            "distances": [[1.0 - s for s, _ in scored]],
+        }
+
+    async def query_async(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        return self.query(query_embedding, top_k=top_k)
+
+    def index_version(self) -> str:
+        return f"stub:{self._version or len(self.ids)}"
@@ -1,29 +1,69 @@
+# imported first: starts the cold-start clock reported by /ready
+from app.services import (
+    get_agem, get_assessor, get_chat_agent, get_chat_store, get_patient_store, get_services,
+)
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
 # Part 1 Imports
-from app.models import AssessRequest, AssessmentResponse
+from app.models import AssessRequest, AssessmentResponse, BatchAssessRequest
 from app.patient_store import PatientStore
 from app.llm.assessor import NG12Assessor
-from app.llm.gemini_client import GeminiClient
+from app.concurrency import run_blocking
+from app.config import settings
+from app.timing import StageTimer
+from app.metrics import HTTPMetricsMiddleware, metrics
+from app.llm.call_policy import CircuitOpenError, DeadlineExceeded
 
 # Part 2 Imports
 from app.chat_store import ChatStore
 from app.models_chat import ChatRequest, ChatResponse, ChatHistoryResponse
 from app.llm.chat_agent import NG12ChatAgent
+from app.llm.conversation_memory import fold_session
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 WEB_DIR = BASE_DIR / "web"
 STATIC_DIR = WEB_DIR / "static"
 
-app = FastAPI(title="NG12 Cancer Risk Assessor", version="2.0")
+logger = logging.getLogger("uvicorn.error")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # clients and indexes build in the background; /health answers right away
+    services = get_services()
+    if settings.warmup_on_start:
+        services.start_warmup()
+    yield
+    services.close()
+
+
+app = FastAPI(title="NG12 Cancer Risk Assessor", version="2.0", lifespan=lifespan)
+app.add_middleware(HTTPMetricsMiddleware)
 
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(request, exc: CircuitOpenError):
+    # Gemini is failing: tell clients when to come back instead of a 500
+    retry_after = str(max(1, int(exc.retry_after_s + 0.999)))
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": retry_after})
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request, exc: DeadlineExceeded):
+    return JSONResponse({"detail": str(exc)}, status_code=504)
+
+
 @app.get("/")
 def home():
     return FileResponse(str(WEB_DIR / "index.html"))
@@ -34,63 +74,246 @@ def health():
     return {"status": "ok"}
 
 
-# =====================
-# Initialize Services
-# =====================
+@app.get("/ready")
+def ready():
+    """200 once every client / index is built (see app/services.py), else 503."""
+    status = get_services().status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
-store = PatientStore()
-assessor = NG12Assessor()
-gem = GeminiClient()
 
-chat_store = ChatStore()
-chat_agent = NG12ChatAgent()
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape: stage histograms, token / byte / cache / error counters (app/metrics.py)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # =====================
 # PART 1 — Clinical Assessor
 # =====================
 
-@app.post("/assess", response_model=AssessmentResponse)
-def assess(req: AssessRequest):
+async def _tool_call_patient_id(agem, patient_id: str, timer: StageTimer) -> str:
+    with timer.stage("tool_call"):
+        tool_call = await agem.tool_call_get_patient(patient_id)
+    return tool_call.get("args", {}).get("patient_id", patient_id)
+
 
-    tool_call = gem.tool_call_get_patient(req.patient_id)
-    patient_id = tool_call.get("args", {}).get("patient_id", req.patient_id)
+async def _assess_serial(
+    req: AssessRequest, timer: StageTimer, agem, store: PatientStore, assessor: NG12Assessor
+) -> AssessmentResponse:
+    patient_id = await _tool_call_patient_id(agem, req.patient_id, timer)
 
-    patient = store.get_patient(patient_id)
+    with timer.stage("patient_lookup"):
+        patient = await run_blocking(store.get_patient, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient not found: {patient_id}")
 
-    return assessor.assess(patient, top_k=req.top_k)
+    return await assessor.assess_async(patient, top_k=req.top_k, timer=timer)
+
+
+@app.post("/assess", response_model=AssessmentResponse)
+async def assess(
+    req: AssessRequest,
+    assessor: NG12Assessor = Depends(get_assessor),
+    store: PatientStore = Depends(get_patient_store),
+    agem=Depends(get_agem),
+):
+    """
+    ASSESS_TOOL_CALL controls the get_patient tool-call round trip:
+      - serial:   tool call -> lookup -> assess (original flow)
+      - parallel: look the id up locally and start assessing right away; the tool
+                  call runs concurrently and is validated against the local record
+      - off:      skip the tool call entirely
+    """
+    timer = StageTimer()
+    mode = settings.assess_tool_call
+
+    if mode == "serial":
+        res = await _assess_serial(req, timer, agem, store, assessor)
+        tool_info = {"mode": mode}
+    else:
+        with timer.stage("patient_lookup"):
+            patient = await run_blocking(store.get_patient, req.patient_id)
+
+        if not patient:
+            if mode == "off":
+                raise HTTPException(status_code=404, detail=f"Patient not found: {req.patient_id}")
+            # unknown locally: let the tool call resolve the id, as before
+            res = await _assess_serial(req, timer, agem, store, assessor)
+            tool_info = {"mode": mode, "fallback": "serial"}
+
+        elif mode == "off":
+            res = await assessor.assess_async(patient, top_k=req.top_k, timer=timer)
+            tool_info = {"mode": mode}
+
+        else:
+            tool_task = asyncio.create_task(_tool_call_patient_id(agem, req.patient_id, timer))
+            try:
+                res = await assessor.assess_async(patient, top_k=req.top_k, timer=timer)
+            except BaseException:
+                tool_task.cancel()
+                raise
+
+            try:
+                tool_id = await tool_task
+            except Exception as e:
+                tool_id, tool_info = None, {"mode": mode, "error": str(e)}
+            else:
+                tool_info = {"mode": mode, "patient_id": tool_id, "validated": tool_id == patient.patient_id}
+
+            if tool_id and tool_id != patient.patient_id:
+                # model picked a different record: honour it like the serial path would
+                other = await run_blocking(store.get_patient, tool_id)
+                if other:
+                    res = await assessor.assess_async(other, top_k=req.top_k, timer=timer)
+                    tool_info["fallback"] = "reassessed"
+
+    if res.debug is not None:
+        res.debug["tool_call"] = tool_info
+        if settings.debug_timings:
+            res.debug["timings_ms"] = timer.as_dict()
+        else:
+            res.debug.pop("timings_ms", None)
+    return res
+
+
+@app.post("/assess/batch")
+async def assess_batch(
+    req: BatchAssessRequest,
+    assessor: NG12Assessor = Depends(get_assessor),
+    store: PatientStore = Depends(get_patient_store),
+):
+    """
+    Assess many patients in one call. Streams NDJSON, one line per patient in
+    completion order:
+      {"patient_id": ..., "status": "ok", "result": {...AssessmentResponse}}
+      {"patient_id": ..., "status": "error", "error": "..."}
+    The get_patient tool call is skipped; ids are resolved against the local store.
+    """
+    ids = list(dict.fromkeys(req.patient_ids))
+    found = await run_blocking(store.get_patients, ids)
+
+    async def _lines():
+        for pid in ids:
+            if pid not in found:
+                yield json.dumps({"patient_id": pid, "status": "error", "error": "Patient not found"}) + "\n"
+
+        async for pid, res, err in assessor.assess_many(found.values(), top_k=req.top_k):
+            if res is not None:
+                line = {"patient_id": pid, "status": "ok", "result": res.model_dump()}
+            else:
+                line = {"patient_id": pid, "status": "error", "error": err}
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
 
 
 # =====================
 # PART 2 — Chat Mode
 # =====================
 
+async def _session_context(chat_store: ChatStore, session_id: str):
+    # running summary + the turns it does not cover yet (at most 12)
+    memory = await run_blocking(chat_store.memory, session_id, 12)
+    history = [{"role": m.role, "content": m.content} for m in memory.messages]
+    return memory, history
+
+
+async def _fold(chat_store: ChatStore, chat_agent: NG12ChatAgent, session_id: str) -> None:
+    # runs after the reply is sent; a failed fold is retried on the next turn
+    try:
+        await fold_session(chat_store, chat_agent.agem, session_id)
+    except Exception:
+        metrics.inc("ng12_stage_errors_total", stage="chat.fold")
+        logger.exception("summary fold failed for session %s", session_id)
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(
+    req: ChatRequest,
+    background: BackgroundTasks,
+    chat_agent: NG12ChatAgent = Depends(get_chat_agent),
+    chat_store: ChatStore = Depends(get_chat_store),
+):
 
-    chat_store.add(req.session_id, "user", req.message)
+    await run_blocking(chat_store.add, req.session_id, "user", req.message)
 
-    history = chat_store.to_openai_style(req.session_id, max_messages=12)
+    memory, history = await _session_context(chat_store, req.session_id)
 
-    answer, citations = chat_agent.chat(
+    answer, citations, debug = await chat_agent.chat_async(
         message=req.message,
         history=history,
-        top_k=req.top_k
+        top_k=req.top_k,
+        summary=memory.summary,
+        topics=memory.topics,
     )
 
-    chat_store.add(req.session_id, "assistant", answer)
+    await run_blocking(chat_store.add, req.session_id, "assistant", answer)
+    background.add_task(_fold, chat_store, chat_agent, req.session_id)
 
     return {
         "session_id": req.session_id,
         "answer": answer,
-        "citations": citations
+        "citations": citations,
+        "debug": debug or None,
     }
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    req: ChatRequest,
+    background: BackgroundTasks,
+    chat_agent: NG12ChatAgent = Depends(get_chat_agent),
+    chat_store: ChatStore = Depends(get_chat_store),
+):
+    """
+    Same as /chat, streamed as Server-Sent Events:
+      event: token      data: {"text": "..."}             answer text as it is generated
+      event: citations  data: {"session_id", "answer", "citations", "debug"}   final event
+      event: error      data: {"detail": "..."}
+    The final answer is parsed from the complete model output and may differ
+    slightly from the concatenated tokens (e.g. plain-text fallbacks).
+    """
+
+    await run_blocking(chat_store.add, req.session_id, "user", req.message)
+
+    memory, history = await _session_context(chat_store, req.session_id)
+
+    async def _events():
+        try:
+            async for kind, payload in chat_agent.chat_stream(
+                message=req.message,
+                history=history,
+                top_k=req.top_k,
+                summary=memory.summary,
+                topics=memory.topics,
+            ):
+                if kind == "token":
+                    yield _sse("token", {"text": payload})
+                else:
+                    await run_blocking(chat_store.add, req.session_id, "assistant", payload["answer"])
+                    yield _sse("citations", {
+                        "session_id": req.session_id,
+                        "answer": payload["answer"],
+                        "citations": payload["citations"],
+                        "debug": payload["debug"] or None,
+                    })
+        except Exception as e:
+            yield _sse("error", {"detail": f"{type(e).__name__}: {e}"})
+
+    background.add_task(_fold, chat_store, chat_agent, req.session_id)
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/chat/{session_id}/history", response_model=ChatHistoryResponse)
-def chat_history(session_id: str):
+def chat_history(session_id: str, chat_store: ChatStore = Depends(get_chat_store)):
 
     history = chat_store.get(session_id)
 
@@ -103,7 +326,13 @@ def chat_history(session_id: str):
     }
 
 
+@app.get("/chat/cache/stats")
+def chat_cache_stats(chat_agent: NG12ChatAgent = Depends(get_chat_agent)):
+    cache = chat_agent.answer_cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
 @app.delete("/chat/{session_id}")
-def chat_clear(session_id: str):
+def chat_clear(session_id: str, chat_store: ChatStore = Depends(get_chat_store)):
     chat_store.clear(session_id)
     return {"session_id": session_id, "cleared": True}
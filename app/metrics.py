@@ -0,0 +1,389 @@
+"""
+Process-wide latency / volume metrics in Prometheus text format (GET /metrics).
+
+  ng12_stage_seconds{stage}         histogram: request stages (StageTimer) and
+                                    client calls (gemini.*, vector.*, patients.*)
+  ng12_stage_errors_total{stage}    calls that raised
+  ng12_tokens_total{op,kind}        Gemini usage metadata (prompt / cached / output tokens)
+  ng12_bytes_total{op,direction}    payload sizes sent to / received from Gemini
+  ng12_cache_*{cache}               hit / miss / eviction counters of the in-process caches
+  ng12_http_request_seconds{route}  histogram per endpoint (+ ng12_http_requests_total{route,status})
+
+METRICS_ENABLED=False turns every hook into one attribute check; run
+`python -m app.metrics bench` to measure the per-call overhead either way.
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from app.config import settings
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_LE = tuple(f'le="{b}"' for b in BUCKETS)
+_LE_INF = 'le="+Inf"'
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Collector = Callable[[], List[Tuple[str, str, Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """
+    Counters and fixed-bucket histograms keyed by (name, labels). One lock,
+    held only for the dict update. Cache sizes / hit counts are not counted
+    on the hot path; `add_collector` callables are read at scrape time instead.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hist: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: Dict[str, Collector] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        if self.enabled:
+            self._observe(name, tuple(sorted(labels.items())), seconds)
+
+    def _observe(self, name: str, key: LabelKey, seconds: float) -> None:
+        idx = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self._hist.setdefault(name, {}).get(key)
+            if h is None:
+                h = self._hist[name][key] = _Histogram()
+            h.counts[idx] += 1
+            h.sum += seconds
+            h.count += 1
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def stage(self, stage: str, seconds: float, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        self._observe("ng12_stage_seconds", (("stage", stage),), seconds)
+        if error:
+            self.inc("ng12_stage_errors_total", stage=stage)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.stage(stage, time.perf_counter() - t0, error)
+
+    def add_collector(self, name: str, fn: Collector) -> None:
+        """`fn()` -> [(metric name, type, labels, value)], read on every scrape."""
+        self._collectors[name] = fn
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+    # ==========================
+    # Exposition
+    # ==========================
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines: List[str] = []
+
+        def _head(name: str, kind: str) -> None:
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            hist = {n: {k: (list(h.counts), h.sum, h.count) for k, h in s.items()} for n, s in self._hist.items()}
+            counters = {n: dict(s) for n, s in self._counters.items()}
+
+        for name in sorted(hist):
+            _head(name, "histogram")
+            for key, (counts, total, count) in sorted(hist[name].items()):
+                running = 0
+                for bound, c in zip(_LE, counts):
+                    running += c
+                    lines.append(f"{name}_bucket{_labels(key, bound)} {running}")
+                lines.append(f"{name}_bucket{_labels(key, _LE_INF)} {count}")
+                lines.append(f"{name}_sum{_labels(key)} {total:.6f}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+
+        for name in sorted(counters):
+            _head(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_labels(key)} {value:g}")
+
+        collected: Dict[str, Tuple[str, List[Tuple[LabelKey, float]]]] = {}
+        for fn in list(self._collectors.values()):
+            try:
+                rows = fn()
+            except Exception:
+                continue  # a broken collector must not break the scrape
+            for name, kind, labels, value in rows:
+                collected.setdefault(name, (kind, []))[1].append((tuple(sorted(labels.items())), value))
+        for name in sorted(collected):
+            kind, rows = collected[name]
+            _head(name, kind)
+            for key, value in rows:
+                lines.append(f"{name}{_labels(key)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """{stage: {count, sum_ms, mean_ms}} for quick JSON inspection."""
+        with self._lock:
+            series = dict(self._hist.get("ng12_stage_seconds", {}))
+            return {
+                dict(key).get("stage", ""): {
+                    "count": h.count,
+                    "sum_ms": round(h.sum * 1000.0, 2),
+                    "mean_ms": round(h.sum * 1000.0 / h.count, 3) if h.count else 0.0,
+                }
+                for key, h in series.items()
+            }
+
+
+metrics = Metrics(enabled=settings.metrics_enabled)
+metrics.describe("ng12_stage_seconds", "Duration of request stages and client calls.")
+metrics.describe("ng12_stage_errors_total", "Stage / client calls that raised.")
+metrics.describe("ng12_tokens_total", "Gemini tokens reported in usage metadata.")
+metrics.describe("ng12_bytes_total", "Bytes of text sent to / received from Gemini.")
+metrics.describe("ng12_http_request_seconds", "HTTP request duration by route.")
+metrics.describe("ng12_http_requests_total", "HTTP requests by route and status.")
+
+
+# ==========================
+# Instrumentation helpers
+# ==========================
+_now = time.perf_counter
+
+
+def instrumented(stage: str):
+    """
+    Decorator timing every call into ng12_stage_seconds{stage}; works on plain
+    functions, coroutines and (async) generators (timed until exhausted).
+    """
+
+    def wrap(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen(*args, **kwargs):
+                if not metrics.enabled:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                with metrics.timed(stage):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return agen
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen(*args, **kwargs):
+                if not metrics.enabled:
+                    yield from fn(*args, **kwargs)
+                    return
+                with metrics.timed(stage):
+                    yield from fn(*args, **kwargs)
+            return gen
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coro(*args, **kwargs):
+                if not metrics.enabled:
+                    return await fn(*args, **kwargs)
+                t0 = _now()
+                try:
+                    out = await fn(*args, **kwargs)
+                except BaseException:
+                    metrics.stage(stage, _now() - t0, True)
+                    raise
+                metrics.stage(stage, _now() - t0)
+                return out
+            return coro
+
+        # plain calls are timed inline: a @contextmanager costs more than the timing itself
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            t0 = _now()
+            try:
+                out = fn(*args, **kwargs)
+            except BaseException:
+                metrics.stage(stage, _now() - t0, True)
+                raise
+            metrics.stage(stage, _now() - t0)
+            return out
+        return call
+
+    return wrap
+
+
+def record_text(op: str, sent: str = "", received: str = "") -> None:
+    if not metrics.enabled:
+        return
+    if sent:
+        metrics.inc("ng12_bytes_total", len(sent.encode("utf-8")), op=op, direction="sent")
+    if received:
+        metrics.inc("ng12_bytes_total", len(received.encode("utf-8")), op=op, direction="received")
+
+
+def record_usage(op: str, resp: Any) -> None:
+    """Token counts from a google-genai response's usage_metadata (absent on some backends)."""
+    if not metrics.enabled:
+        return
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (
+        ("prompt", "prompt_token_count"),
+        ("cached", "cached_content_token_count"),
+        ("output", "candidates_token_count"),
+    ):
+        n = getattr(usage, attr, None)
+        if n:
+            metrics.inc("ng12_tokens_total", n, op=op, kind=kind)
+
+
+def cache_collector(cache_name: str, cache) -> Collector:
+    """Collector exporting a cache's `stats()` (hits / misses / evictions / size)."""
+
+    def _collect():
+        st = cache.stats()
+        labels = {"cache": cache_name}
+        rows = [(f"ng12_cache_{k}_total", "counter", labels, float(st[k]))
+                for k in ("hits", "misses", "evictions", "invalidations") if k in st]
+        rows.append(("ng12_cache_entries", "gauge", labels, float(st.get("size", 0))))
+        return rows
+
+    return _collect
+
+
+class HTTPMetricsMiddleware:
+    """Pure ASGI middleware: duration + status per route template (e.g. /chat/{session_id}/history)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            metrics.observe("ng12_http_request_seconds", time.perf_counter() - t0, route=path)
+            metrics.inc("ng12_http_requests_total", route=path, status=str(status["code"]))
+
+
+# ==========================
+# Overhead microbenchmark
+# ==========================
+def _bench(n: int) -> Dict[str, float]:
+    def noop(x):
+        return x
+
+    wrapped = instrumented("bench.noop")(noop)
+
+    async def anoop(x):
+        return x
+
+    awrapped = instrumented("bench.anoop")(anoop)
+
+    def _ns(fn) -> float:
+        t0 = time.perf_counter_ns()
+        for i in range(n):
+            fn(i)
+        return (time.perf_counter_ns() - t0) / n
+
+    async def _ans(fn) -> float:
+        t0 = time.perf_counter_ns()
+        for i in range(n):
+            await fn(i)
+        return (time.perf_counter_ns() - t0) / n
+
+    was = metrics.enabled
+    try:
+        base = _ns(noop)
+        abase = asyncio.run(_ans(anoop))
+        metrics.enabled = False
+        off, aoff = _ns(wrapped), asyncio.run(_ans(awrapped))
+        metrics.enabled = True
+        on, aon = _ns(wrapped), asyncio.run(_ans(awrapped))
+    finally:
+        metrics.enabled = was
+        metrics.reset()
+    return {
+        "calls": n,
+        "sync_overhead_disabled_ns": round(off - base, 1),
+        "sync_overhead_enabled_ns": round(on - base, 1),
+        "async_overhead_disabled_ns": round(aoff - abase, 1),
+        "async_overhead_enabled_ns": round(aon - abase, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics utilities.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="per-call overhead of @instrumented, metrics on vs off")
+    bench.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(json.dumps(_bench(args.calls), indent=2))
+
+
+if __name__ == "__main__":
+    main()
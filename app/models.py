@@ -30,3 +30,7 @@ class AssessmentResponse(BaseModel):
 class AssessRequest(BaseModel):
     patient_id: str
     top_k: Optional[int] = None
+
+class BatchAssessRequest(BaseModel):
+    patient_ids: List[str] = Field(..., min_length=1)
+    top_k: Optional[int] = None
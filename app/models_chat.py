@@ -1,6 +1,6 @@
 # app/models_chat.py
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class ChatRequest(BaseModel):
     session_id: str = Field(..., description="Client-generated session id")
@@ -17,6 +17,7 @@ class ChatResponse(BaseModel):
     session_id: str
     answer: str
     citations: List[ChatCitation]
+    debug: Optional[Dict[str, Any]] = None
 
 class ChatHistoryItem(BaseModel):
     role: str
@@ -0,0 +1,313 @@
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.models import Patient
+
+
+BACKENDS = ("json", "jsonl", "sqlite")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def file_stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def detect_backend(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    return "json"
+
+
+class PatientBackend(ABC):
+    """
+    Storage interface behind PatientStore.
+    Implementations must be safe for concurrent readers.
+    """
+
+    @abstractmethod
+    def get(self, patient_id: str) -> Optional[Patient]:
+        ...
+
+    def get_many(self, patient_ids: Iterable[str]) -> Dict[str, Patient]:
+        out: Dict[str, Patient] = {}
+        for pid in patient_ids:
+            if pid in out:
+                continue
+            p = self.get(pid)
+            if p is not None:
+                out[pid] = p
+        return out
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+# ==========================
+# JSON (whole file, in-memory index)
+# ==========================
+class _PatientRow:
+    """
+    Compact patient record kept in the index.
+    Strings are interned so repeated values (gender, smoking history,
+    symptom names) share one object across all rows.
+    """
+    __slots__ = (
+        "patient_id",
+        "name",
+        "age",
+        "gender",
+        "smoking_history",
+        "symptoms",
+        "symptom_duration_days",
+    )
+
+    def __init__(self, row: dict):
+        self.patient_id = _intern(row.get("patient_id"))
+        self.name = row.get("name")
+        self.age = row.get("age")
+        self.gender = _intern(row.get("gender"))
+        self.smoking_history = _intern(row.get("smoking_history"))
+        self.symptoms = tuple(_intern(s) for s in (row.get("symptoms") or ()))
+        self.symptom_duration_days = row.get("symptom_duration_days")
+
+    def to_patient(self) -> Patient:
+        return Patient(
+            patient_id=self.patient_id,
+            name=self.name,
+            age=self.age,
+            gender=self.gender,
+            smoking_history=self.smoking_history,
+            symptoms=list(self.symptoms),
+            symptom_duration_days=self.symptom_duration_days,
+        )
+
+
+class JsonBackend(PatientBackend):
+    """Loads a JSON array of patients into a compact id -> row index."""
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        rows: Dict[str, _PatientRow] = {}
+        for raw in data:
+            if raw.get("patient_id") is None:
+                continue
+            row = _PatientRow(raw)
+            # first occurrence wins, same as the old linear scan
+            rows.setdefault(row.patient_id, row)
+        self._rows = rows
+
+    def get(self, patient_id: str) -> Optional[Patient]:
+        row = self._rows.get(patient_id)
+        return row.to_patient() if row is not None else None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+# ==========================
+# JSONL (offset index + mmap reads)
+# ==========================
+class JsonlBackend(PatientBackend):
+    """
+    One patient object per line. Only byte offsets are kept in memory;
+    records are parsed from a read-only mmap when requested.
+    """
+
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        # record i occupies bytes [spans[2i], spans[2i + 1])
+        spans = array("q")
+        records: Dict[str, int] = {}
+        pos = 0
+        for line in self._f:
+            stripped = line.strip()
+            if stripped:
+                pid = json.loads(stripped).get("patient_id")
+                if pid is not None and pid not in records:
+                    records[_intern(pid)] = len(spans) // 2
+                    spans.append(pos)
+                    spans.append(pos + len(line))
+            pos += len(line)
+        self._spans = spans
+        self._records = records
+
+    def _read(self, i: int) -> Patient:
+        start, end = self._spans[2 * i], self._spans[2 * i + 1]
+        return Patient(**json.loads(self._mm[start:end]))
+
+    def get(self, patient_id: str) -> Optional[Patient]:
+        i = self._records.get(patient_id)
+        return self._read(i) if i is not None else None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._f.close()
+
+
+# ==========================
+# SQLite
+# ==========================
+_SQLITE_SCHEMA = "CREATE TABLE IF NOT EXISTS patients (patient_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+_SQLITE_MAX_VARS = 500
+
+
+class SqliteBackend(PatientBackend):
+    """
+    Read-only access to a `patients(patient_id, data)` table where `data` is the
+    patient JSON. One connection per thread.
+    """
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, patient_id: str) -> Optional[Patient]:
+        row = self._conn().execute(
+            "SELECT data FROM patients WHERE patient_id = ?", (patient_id,)
+        ).fetchone()
+        return Patient(**json.loads(row[0])) if row else None
+
+    def get_many(self, patient_ids: Iterable[str]) -> Dict[str, Patient]:
+        ids = list(dict.fromkeys(patient_ids))
+        found: Dict[str, Patient] = {}
+        conn = self._conn()
+        for start in range(0, len(ids), _SQLITE_MAX_VARS):
+            batch = ids[start:start + _SQLITE_MAX_VARS]
+            marks = ",".join("?" * len(batch))
+            for pid, data in conn.execute(
+                f"SELECT patient_id, data FROM patients WHERE patient_id IN ({marks})", batch
+            ):
+                found[pid] = Patient(**json.loads(data))
+        # keep caller order
+        return {pid: found[pid] for pid in ids if pid in found}
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+    def close(self) -> None:
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+
+def open_backend(kind: str, path: str) -> PatientBackend:
+    if kind == "auto":
+        kind = detect_backend(path)
+    if kind == "json":
+        return JsonBackend(path)
+    if kind == "jsonl":
+        return JsonlBackend(path)
+    if kind == "sqlite":
+        return SqliteBackend(path)
+    raise ValueError(f"Unknown patient backend: {kind!r} (expected one of {BACKENDS} or 'auto')")
+
+
+# ==========================
+# Conversion from patients.json
+# ==========================
+def iter_json_patients(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for row in json.load(f):
+            if row.get("patient_id") is not None:
+                yield row
+
+
+def iter_patient_rows(path: str, kind: str = "auto") -> Iterator[dict]:
+    """Stream raw patient dicts from any supported backend file."""
+    if kind == "auto":
+        kind = detect_backend(path)
+    if kind == "json":
+        yield from iter_json_patients(path)
+    elif kind == "jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    if row.get("patient_id") is not None:
+                        yield row
+    elif kind == "sqlite":
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for (data,) in conn.execute("SELECT data FROM patients ORDER BY rowid"):
+                yield json.loads(data)
+        finally:
+            conn.close()
+    else:
+        raise ValueError(f"Unknown patient backend: {kind!r}")
+
+
+def write_jsonl(rows: Iterable[dict], dest: str) -> int:
+    n = 0
+    tmp = dest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            n += 1
+    os.replace(tmp, dest)
+    return n
+
+
+def write_sqlite(rows: Iterable[dict], dest: str, batch_size: int = 5000) -> int:
+    tmp = dest + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute(_SQLITE_SCHEMA)
+        batch = []
+        for row in rows:
+            batch.append((row["patient_id"], json.dumps(row, ensure_ascii=False, separators=(",", ":"))))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT OR IGNORE INTO patients VALUES (?, ?)", batch)
+                batch.clear()
+        if batch:
+            conn.executemany("INSERT OR IGNORE INTO patients VALUES (?, ?)", batch)
+        conn.commit()
+        n = conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+    finally:
+        conn.close()
+    os.replace(tmp, dest)
+    return n
@@ -1,21 +1,115 @@
-import json
-from typing import Optional
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
 from app.models import Patient
 from app.config import settings
+from app.metrics import instrumented
+from app.patient_backends import PatientBackend, file_stamp, open_backend
+
+# a swapped-out backend stays open this long for lookups that already hold it
+_RETIRE_AFTER_S = 10.0
+
 
 class PatientStore:
-    def __init__(self, path: str = settings.patients_path):
+    """
+    Patient lookup over a pluggable storage backend (see app/patient_backends.py):
+      - json:   whole-file load into a compact in-memory id -> row index
+      - jsonl:  byte-offset index, records read from an mmap on demand
+      - sqlite: primary-key lookups, nothing held in memory
+
+    The file's mtime/size is polled (at most every `reload_interval_s`); on change
+    the backend is reopened in a background thread and swapped in, so readers keep
+    using the previous one and never wait on a rebuild. The previous backend
+    (mmap, sqlite connections) is closed once in-flight lookups have had
+    `_RETIRE_AFTER_S` to finish.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.patients_path,
+        backend: str = settings.patient_backend,
+        reload_interval_s: float = settings.patients_reload_interval_s,
+    ):
         self.path = path
-        self._cache = None
+        self.backend_kind = backend
+        self.reload_interval_s = reload_interval_s
+        self._backend: Optional[PatientBackend] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._init_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._next_check = 0.0
+
+    def _open(self) -> Tuple[PatientBackend, Tuple[int, int]]:
+        stamp = file_stamp(self.path)
+        return open_backend(self.backend_kind, self.path), stamp
+
+    def _load(self) -> PatientBackend:
+        backend = self._backend
+        if backend is None:
+            with self._init_lock:
+                if self._backend is None:
+                    self._backend, self._stamp = self._open()
+                    self._next_check = time.monotonic() + max(self.reload_interval_s, 0.0)
+                return self._backend
+
+        if self.reload_interval_s >= 0:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.reload_interval_s
+                self._maybe_reload()
+        return backend
 
-    def _load(self):
-        if self._cache is None:
-            with open(self.path, "r", encoding="utf-8") as f:
-                self._cache = json.load(f)
+    def _maybe_reload(self) -> None:
+        try:
+            stamp = file_stamp(self.path)
+        except OSError:
+            # file missing mid-replace: keep serving the current backend
+            return
+        if stamp == self._stamp:
+            return
+        if not self._rebuild_lock.acquire(blocking=False):
+            return  # a rebuild is already running
 
+        def _rebuild():
+            try:
+                self._swap(*self._open())
+            except Exception:
+                # partially written / invalid file: keep the old backend, retry on next check
+                pass
+            finally:
+                self._rebuild_lock.release()
+
+        threading.Thread(target=_rebuild, name="patient-index-reload", daemon=True).start()
+
+    def _swap(self, backend: PatientBackend, stamp: Tuple[int, int]) -> None:
+        old = self._backend
+        self._backend, self._stamp = backend, stamp
+        if old is not None:
+            timer = threading.Timer(_RETIRE_AFTER_S, old.close)
+            timer.daemon = True
+            timer.start()
+
+    def reload(self) -> None:
+        """Reopen the backend synchronously."""
+        self._swap(*self._open())
+
+    def close(self) -> None:
+        backend, self._backend = self._backend, None
+        if backend is not None:
+            backend.close()
+
+    @instrumented("patients.get")
     def get_patient(self, patient_id: str) -> Optional[Patient]:
-        self._load()
-        for row in self._cache:
-            if row.get("patient_id") == patient_id:
-                return Patient(**row)
-        return None
+        return self._load().get(patient_id)
+
+    @instrumented("patients.get_many")
+    def get_patients(self, patient_ids: Iterable[str]) -> Dict[str, Patient]:
+        """
+        Batch lookup. Returns {patient_id: Patient} for the ids that exist;
+        unknown ids are omitted.
+        """
+        return self._load().get_many(patient_ids)
+
+    def __len__(self) -> int:
+        return len(self._load())
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set
+
+from app.config import settings
+from app.models import Patient
+from app.patient_backends import iter_patient_rows
+from app.timing import percentile
+
+
+# ==========================
+# Output writers
+# ==========================
+class JsonlWriter:
+    """Appends one JSON object per line; every record is durable once written."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        return True
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class ParquetWriter:
+    """
+    Buffers records and writes them as numbered part files
+    (`<output>/part-00000.parquet`, ...). Requires pyarrow.
+    """
+
+    def __init__(self, path: str, rows_per_part: int = 1000):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        self.path = path
+        self.rows_per_part = max(1, rows_per_part)
+        os.makedirs(path, exist_ok=True)
+        self._part = len([n for n in os.listdir(path) if n.endswith(".parquet")])
+        self._buf: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _flatten(record: Dict[str, Any]) -> Dict[str, Any]:
+        res = record.get("result") or {}
+        return {
+            "patient_id": record["patient_id"],
+            "status": record["status"],
+            "latency_ms": record["latency_ms"],
+            "decision": res.get("decision"),
+            "confidence": res.get("confidence"),
+            "summary": res.get("summary"),
+            "reasoning": res.get("reasoning"),
+            "citations": json.dumps(res.get("citations", [])),
+            "error": record.get("error"),
+        }
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """Returns True when buffered records were flushed to disk."""
+        self._buf.append(self._flatten(record))
+        if len(self._buf) >= self.rows_per_part:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> None:
+        if not self._buf:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self._buf)
+        tmp = os.path.join(self.path, f".part-{self._part:05d}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.path, f"part-{self._part:05d}.parquet"))
+        self._part += 1
+        self._buf.clear()
+
+    def close(self) -> None:
+        self.flush()
+
+
+# ==========================
+# Checkpoint
+# ==========================
+class Checkpoint:
+    """Append-only list of patient_ids whose results are safely on disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._f = open(path, "a", encoding="utf-8")
+
+    def mark(self, patient_ids: List[str]) -> None:
+        if not patient_ids:
+            return
+        self._f.write("".join(pid + "\n" for pid in patient_ids))
+        self._f.flush()
+        self.done.update(patient_ids)
+
+    def close(self) -> None:
+        self._f.close()
+
+
+# ==========================
+# Runner
+# ==========================
+def build_assessor(backend: str, stub_latency_ms: float, use_cache: bool):
+    from app.llm.assessor import NG12Assessor
+
+    if backend == "stub":
+        from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient, StubVectorStore
+
+        gem = StubGeminiClient(latency_ms=stub_latency_ms)
+        return NG12Assessor(
+            gem=gem, agem=AsyncStubGeminiClient(gem), store=StubVectorStore(), use_cache=use_cache,
+            use_symptom_index=False,  # the ingested index would not match the synthetic corpus
+        )
+    return NG12Assessor(use_cache=use_cache)
+
+
+def _assess_one(assessor, row: Dict[str, Any], top_k: Optional[int]) -> Dict[str, Any]:
+    pid = row.get("patient_id")
+    t0 = time.perf_counter()
+    try:
+        res = assessor.assess(Patient(**row), top_k=top_k)
+        out = {"patient_id": pid, "status": "ok", "result": res.model_dump()}
+    except Exception as e:
+        out = {"patient_id": pid, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    out["latency_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+    return out
+
+
+def _report(done: int, errors: int, latencies: List[float], elapsed: float, final: bool = False) -> None:
+    rate = done / elapsed if elapsed > 0 else 0.0
+    label = "Done" if final else "Progress"
+    print(
+        f"{label}: {done} assessed, {errors} errors, {rate:.2f} patients/s, "
+        f"p50={percentile(latencies, 50):.0f}ms p95={percentile(latencies, 95):.0f}ms",
+        file=sys.stderr,
+    )
+
+
+def run(args) -> Dict[str, Any]:
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    ckpt = Checkpoint(args.checkpoint or args.output + ".ckpt")
+    if not args.resume and (ckpt.done or os.path.exists(args.output)):
+        raise SystemExit(f"{args.output} / {ckpt.path} already exist; use --resume or delete them.")
+
+    writer = ParquetWriter(args.output, args.rows_per_part) if fmt == "parquet" else JsonlWriter(args.output)
+    assessor = build_assessor(args.backend, args.stub_latency_ms, use_cache=not args.no_cache)
+
+    skipped = 0
+    done = errors = 0
+    latencies: List[float] = []
+    unflushed: List[str] = []
+    t_start = time.perf_counter()
+    max_inflight = args.workers * 4
+
+    def _collect(futs) -> None:
+        nonlocal done, errors
+        for fut in futs:
+            rec = fut.result()
+            done += 1
+            latencies.append(rec["latency_ms"])
+            if rec["status"] != "ok":
+                errors += 1
+            unflushed.append(rec["patient_id"])
+            if writer.write(rec):
+                ckpt.mark(unflushed)
+                unflushed.clear()
+            if args.progress_every and done % args.progress_every == 0:
+                _report(done, errors, latencies, time.perf_counter() - t_start)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            inflight = set()
+            for row in iter_patient_rows(args.input):
+                if row["patient_id"] in ckpt.done:
+                    skipped += 1
+                    continue
+                if args.limit and done + len(inflight) >= args.limit:
+                    break
+                inflight.add(pool.submit(_assess_one, assessor, row, args.top_k))
+                if len(inflight) >= max_inflight:
+                    finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    _collect(finished)
+            finished, _ = wait(inflight)
+            _collect(finished)
+    finally:
+        # whatever reached disk is checkpointed, also on Ctrl-C
+        writer.close()
+        ckpt.mark(unflushed)
+        ckpt.close()
+
+    elapsed = time.perf_counter() - t_start
+    _report(done, errors, latencies, elapsed, final=True)
+    return {
+        "assessed": done,
+        "skipped_from_checkpoint": skipped,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(done / elapsed, 3) if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run NG12Assessor over a patient file (resumable).")
+    parser.add_argument("--input", default=settings.patients_path, help="patients .json / .jsonl / .db")
+    parser.add_argument("--output", required=True, help="results .jsonl file, or a directory for parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None)
+    parser.add_argument("--checkpoint", default="", help="default: <output>.ckpt")
+    parser.add_argument("--resume", action="store_true", help="skip patients already in the checkpoint")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=0, help="stop after N patients (0 = all)")
+    parser.add_argument("--backend", choices=["gemini", "stub"], default="gemini",
+                        help="stub = offline deterministic LLM + vector store (benchmarking)")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the assessment result cache")
+    parser.add_argument("--rows-per-part", type=int, default=1000, help="parquet rows per part file")
+    parser.add_argument("--progress-every", type=int, default=100)
+    args = parser.parse_args()
+
+    summary = run(args)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
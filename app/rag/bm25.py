@@ -0,0 +1,266 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import instrumented
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in include is it of on or that the "
+    "this to with without who ng12 criteria guidance".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens with light normalization so patient wording and NG12
+    wording meet: British -> American digraphs (haemoptysis ~ hemoptysis,
+    oesophageal ~ esophageal) and a naive plural strip.
+    """
+    out = []
+    for tok in _TOKEN.findall(text.lower()):
+        if tok in _STOPWORDS:
+            continue
+        tok = tok.replace("ae", "e").replace("oe", "e")
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        out.append(tok)
+    return out
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the ingested NG12 chunks, with a precomputed inverted index
+    (term -> parallel arrays of doc index / term frequency). Small enough to
+    live in memory; persisted as JSON next to the vector index.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        version: str = "",
+        k1: float = 1.5,
+        b: float = 0.75,
+        postings: Optional[Dict[str, Tuple[List[int], List[int]]]] = None,
+        doc_len: Optional[List[int]] = None,
+    ):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.version = version
+        self.k1 = k1
+        self.b = b
+
+        if postings is None or doc_len is None:
+            postings, doc_len = self._build(documents)
+        self.doc_len = array("i", doc_len)
+        self.postings = {t: (array("i", d), array("i", f)) for t, (d, f) in postings.items()}
+
+        n = len(documents)
+        self.avgdl = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            t: math.log(1.0 + (n - len(d) + 0.5) / (len(d) + 0.5))
+            for t, (d, _) in self.postings.items()
+        }
+
+    @staticmethod
+    def _build(documents: List[str]):
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        doc_len: List[int] = []
+        for i, doc in enumerate(documents):
+            toks = tokenize(doc or "")
+            doc_len.append(len(toks))
+            tf: Dict[str, int] = {}
+            for t in toks:
+                tf[t] = tf.get(t, 0) + 1
+            for t, f in tf.items():
+                d, fs = postings.setdefault(t, ([], []))
+                d.append(i)
+                fs.append(f)
+        return postings, doc_len
+
+    @instrumented("bm25.search")
+    def search(self, query: str, top_n: int = 20) -> List[Tuple[int, float]]:
+        """[(doc index, score)] best first."""
+        if not self.ids or self.avgdl == 0:
+            return []
+        scores: Dict[int, float] = {}
+        k1, b, avgdl = self.k1, self.b, self.avgdl
+        for t in set(tokenize(query)):
+            posting = self.postings.get(t)
+            if posting is None:
+                continue
+            idf = self.idf[t]
+            docs, freqs = posting
+            for i, f in zip(docs, freqs):
+                denom = f + k1 * (1.0 - b + b * self.doc_len[i] / avgdl)
+                scores[i] = scores.get(i, 0.0) + idf * f * (k1 + 1.0) / denom
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_n]
+
+    # ==========================
+    # Persistence
+    # ==========================
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "version": self.version,
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "documents": self.documents,
+            "metadatas": self.metadatas,
+            "doc_len": list(self.doc_len),
+            "postings": {t: [list(d), list(f)] for t, (d, f) in self.postings.items()},
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            p = json.load(f)
+        return cls(
+            p["ids"], p["documents"], p["metadatas"], p.get("version", ""),
+            k1=p.get("k1", 1.5), b=p.get("b", 0.75),
+            postings={t: (d, fs) for t, (d, fs) in p["postings"].items()},
+            doc_len=p["doc_len"],
+        )
+
+
+def build_from_store(store, path: str = settings.bm25_path) -> BM25Index:
+    """Build + persist the lexical index from everything currently in the Chroma collection."""
+    res = store.col.get(include=["documents", "metadatas"])
+    index = BM25Index(
+        list(res.get("ids") or []),
+        list(res.get("documents") or []),
+        [m or {} for m in (res.get("metadatas") or [])],
+        version=store.index_version(),
+    )
+    index.save(path)
+    return index
+
+
+# ==========================
+# Hybrid retrieval (BM25 + dense, reciprocal rank fusion)
+# ==========================
+class HybridVectorStore:
+    """
+    Wraps a dense store (Chroma or numpy). When the caller passes `query_text`,
+    dense and BM25 candidate lists are fused with reciprocal rank fusion:
+    score(d) = sum over lists of 1 / (rrf_k + rank). Without `query_text` it
+    behaves exactly like the wrapped store.
+
+    With `path`, the BM25 file's mtime is checked every `reload_interval_s`
+    and a re-ingested index is picked up, like NumpyVectorStore's manifest.
+    """
+
+    def __init__(
+        self,
+        dense,
+        bm25: BM25Index,
+        rrf_k: int = 60,
+        candidates: int = 20,
+        path: Optional[str] = None,
+        reload_interval_s: float = 2.0,
+    ):
+        self.dense = dense
+        self.bm25 = bm25
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.path = path
+        self.reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._stamp = self._mtime()
+
+    @classmethod
+    def from_path(cls, dense, path: str, **kwargs) -> "HybridVectorStore":
+        return cls(dense, BM25Index.load(path), path=path, **kwargs)
+
+    def __getattr__(self, name):
+        # upsert / delete / get_content_hashes / col ... go to the dense store
+        return getattr(self.dense, name)
+
+    def _mtime(self) -> Optional[int]:
+        if not self.path:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _current(self) -> BM25Index:
+        now = time.monotonic()
+        if self.path and now >= self._next_check:
+            self._next_check = now + self.reload_interval_s
+            stamp = self._mtime()
+            if stamp is not None and stamp != self._stamp and self._lock.acquire(blocking=False):
+                try:
+                    self.bm25 = BM25Index.load(self.path)
+                    self._stamp = stamp
+                except (OSError, ValueError, KeyError):
+                    pass  # save in progress; keep serving the old index
+                finally:
+                    self._lock.release()
+        return self.bm25
+
+    def index_version(self) -> str:
+        return f"{self.dense.index_version()}+bm25:{self._current().version}"
+
+    @instrumented("vector.fuse")
+    def _fuse(self, dense_res: Dict[str, Any], query_text: str, top_k: int) -> Dict[str, Any]:
+        """
+        Chroma-shaped result plus "rrf_scores". Hits found only by BM25 have no
+        dense distance; they report the furthest dense candidate's distance
+        (1.0 when there is none), so "distances" stays numeric and sortable.
+        """
+        bm25 = self._current()
+        fused: Dict[str, float] = {}
+        rows: Dict[str, Tuple[str, Dict[str, Any], float]] = {}
+
+        d_ids = dense_res.get("ids", [[]])[0]
+        d_docs = dense_res.get("documents", [[]])[0]
+        d_metas = dense_res.get("metadatas", [[]])[0]
+        d_dists = (dense_res.get("distances") or [[]])[0]
+        far = max((float(d) for d in d_dists if d is not None), default=1.0)
+        for rank, cid in enumerate(d_ids):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            dist = d_dists[rank] if rank < len(d_dists) and d_dists[rank] is not None else far
+            rows[cid] = (d_docs[rank], d_metas[rank] or {}, dist)
+
+        for rank, (i, _) in enumerate(bm25.search(query_text, self.candidates)):
+            cid = bm25.ids[i]
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            if cid not in rows:
+                rows[cid] = (bm25.documents[i], bm25.metadatas[i], far)
+
+        best = sorted(fused.items(), key=lambda x: -x[1])[:top_k]
+        return {
+            "ids": [[cid for cid, _ in best]],
+            "documents": [[rows[cid][0] for cid, _ in best]],
+            "metadatas": [[rows[cid][1] for cid, _ in best]],
+            "distances": [[rows[cid][2] for cid, _ in best]],
+            "rrf_scores": [[round(s, 6) for _, s in best]],
+        }
+
+    def query(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        if not query_text:
+            return self.dense.query(query_embedding, top_k=top_k)
+        dense_res = self.dense.query(query_embedding, top_k=max(top_k, self.candidates))
+        return self._fuse(dense_res, query_text, top_k)
+
+    async def query_async(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        if not query_text:
+            return await self.dense.query_async(query_embedding, top_k=top_k)
+        dense_res = await self.dense.query_async(query_embedding, top_k=max(top_k, self.candidates))
+        return self._fuse(dense_res, query_text, top_k)
@@ -1,4 +1,5 @@
-from typing import List, Dict
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
 
 def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[str]:
     text = " ".join(text.split())
@@ -18,11 +19,18 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[st
             break
     return chunks
 
-def build_page_chunks(pages: List[Dict], chunk_size: int = 1200, overlap: int = 150) -> List[Dict]:
+def build_page_chunks(
+    pages: List[Dict], chunk_size: int = 1200, overlap: int = 150, mode: str = "fixed"
+) -> List[Dict]:
     """
     pages: [{ "page": int, "text": str }]
     returns: [{ "page": int, "chunk_id": str, "text": str }]
+    mode="structured" splits on NG12 structure instead (see iter_structured_chunks);
+    chunk_size is then the upper bound and overlap is ignored.
     """
+    if mode == "structured":
+        return list(iter_structured_chunks(pages, max_chars=chunk_size))
+
     out = []
     for p in pages:
         page_num = p["page"]
@@ -31,3 +39,233 @@ def build_page_chunks(pages: List[Dict], chunk_size: int = 1200, overlap: int =
             chunk_id = f"ng12_{page_num:04d}_{idx:02d}"
             out.append({"page": page_num, "chunk_id": chunk_id, "text": ch})
     return out
+
+
+# ==========================
+# Structure-aware chunking
+# ==========================
+_FOOTER_START = "Suspected cancer: recognition and referral (NG12)"
+_FOOTER_END = re.compile(r"^Page \d+ of\s*$")
+_REC = re.compile(r"^(\d+\.\d+\.\d+)\s+\S")
+_REC_REF = re.compile(r"\[(\d+\.\d+\.\d+)\]")
+_SECTION = re.compile(r"^\d+\.\d+\s+[A-Z]")
+_PART = re.compile(
+    r"^(Recommendations (organised|on|for)\b|Terms used in this guideline|Rationale and impact|"
+    r"Context|Finding more information|Update information|Overview)"
+)
+# symptom tables repeat a column header, wrapped over one to three lines:
+# "Symptom and specific features Possible" / "cancer Recommendation"
+_TABLE_HEADER_END = re.compile(r"(^|\bPossible )cancer Recommendation$")
+_TABLE_HEADER_PART = re.compile(
+    r"^((Symptoms?|Investigation findings|Examination findings)( and)?( specific)?( features| signs)?( Possible)?"
+    r"|(specific )?features|Possible)$"
+)
+_BULLET = ("•", "－", "-", "–")
+_SENTENCE_END = re.compile(r"(?<=[.;:\]])\s+(?=[A-Z•－\[])")
+
+
+def _page_lines(text: str) -> List[str]:
+    """Non-empty lines with the NICE page footer removed."""
+    lines: List[str] = []
+    in_footer = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line == _FOOTER_START:
+            in_footer = True
+            continue
+        if in_footer:
+            if _FOOTER_END.match(line):
+                in_footer = False
+            continue
+        # page numbers and table-of-contents leaders carry nothing retrievable
+        if line and not line.isdigit() and "....." not in line:
+            lines.append(line)
+    return lines
+
+
+def _is_heading(line: str, prev: Optional[str]) -> bool:
+    """Short title-like line that does not continue the previous sentence."""
+    if len(line) > 60 or not line[0].isupper() or line.startswith(_BULLET):
+        return False
+    if line[-1] in ".,;:" or _REC_REF.search(line):
+        return False
+    return prev is None or prev[-1] in ".:]" or prev.endswith(")")
+
+
+class _Block:
+    __slots__ = ("kind", "page", "section", "heading", "recs", "lines")
+
+    def __init__(self, kind: str, page: int, section: str, heading: str, rec: str = ""):
+        self.kind = kind
+        self.page = page
+        self.section = section
+        self.heading = heading
+        self.recs: List[str] = [rec] if rec else []
+        self.lines: List[str] = []
+
+    def add(self, line: str) -> None:
+        if self.kind == "table":
+            self.recs.extend(r for r in _REC_REF.findall(line) if r not in self.recs)
+        self.lines.append(line)
+
+    def text(self) -> str:
+        # wrapped lines are re-joined; list items (and table rows, which end
+        # with a recommendation reference) keep their own line
+        out: List[str] = []
+        for line in self.lines:
+            if not out:
+                out.append(line)
+            elif self.kind == "table":
+                if _REC_REF.search(out[-1]) and not _REC_REF.match(line):
+                    out.append(line)
+                else:
+                    out[-1] += " " + line
+            elif line.startswith(_BULLET):
+                out.append(line)
+            else:
+                out[-1] += " " + line
+        return "\n".join(out)
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Split on line, then sentence, then word boundaries so no piece exceeds max_chars."""
+    if len(text) <= max_chars:
+        return [text]
+    units: List[str] = []
+    for line in text.split("\n"):
+        for unit in (_SENTENCE_END.split(line) if len(line) > max_chars else [line]):
+            while len(unit) > max_chars:
+                cut = unit.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                units.append(unit[:cut])
+                unit = unit[cut:].lstrip()
+            units.append(unit)
+    pieces: List[str] = []
+    cur = ""
+    for u in units:
+        if cur and len(cur) + 1 + len(u) > max_chars:
+            pieces.append(cur)
+            cur = u
+        else:
+            cur = f"{cur}\n{u}" if cur else u
+    if cur:
+        pieces.append(cur)
+    return pieces
+
+
+def _iter_blocks(pages: Iterable[Dict]) -> Iterator[_Block]:
+    """Recommendation / table / prose blocks, in document order, across page breaks."""
+    section = heading = ""
+    block: Optional[_Block] = None
+    prev: Optional[str] = None
+    title_open = False  # part titles wrap onto a second line
+
+    for p in pages:
+        page_num = p["page"]
+        for line in _page_lines(p["text"]):
+            if title_open and line[0].islower():
+                section += " " + line
+                prev = None
+                continue
+            title_open = False
+
+            rec = _REC.match(line)
+            if rec:
+                if block is not None:
+                    yield block
+                block = _Block("recommendation", page_num, section, heading, rec.group(1))
+
+            elif (_SECTION.match(line) or _PART.match(line)) and len(line) <= 80:
+                if block is not None:
+                    yield block
+                block = None
+                section, heading = line, ""
+                title_open = bool(_PART.match(line))
+                prev = None
+                continue
+
+            elif _TABLE_HEADER_END.search(line):
+                # drop the wrapped column header; the line before it titles the table
+                lines = block.lines if block is not None else []
+                while lines and _TABLE_HEADER_PART.match(lines[-1]):
+                    lines.pop()
+                title = lines.pop() if lines and _is_heading(lines[-1], None) else None
+                if title is None and block is not None and block.kind == "table":
+                    prev = line
+                    continue  # same table, header repeated after a page break
+                if block is not None and block.lines:
+                    yield block
+                heading = title or heading
+                block = _Block("table", page_num, section, heading)
+                prev = line
+                continue
+
+            elif block is not None and block.kind == "table":
+                pass  # rows are only split at recommendation references (see _Block.text)
+
+            elif _is_heading(line, prev):
+                if block is not None:
+                    yield block
+                heading = line
+                block = _Block("text", page_num, section, heading)
+
+            elif block is None:
+                block = _Block("text", page_num, section, heading)
+
+            block.add(line)
+            prev = line
+
+    if block is not None:
+        yield block
+
+
+def iter_structured_chunks(pages: Iterable[Dict], max_chars: int = 1200, min_chars: int = 200) -> Iterator[Dict]:
+    """
+    Variable-size, non-overlapping chunks that follow NG12 structure: one chunk
+    per numbered recommendation (1.3.2 ...), prose grouped under its heading,
+    and symptom tables split only between rows. Recommendations that continue
+    onto the next page stay whole and keep the page they start on. Pages may be
+    a stream; chunk ids stay `ng12_<page>_<n>` like the fixed chunker.
+
+    Extra keys per chunk: section ("1.3 Lower gastrointestinal tract cancers"),
+    heading ("Colorectal cancer"), kind (recommendation | table | text) and
+    recommendations (comma-joined ids such as "1.3.1,1.3.2").
+    """
+    counters: Dict[int, int] = {}
+    pending: Optional[Dict] = None
+
+    def _emit(c: Dict) -> Dict:
+        idx = counters.get(c["page"], 0)
+        counters[c["page"]] = idx + 1
+        c["chunk_id"] = f"ng12_{c['page']:04d}_{idx:02d}"
+        return c
+
+    for block in _iter_blocks(pages):
+        text = block.text()
+        if not text:
+            continue
+        if block.kind == "text" and block.heading and text == block.heading:
+            continue  # bare heading; already carried in metadata
+        for piece in _split_long(text, max_chars):
+            chunk = {
+                "page": block.page,
+                "text": piece,
+                "section": block.section,
+                "heading": block.heading,
+                "kind": block.kind,
+                "recommendations": ",".join(block.recs),
+            }
+            # tiny prose fragments (glossary entries, intros) are merged forward within a section
+            if pending is not None:
+                same = chunk["kind"] == "text" and chunk["section"] == pending["section"]
+                if same and len(pending["text"]) + len(piece) + 1 <= max_chars:
+                    pending["text"] += "\n" + piece
+                    continue
+                yield _emit(pending)
+                pending = None
+            if chunk["kind"] == "text" and len(piece) < min_chars:
+                pending = chunk
+            else:
+                yield _emit(chunk)
+    if pending is not None:
+        yield _emit(pending)
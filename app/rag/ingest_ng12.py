@@ -1,9 +1,17 @@
+import argparse
+import hashlib
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Tuple
+
 import requests
 from pypdf import PdfReader
 from app.config import settings
-from app.rag.chunking import build_page_chunks
+from app.rag.chunking import build_page_chunks, iter_structured_chunks
 from app.rag.vector_store import VectorStore
+from app.rag.numpy_store import export_index
+from app.rag.bm25 import build_from_store
+from app.rag import symptom_index
 from app.llm.gemini_client import GeminiClient
 
 NG12_URL = "https://www.nice.org.uk/guidance/ng12/resources/suspected-cancer-recognition-and-referral-pdf-1837268071621"
@@ -18,51 +26,174 @@ def download_pdf(dest_path: str):
     with open(dest_path, "wb") as f:
         f.write(r.content)
 
-def extract_pages(pdf_path: str):
+def _extract_range(job: Tuple[str, int, int]) -> List[Dict]:
+    pdf_path, start, end = job
     reader = PdfReader(pdf_path)
-    pages = []
     # NOTE: pypdf pages are 0-indexed; we store human page numbers as 1-indexed.
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
-        pages.append({"page": i + 1, "text": text})
-    return pages
+    return [
+        {"page": i + 1, "text": reader.pages[i].extract_text() or ""}
+        for i in range(start, end)
+    ]
+
+def iter_pages(pdf_path: str, workers: int = 0, pages_per_job: int = 8) -> Iterator[Dict]:
+    """
+    Yield {"page", "text"} in page order. With workers > 1, page ranges are
+    extracted in a process pool (pypdf text extraction is CPU bound).
+    """
+    n_pages = len(PdfReader(pdf_path).pages)
+    jobs = [(pdf_path, s, min(s + pages_per_job, n_pages)) for s in range(0, n_pages, pages_per_job)]
+
+    if workers <= 1:
+        for job in jobs:
+            yield from _extract_range(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for pages in pool.map(_extract_range, jobs):
+            yield from pages
+
+def extract_pages(pdf_path: str):
+    return list(iter_pages(pdf_path))
+
+def content_hash(text: str, chunker: str = "fixed") -> str:
+    # embed model and chunker are part of the hash: switching either re-embeds everything
+    return hashlib.sha1(f"{settings.embed_model}\0{chunker}\0{text}".encode("utf-8")).hexdigest()[:16]
+
+def iter_chunks(
+    pages: Iterator[Dict], chunk_size: int = 1200, overlap: int = 150, chunker: str = "fixed"
+) -> Iterator[Dict]:
+    if chunker == "structured":
+        # recommendations may continue on the next page, so the chunker sees the whole stream
+        chunks = iter_structured_chunks(pages, max_chars=chunk_size)
+    else:
+        chunks = (c for p in pages for c in build_page_chunks([p], chunk_size=chunk_size, overlap=overlap))
+    for c in chunks:
+        c["content_hash"] = content_hash(c["text"], chunker)
+        yield c
+
+def chunk_metadata(c: Dict) -> Dict:
+    meta = {"page": c["page"], "chunk_id": c["chunk_id"], "source": "NG12 PDF",
+            "content_hash": c["content_hash"]}
+    # empty for fixed chunks; always written because Chroma upserts merge metadata keys
+    for key in ("section", "heading", "kind", "recommendations"):
+        meta[key] = c.get(key, "")
+    return meta
+
+def _batches(items: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ingest(
+    pdf_path: str,
+    store: VectorStore,
+    gem: GeminiClient,
+    workers: int = 4,
+    embed_concurrency: int = 4,
+    batch_size: int = 64,
+    full: bool = False,
+    chunker: str = settings.chunker,
+) -> Dict[str, int]:
+    """
+    Streaming, incremental ingestion:
+      pages (process pool) -> chunks + content hash -> skip unchanged ->
+      embed batches (bounded threads) -> upsert each batch -> delete stale ids
+    """
+    existing = {} if full else store.get_content_hashes()
+
+    seen: Dict[str, str] = {}
+    stats = {"chunks": 0, "unchanged": 0, "embedded": 0, "deleted": 0}
+
+    def _changed() -> Iterator[Dict]:
+        for c in iter_chunks(iter_pages(pdf_path, workers=workers), chunker=chunker):
+            seen[c["chunk_id"]] = c["content_hash"]
+            stats["chunks"] += 1
+            if existing.get(c["chunk_id"]) == c["content_hash"]:
+                stats["unchanged"] += 1
+                continue
+            yield c
+
+    def _embed_and_upsert(batch: List[Dict]) -> int:
+        embs = gem.embed_texts([c["text"] for c in batch])
+        store.upsert(
+            ids=[c["chunk_id"] for c in batch],
+            documents=[c["text"] for c in batch],
+            embeddings=embs,
+            metadatas=[chunk_metadata(c) for c in batch],
+        )
+        return len(batch)
+
+    with ThreadPoolExecutor(max_workers=max(1, embed_concurrency)) as pool:
+        inflight = set()
+        for batch in _batches(_changed(), batch_size):
+            inflight.add(pool.submit(_embed_and_upsert, batch))
+            if len(inflight) >= embed_concurrency * 2:
+                finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                stats["embedded"] += sum(f.result() for f in finished)
+        finished, _ = wait(inflight)
+        stats["embedded"] += sum(f.result() for f in finished)
+
+    if not seen:
+        raise RuntimeError("No text extracted from PDF. Check PDF download or parsing.")
+
+    previous = store.get_content_hashes() if full else existing
+    stale = [cid for cid in previous if cid not in seen]
+    for start in range(0, len(stale), 500):
+        store.delete(stale[start:start + 500])
+    stats["deleted"] = len(stale)
+
+    # new version => cached assessments built on the old index are dropped
+    digest = hashlib.sha1(settings.embed_model.encode("utf-8"))
+    for cid in sorted(seen):
+        digest.update(f"{cid}\0{seen[cid]}\0".encode("utf-8"))
+    store.write_index_version(digest.hexdigest()[:16])
+
+    return stats
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest the NG12 PDF into the vector store.")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="processes for PDF text extraction")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="parallel embed calls")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per embed call / upsert")
+    parser.add_argument("--full", action="store_true", help="re-embed every chunk, ignoring content hashes")
+    parser.add_argument("--chunker", choices=["structured", "fixed"], default=settings.chunker,
+                        help="structured = split on NG12 recommendations/tables, fixed = 1200-char windows")
+    parser.add_argument("--no-export", action="store_true", help="skip exporting the numpy retriever index")
+    args = parser.parse_args()
+
     if not settings.google_cloud_project and settings.use_vertexai:
         raise RuntimeError("GOOGLE_CLOUD_PROJECT is required when GOOGLE_GENAI_USE_VERTEXAI=True")
 
     download_pdf(settings.pdf_path)
-    pages = extract_pages(settings.pdf_path)
-
-    chunks = build_page_chunks(pages, chunk_size=1200, overlap=150)
-    if not chunks:
-        raise RuntimeError("No text extracted from PDF. Check PDF download or parsing.")
 
-    gem = GeminiClient()
     store = VectorStore()
+    stats = ingest(
+        settings.pdf_path,
+        store=store,
+        gem=GeminiClient(),
+        workers=args.workers,
+        embed_concurrency=args.embed_concurrency,
+        batch_size=args.batch_size,
+        full=args.full,
+        chunker=args.chunker,
+    )
 
-    # Batch embeddings (safe default: 64)
-    batch_size = 64
-    all_ids, all_docs, all_metas, all_embs = [], [], [], []
+    if not args.no_export:
+        export_index(store, settings.numpy_index_dir)
+    build_from_store(store, settings.bm25_path)
+    symptoms = symptom_index.build_from_store(store, settings.symptom_index_path)
 
-    for c in chunks:
-        all_ids.append(c["chunk_id"])
-        all_docs.append(c["text"])
-        all_metas.append({"page": c["page"], "chunk_id": c["chunk_id"], "source": "NG12 PDF"})
-
-    for start in range(0, len(all_docs), batch_size):
-        docs_batch = all_docs[start:start+batch_size]
-        embs = gem.embed_texts(docs_batch)
-        all_embs.extend(embs)
-
-    store.upsert(
-        ids=all_ids,
-        documents=all_docs,
-        embeddings=all_embs,
-        metadatas=all_metas
+    print(
+        f"✅ Ingested {stats['chunks']} chunks into Chroma at: {settings.chroma_dir} "
+        f"(embedded {stats['embedded']}, unchanged {stats['unchanged']}, deleted {stats['deleted']}); "
+        f"symptom index: {len(symptoms)} terms"
     )
 
-    print(f"✅ Ingested {len(all_docs)} chunks into Chroma at: {settings.chroma_dir}")
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import instrumented
+
+MANIFEST = "chunks.json"
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (mat / norms).astype(np.float32, copy=False)
+
+
+def export_index(store, out_dir: str = settings.numpy_index_dir) -> str:
+    """
+    Dump a Chroma-backed VectorStore into `out_dir`:
+      embeddings-<version>.npy  contiguous float32 (n, dim), rows L2-normalized
+      chunks.json               ids / documents / metadatas / version / matrix file name
+    The manifest is replaced last, so readers never see a half-written index.
+    """
+    res = store.col.get(include=["embeddings", "documents", "metadatas"])
+    ids = list(res.get("ids") or [])
+    if ids:
+        mat = _normalize_rows(np.asarray(res["embeddings"], dtype=np.float32))
+    else:
+        mat = np.zeros((0, 0), dtype=np.float32)
+    version = store.index_version()
+
+    os.makedirs(out_dir, exist_ok=True)
+    matrix_name = f"embeddings-{version.split(':')[-1]}.npy"
+    tmp_matrix = os.path.join(out_dir, f".{matrix_name}.tmp")
+    with open(tmp_matrix, "wb") as f:
+        np.save(f, np.ascontiguousarray(mat))
+    os.replace(tmp_matrix, os.path.join(out_dir, matrix_name))
+
+    manifest = {
+        "version": version,
+        "matrix": matrix_name,
+        "ids": ids,
+        "documents": list(res.get("documents") or []),
+        "metadatas": list(res.get("metadatas") or []),
+    }
+    tmp_manifest = os.path.join(out_dir, f".{MANIFEST}.tmp")
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, os.path.join(out_dir, MANIFEST))
+
+    # drop matrices from older exports
+    for name in os.listdir(out_dir):
+        if name.startswith("embeddings-") and name.endswith(".npy") and name != matrix_name:
+            try:
+                os.remove(os.path.join(out_dir, name))
+            except OSError:
+                pass
+    return version
+
+
+class _Loaded:
+    __slots__ = ("stamp", "version", "matrix", "ids", "documents", "metadatas")
+
+
+class NumpyVectorStore:
+    """
+    Read-only exact-cosine retriever over an exported index (see `export_index`).
+
+    The embedding matrix is memory-mapped, so every worker process shares the
+    same OS page cache. `query` is one mat-vec product + argpartition;
+    `query_many` answers several embeddings with a single mat-mat product.
+    Result dicts have the same shape as Chroma's `collection.query`.
+    """
+
+    def __init__(self, index_dir: str = settings.numpy_index_dir, reload_interval_s: float = 2.0):
+        self.index_dir = index_dir
+        self.reload_interval_s = reload_interval_s
+        self._manifest_path = os.path.join(index_dir, MANIFEST)
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._data = self._load()
+
+    def _load(self) -> _Loaded:
+        stamp = os.stat(self._manifest_path).st_mtime_ns
+        with open(self._manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        d = _Loaded()
+        d.stamp = stamp
+        d.version = manifest["version"]
+        d.ids = manifest["ids"]
+        d.documents = manifest["documents"]
+        d.metadatas = manifest["metadatas"]
+        d.matrix = np.load(os.path.join(self.index_dir, manifest["matrix"]), mmap_mode="r")
+        return d
+
+    def _current(self) -> _Loaded:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.reload_interval_s
+            try:
+                changed = os.stat(self._manifest_path).st_mtime_ns != self._data.stamp
+            except OSError:
+                changed = False
+            if changed and self._lock.acquire(blocking=False):
+                try:
+                    self._data = self._load()
+                except (OSError, ValueError, KeyError):
+                    pass  # export in progress; keep serving the old index
+                finally:
+                    self._lock.release()
+        return self._data
+
+    def _result(self, d: _Loaded, idx: np.ndarray, scores: np.ndarray) -> Dict[str, List[Any]]:
+        return {
+            "ids": [d.ids[i] for i in idx],
+            "documents": [d.documents[i] for i in idx],
+            "metadatas": [d.metadatas[i] for i in idx],
+            # Chroma "cosine" space reports distance = 1 - cosine similarity
+            "distances": [float(1.0 - scores[i]) for i in idx],
+        }
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if k >= scores.shape[0]:
+            part = np.arange(scores.shape[0])
+        else:
+            part = np.argpartition(-scores, k - 1)[:k]
+        # stable sort on (-score, row) so ties resolve deterministically
+        return part[np.lexsort((part, -scores[part]))]
+
+    @instrumented("vector.query")
+    def query_many(self, query_embeddings: List[List[float]], top_k: int = 5) -> List[Dict[str, List[Any]]]:
+        d = self._current()
+        n = d.matrix.shape[0]
+        if n == 0 or not len(query_embeddings):
+            return [{"ids": [], "documents": [], "metadatas": [], "distances": []} for _ in query_embeddings]
+
+        q = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        scores = q @ d.matrix.T  # (m, n)
+        k = max(1, min(int(top_k), n))
+        return [self._result(d, self._top_k(row, k), row) for row in scores]
+
+    def query(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        r = self.query_many([query_embedding], top_k=top_k)[0]
+        # wrap like Chroma: one inner list per query embedding
+        return {key: [val] for key, val in r.items()}
+
+    async def query_async(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        # microseconds of numpy work; not worth a thread hop
+        return self.query(query_embedding, top_k=top_k)
+
+    def index_version(self) -> str:
+        return self._current().version
+
+    def __len__(self) -> int:
+        return int(self._current().matrix.shape[0])
+
+
+def compare_with_chroma(top_k: int = 5, n_queries: int = 50, seed: int = 0) -> Dict[str, float]:
+    """
+    Run the same queries through Chroma and the numpy index; report how often
+    the top_k id lists match exactly. Queries are perturbed stored embeddings.
+    """
+    from app.rag.vector_store import VectorStore
+
+    chroma = VectorStore()
+    npstore = NumpyVectorStore()
+    base = np.asarray(npstore._current().matrix)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(base.shape[0], size=min(n_queries, base.shape[0]), replace=False)
+
+    exact = 0
+    for i in picks:
+        q = base[i] + rng.normal(0, 0.01, size=base.shape[1]).astype(np.float32)
+        a = chroma.query(q.tolist(), top_k=top_k)["ids"][0]
+        b = npstore.query(q.tolist(), top_k=top_k)["ids"][0]
+        exact += int(a == b)
+    return {"queries": len(picks), "exact_match_rate": exact / max(1, len(picks))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / check the in-process numpy retriever index.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("export", help="export the Chroma collection to NUMPY_INDEX_DIR")
+    cmp_ = sub.add_parser("compare", help="compare top_k results against Chroma")
+    cmp_.add_argument("--top-k", type=int, default=settings.top_k)
+    cmp_.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        from app.rag.vector_store import VectorStore
+
+        version = export_index(VectorStore())
+        print(f"✅ Exported numpy index {version} to {settings.numpy_index_dir}")
+    else:
+        print(json.dumps(compare_with_chroma(args.top_k, args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
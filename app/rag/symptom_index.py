@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.rag.bm25 import tokenize
+
+_BULLET = re.compile(r"^[•－\-–]\s*")
+_TRAILER = re.compile(r"(\s*\[\d{4}[^\]]*\])?[.:;,]?\s*(\b(or|and)\b)?\s*$")
+_MIN_AGE = re.compile(r"\baged (\d+) (?:and|or) (?:over|older)\b|\b(\d+) and over\b")
+_MAX_AGE = re.compile(r"\baged (?:under|younger than) (\d+)\b")
+_CHILDREN = re.compile(r"\bchildren\b|\byoung people\b")
+_ADULTS = re.compile(r"\badults?\b")
+_TERM_SPLIT = re.compile(r",\s*|\s+(?:and/or|or)\s+")
+_ROW_SYMPTOM = re.compile(r"^([A-Z][\w\- ]+?)\s*(?:\(|,| with | in )")
+_REC_REF = re.compile(r"\[?(\d+\.\d+\.\d+)\]")
+
+# patient wording that qualifies a symptom but never names one
+_MODIFIERS = frozenset(tokenize(
+    "unexplained persistent recurrent frequent new onset visible severe chronic ongoing worsening sudden"
+))
+MAX_TERM_WORDS = 4
+
+
+def term_key(text: str) -> str:
+    """Match key for a symptom term: bm25 tokens (stopwords dropped, ae/oe folded, plurals stripped)."""
+    return " ".join(tokenize(text))
+
+
+def _bounds(text: str) -> Tuple[Optional[int], Optional[int]]:
+    mins = [int(a or b) for a, b in _MIN_AGE.findall(text)]
+    maxs = [int(a) for a in _MAX_AGE.findall(text)]
+    lowered = text.lower()
+    if _CHILDREN.search(lowered) and not _ADULTS.search(lowered):
+        maxs.append(24)  # NG12: children = birth to 15, young people = 16 to 24
+    return (min(mins) if mins else None), (max(maxs) if maxs else None)
+
+
+def age_bounds(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    (min_age, max_age) a recommendation applies to; None where it sets no bound.
+    A bound in the lead sentence covers the whole recommendation; otherwise it
+    only holds if every top-level bullet ("• aged 50 and over with ...") states one.
+    """
+    lead, *branches = text.split("\n• ")
+    lo, hi = _bounds(lead)
+    if lo is not None or hi is not None or not branches:
+        return lo, hi
+    bounds = [_bounds(b) for b in branches]
+    los = [b[0] for b in bounds]
+    his = [b[1] for b in bounds]
+    return (
+        min(los) if None not in los else None,
+        max(his) if None not in his else None,
+    )
+
+
+def _bullet_terms(text: str) -> List[str]:
+    out = []
+    for line in text.split("\n"):
+        if not _BULLET.match(line):
+            continue
+        term = _TRAILER.sub("", _BULLET.sub("", line)).strip()
+        if term and len(term.split()) <= MAX_TERM_WORDS:
+            out.append(term)
+    return out
+
+
+def _heading_terms(heading: str) -> List[str]:
+    # "Bleeding, bruising or petechiae" -> bleeding / bruising / petechiae
+    return [t for t in _TERM_SPLIT.split(heading.strip()) if t and len(t.split()) <= MAX_TERM_WORDS]
+
+
+def _row_terms(table_text: str) -> List[Tuple[str, List[str]]]:
+    # "Breast lump (unexplained) with or without pain, 30 and over Breast Refer ... [1.4.1]"
+    out = []
+    for row in table_text.split("\n"):
+        m = _ROW_SYMPTOM.match(row)
+        recs = _REC_REF.findall(row)
+        if m and recs:
+            out.extend((t, recs) for t in _heading_terms(m.group(1)))
+    return out
+
+
+def build_symptom_index(ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    symptom term -> recommendation chunks -> age thresholds, from structured chunks:
+      - bullet items of a recommendation ("• haemoptysis") point at that recommendation
+      - symptom-table titles ("Haemoptysis") point at every recommendation the table cites
+      - symptom-table rows ("Breast lump (unexplained), 30 and over ... [1.4.1]") point at the
+        recommendations cited on that row
+    Fixed-size chunks carry no structure metadata and yield an empty index.
+    """
+    chunks: Dict[str, Dict[str, Any]] = {}
+    rec_chunks: Dict[str, List[str]] = {}
+    terms: Dict[str, List[str]] = {}
+
+    def _add(term: str, chunk_ids: List[str]) -> None:
+        key = term_key(term)
+        if not key or not chunk_ids:
+            return
+        bucket = terms.setdefault(key, [])
+        bucket.extend(c for c in chunk_ids if c not in bucket)
+
+    for order, (cid, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+        meta = meta or {}
+        if meta.get("kind") != "recommendation":
+            continue
+        lo, hi = age_bounds(doc)
+        chunks[cid] = {
+            "text": doc,
+            "page": meta.get("page", -1),
+            "source": meta.get("source", "NG12 PDF"),
+            "recommendation": meta.get("recommendations", ""),
+            "min_age": lo,
+            "max_age": hi,
+            "order": order,
+        }
+        rec_chunks.setdefault(meta.get("recommendations", ""), []).append(cid)
+        for term in _bullet_terms(doc):
+            _add(term, [cid])
+
+    def _cited(recs: List[str]) -> List[str]:
+        return [c for rec in recs for c in rec_chunks.get(rec, [])]
+
+    for doc, meta in zip(documents, metadatas):
+        meta = meta or {}
+        if meta.get("kind") != "table":
+            continue
+        for term, recs in _row_terms(doc):
+            _add(term, _cited(recs))
+        cited = _cited((meta.get("recommendations") or "").split(","))
+        if cited and meta.get("heading"):
+            for term in _heading_terms(meta["heading"]):
+                _add(term, cited)
+
+    return {"chunks": chunks, "terms": terms}
+
+
+def build_from_store(store, path: str = settings.symptom_index_path) -> "SymptomIndex":
+    """Build + persist the symptom index from everything currently in the Chroma collection."""
+    res = store.col.get(include=["documents", "metadatas"])
+    ids = list(res.get("ids") or [])
+    metas = [m or {} for m in (res.get("metadatas") or [])]
+    docs = list(res.get("documents") or [])
+    # document order (page, then position on the page) so ties rank like the guideline
+    order = sorted(range(len(ids)), key=lambda i: ids[i])
+    data = build_symptom_index([ids[i] for i in order], [docs[i] for i in order], [metas[i] for i in order])
+    data["version"] = store.index_version()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+    return SymptomIndex(data)
+
+
+class SymptomIndex:
+    """
+    Deterministic evidence lookup for known symptoms, no embedding or vector
+    query. A patient symptom is known when, after dropping qualifiers such as
+    "unexplained" or "persistent", its tokens are exactly a term in the index
+    ("unexplained hemoptysis" -> "haemoptysis").
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = data.get("version", "")
+        self.chunks: Dict[str, Dict[str, Any]] = data.get("chunks", {})
+        self.terms: Dict[str, List[str]] = data.get("terms", {})
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def match(self, symptom: str) -> List[str]:
+        """Chunk ids for one patient symptom ([] = unknown term)."""
+        toks = tokenize(symptom)
+        key = " ".join(toks)
+        if key in self.terms:
+            return self.terms[key]
+        core = " ".join(t for t in toks if t not in _MODIFIERS)
+        return self.terms.get(core, []) if core else []
+
+    def _eligible(self, cid: str, age: Optional[int]) -> bool:
+        c = self.chunks[cid]
+        if age is None:
+            return True
+        return (c["min_age"] is None or age >= c["min_age"]) and (c["max_age"] is None or age <= c["max_age"])
+
+    def lookup(self, symptoms: List[str], age: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        (evidence rows, unknown symptoms). Rows are shaped like
+        `rows_from_query_result` and ranked by: age threshold met, number of
+        the patient's symptoms the recommendation covers, then round-robin
+        over symptoms in guideline order, so one symptom with many
+        recommendations does not crowd out the others.
+        """
+        hits: Dict[str, int] = {}
+        best_round: Dict[str, int] = {}
+        unknown: List[str] = []
+        for s in symptoms:
+            found = [c for c in self.match(s) if c in self.chunks]
+            if not found:
+                unknown.append(s)
+                continue
+            found.sort(key=lambda c: (not self._eligible(c, age), self.chunks[c]["order"]))
+            for rnd, cid in enumerate(found):
+                hits[cid] = hits.get(cid, 0) + 1
+                best_round[cid] = min(rnd, best_round.get(cid, rnd))
+
+        def _rank(cid: str):
+            return (not self._eligible(cid, age), -hits[cid], best_round[cid], self.chunks[cid]["order"])
+
+        rows = []
+        for cid in sorted(hits, key=_rank)[:limit]:
+            c = self.chunks[cid]
+            rows.append({"text": c["text"], "page": c["page"], "chunk_id": cid, "source": c["source"]})
+        return rows, unknown
+
+
+class _FileSymptomIndex:
+    """Reloads the persisted index when ingest rewrites it (checked at most every `reload_interval_s`)."""
+
+    def __init__(self, path: str, reload_interval_s: float = 2.0):
+        self.path = path
+        self.reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._stamp = None
+        self._index: Optional[SymptomIndex] = None
+
+    def current(self) -> Optional[SymptomIndex]:
+        now = time.monotonic()
+        if now >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = now + self.reload_interval_s
+                try:
+                    stamp = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    stamp = None
+                if stamp != self._stamp:
+                    self._index = self._load() if stamp is not None else None
+                    self._stamp = stamp
+            finally:
+                self._lock.release()
+        return self._index
+
+    def _load(self) -> Optional[SymptomIndex]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return SymptomIndex(json.load(f))
+        except (OSError, ValueError):
+            return self._index  # half-written; keep the previous one
+
+
+_shared: Optional[_FileSymptomIndex] = None
+_shared_lock = threading.Lock()
+
+
+def get_symptom_index() -> Optional[SymptomIndex]:
+    """Process-wide symptom index, or None when SYMPTOM_FAST_PATH is off or ingest has not built one."""
+    global _shared
+    if not settings.symptom_fast_path:
+        return None
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = _FileSymptomIndex(settings.symptom_index_path)
+    return _shared.current()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / inspect the NG12 symptom lookup index.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build", help="rebuild SYMPTOM_INDEX_PATH from the Chroma collection")
+    look = sub.add_parser("lookup", help="show the evidence a patient's symptoms resolve to")
+    look.add_argument("symptoms", nargs="+")
+    look.add_argument("--age", type=int, default=None)
+    look.add_argument("--top-k", type=int, default=settings.top_k)
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        from app.rag.vector_store import VectorStore
+
+        index = build_from_store(VectorStore(), settings.symptom_index_path)
+        print(f"✅ Symptom index: {len(index)} terms -> {settings.symptom_index_path}")
+        return
+
+    with open(settings.symptom_index_path, "r", encoding="utf-8") as f:
+        index = SymptomIndex(json.load(f))
+    rows, unknown = index.lookup(args.symptoms, args.age, args.top_k)
+    print(json.dumps({"unknown": unknown, "evidence": [(r["chunk_id"], r["text"][:120]) for r in rows]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
-from typing import List, Dict, Any
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+import os
+import time
+from typing import List, Dict, Any, Optional
 from app.config import settings
+from app.concurrency import run_blocking
+from app.metrics import instrumented
 
 class VectorStore:
     def __init__(self, persist_dir: str = settings.chroma_dir, collection: str = "ng12"):
+        self.persist_dir = persist_dir
+        self.collection = collection
+        self._version_path = os.path.join(persist_dir, f"{collection}.version")
+        self._fallback_version = ("", 0.0)
+
+        # imported here so workers on the numpy backend never pay for chromadb
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
         self.client = chromadb.PersistentClient(
             path=persist_dir,
             settings=ChromaSettings(anonymized_telemetry=False)
@@ -14,9 +25,80 @@ class VectorStore:
     def upsert(self, ids: List[str], documents: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]):
         self.col.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
 
-    def query(self, query_embedding: List[float], top_k: int = 5):
+    def delete(self, ids: List[str]):
+        if ids:
+            self.col.delete(ids=ids)
+
+    def get_content_hashes(self) -> Dict[str, str]:
+        """{chunk id: content_hash} for every stored chunk ("" if ingested before hashing)."""
+        res = self.col.get(include=["metadatas"])
+        return {
+            cid: (meta or {}).get("content_hash", "")
+            for cid, meta in zip(res.get("ids", []), res.get("metadatas") or [])
+        }
+
+    @instrumented("vector.query")
+    def query(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        # query_text is only used by the hybrid wrapper
         return self.col.query(
             query_embeddings=[query_embedding],
             n_results=top_k,
             include=["documents", "metadatas", "distances"]
         )
+
+    # ==========================
+    # Index version (cache invalidation)
+    # ==========================
+    def index_version(self) -> str:
+        """
+        Fingerprint of the current NG12 index. Ingestion writes it to
+        `<persist_dir>/<collection>.version`; changes whenever the index is re-ingested.
+        """
+        try:
+            with open(self._version_path, "r", encoding="utf-8") as f:
+                return f"{self.collection}:{f.read().strip()}"
+        except OSError:
+            pass
+
+        # never stamped (older ingest): fall back to collection id + size, re-read every 30s
+        version, checked_at = self._fallback_version
+        now = time.monotonic()
+        if not version or now - checked_at > 30.0:
+            version = f"{self.collection}:{self.col.id}:{self.col.count()}"
+            self._fallback_version = (version, now)
+        return version
+
+    def write_index_version(self, version: str) -> None:
+        tmp = self._version_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp, self._version_path)
+
+    async def query_async(self, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None):
+        return await run_blocking(self.query, query_embedding, top_k=top_k)
+
+
+def make_vector_store():
+    """
+    VectorStore for the configured VECTOR_BACKEND (chroma | numpy), wrapped
+    for BM25 hybrid retrieval when RETRIEVAL_MODE=hybrid and the lexical index exists
+    (reloaded whenever ingestion rewrites it).
+    """
+    if settings.vector_backend == "numpy":
+        from app.rag.numpy_store import NumpyVectorStore
+
+        store = NumpyVectorStore()
+    else:
+        store = VectorStore()
+
+    if settings.retrieval_mode == "hybrid" and os.path.exists(settings.bm25_path):
+        from app.rag.bm25 import HybridVectorStore
+
+        # re-reads bm25.json when a re-ingest replaces it
+        store = HybridVectorStore.from_path(
+            store,
+            settings.bm25_path,
+            rrf_k=settings.rrf_k,
+            candidates=settings.hybrid_candidates,
+        )
+    return store
@@ -0,0 +1,207 @@
+"""
+Per-process service container.
+
+Every heavy dependency is built once, on first use, and shared: one genai
+client (credentials and config resolved once; google-genai 0.7 still opens a
+new HTTP session per request, so there is no connection pool to share) behind
+the sync + async Gemini wrappers, one vector index (Chroma client / numpy
+matrix / BM25), one patient store, one chat store. Endpoints receive them
+through the FastAPI dependencies at the bottom of this module, so the app
+module imports in milliseconds and /health answers while `warmup()` builds
+the rest in the background.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.concurrency import run_blocking
+
+# cold start is measured from here: app.main imports this module first thing at startup
+_IMPORTED_AT = time.perf_counter()
+
+COMPONENTS = (
+    "genai_client",
+    "gem",
+    "agem",
+    "vector_store",
+    "patient_store",
+    "chat_store",
+    "assessor",
+    "chat_agent",
+)
+
+
+class Services:
+    """
+    Lazily built, process-wide dependencies. Components passed to the
+    constructor (e.g. stub clients from app.llm.stub_client) are used as is.
+    """
+
+    def __init__(self, **components: Any):
+        unknown = set(components) - set(COMPONENTS)
+        if unknown:
+            raise ValueError(f"Unknown service components: {sorted(unknown)}")
+        self._built: Dict[str, Any] = {k: v for k, v in components.items() if v is not None}
+        self._locks = {name: threading.Lock() for name in COMPONENTS}
+        self.build_ms: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.warmup_ms: Optional[float] = None
+        self.cold_start_ms: Optional[float] = None
+
+    # ==========================
+    # Factories
+    # ==========================
+    def _make_genai_client(self):
+        from app.llm.gemini_client import make_genai_client
+
+        return make_genai_client()
+
+    def _make_gem(self):
+        from app.llm.gemini_client import GeminiClient
+
+        return GeminiClient(client=self.get("genai_client"))
+
+    def _make_agem(self):
+        from app.llm.gemini_client import AsyncGeminiClient
+
+        return AsyncGeminiClient(client=self.get("genai_client"))
+
+    def _make_vector_store(self):
+        from app.rag.vector_store import make_vector_store
+
+        return make_vector_store()
+
+    def _make_patient_store(self):
+        from app.patient_store import PatientStore
+
+        return PatientStore()
+
+    def _make_chat_store(self):
+        from app.chat_store import open_chat_store
+
+        return open_chat_store()
+
+    def _make_assessor(self):
+        from app.llm.assessor import NG12Assessor
+
+        return NG12Assessor(gem=self.get("gem"), agem=self.get("agem"), store=self.get("vector_store"))
+
+    def _make_chat_agent(self):
+        from app.llm.chat_agent import NG12ChatAgent
+
+        return NG12ChatAgent(gem=self.get("gem"), agem=self.get("agem"), vs=self.get("vector_store"))
+
+    # ==========================
+    # Access
+    # ==========================
+    def peek(self, name: str) -> Any:
+        """The component if it is already built, else None (never blocks)."""
+        return self._built.get(name)
+
+    def get(self, name: str) -> Any:
+        obj = self._built.get(name)
+        if obj is not None:
+            return obj
+        factory: Callable[[], Any] = getattr(self, f"_make_{name}")
+        with self._locks[name]:
+            obj = self._built.get(name)
+            if obj is None:
+                t0 = time.perf_counter()
+                obj = factory()
+                self.build_ms[name] = round((time.perf_counter() - t0) * 1000.0, 2)
+                self._built[name] = obj
+        return obj
+
+    async def get_async(self, name: str) -> Any:
+        obj = self._built.get(name)
+        return obj if obj is not None else await run_blocking(self.get, name)
+
+    def warmup(self) -> None:
+        """
+        Build every component and touch the lazily loaded data behind them
+        (patient index, vector index version, symptom index), then mark ready.
+        """
+        t0 = time.perf_counter()
+        try:
+            for name in COMPONENTS:
+                if name == "genai_client" and "gem" in self._built and "agem" in self._built:
+                    continue  # clients were injected; nothing will use a real one
+                self.get(name)
+            len(self.get("patient_store"))
+            self.get("vector_store").index_version()
+
+            from app.rag.symptom_index import get_symptom_index
+
+            get_symptom_index()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            return
+        finally:
+            self.warmup_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+        self.cold_start_ms = round((time.perf_counter() - _IMPORTED_AT) * 1000.0, 2)
+        self.ready = True
+
+    def start_warmup(self) -> threading.Thread:
+        t = threading.Thread(target=self.warmup, name="services-warmup", daemon=True)
+        t.start()
+        return t
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "cold_start_ms": self.cold_start_ms,
+            "warmup_ms": self.warmup_ms,
+            "build_ms": dict(self.build_ms),
+            "built": [name for name in COMPONENTS if name in self._built],
+        }
+
+    def close(self) -> None:
+        for name in ("chat_store", "patient_store"):
+            store = self._built.get(name)
+            if store is not None:
+                store.close()
+
+
+_services: Optional[Services] = None
+_services_lock = threading.Lock()
+
+
+def get_services() -> Services:
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                _services = Services()
+    return _services
+
+
+def set_services(services: Services) -> None:
+    """Replace the process container (benchmarks / offline runs with stub clients)."""
+    global _services
+    with _services_lock:
+        _services = services
+
+
+# ==========================
+# FastAPI dependencies
+# ==========================
+async def get_assessor():
+    return await get_services().get_async("assessor")
+
+
+async def get_chat_agent():
+    return await get_services().get_async("chat_agent")
+
+
+async def get_patient_store():
+    return await get_services().get_async("patient_store")
+
+
+async def get_chat_store():
+    return await get_services().get_async("chat_store")
+
+
+async def get_agem():
+    return await get_services().get_async("agem")
@@ -0,0 +1,55 @@
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from app.metrics import metrics
+
+
+class StageTimer:
+    """
+    Collects wall-clock milliseconds per named stage of one request.
+    Repeated stages accumulate. Stages may overlap (e.g. concurrent tasks).
+    Every stage is also recorded in the process-wide ng12_stage_seconds histogram.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000.0)
+
+    def add(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+        metrics.stage(name, ms / 1000.0)
+
+    def as_dict(self) -> Dict[str, float]:
+        out = {k: round(v, 2) for k, v in self.stages.items()}
+        out["total"] = round((time.perf_counter() - self._start) * 1000.0, 2)
+        return out
+
+
+@contextmanager
+def maybe_stage(timer: Optional[StageTimer], name: str) -> Iterator[None]:
+    # without a per-request timer the stage still feeds the metrics histogram
+    if timer is None:
+        with metrics.timed(name):
+            yield
+    else:
+        with timer.stage(name):
+            yield
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile (p in 0..100); 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(p / 100.0 * len(ordered))))
+    return ordered[rank - 1]
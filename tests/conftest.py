@@ -0,0 +1,7 @@
+import os
+import sys
+
+# tests import the app package from the repo root, like `uvicorn app.main:app`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
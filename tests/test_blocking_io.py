@@ -0,0 +1,102 @@
+"""Index-version reads and SQLite cache I/O must not run on the event loop."""
+import asyncio
+
+from app.llm.answer_cache import SemanticAnswerCache
+from app.llm.assessor import NG12Assessor
+from app.llm.chat_agent import NG12ChatAgent
+from app.llm.embedding_cache import EmbeddingCache
+from app.llm.gemini_client import AsyncGeminiClient
+from app.llm.result_cache import AssessmentCache
+from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient, StubVectorStore
+from app.models import Patient
+
+
+def _on_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class RecordingStore(StubVectorStore):
+    def __init__(self):
+        super().__init__()
+        self.version_reads_on_loop = []
+
+    def index_version(self) -> str:
+        self.version_reads_on_loop.append(_on_loop())
+        return super().index_version()
+
+
+class RecordingCache(AssessmentCache):
+    def __init__(self, path):
+        super().__init__(path=path)
+        self.calls_on_loop = []
+
+    def get(self, key, index_version):
+        self.calls_on_loop.append(_on_loop())
+        return super().get(key, index_version)
+
+    def put(self, key, index_version, res):
+        self.calls_on_loop.append(_on_loop())
+        return super().put(key, index_version, res)
+
+
+PATIENT = Patient(patient_id="PT-1", name="Test", age=60, gender="F", smoking_history="Current",
+                  symptoms=["haemoptysis"], symptom_duration_days=14)
+
+
+def test_assess_async_cache_io_off_loop(tmp_path):
+    gem, store = StubGeminiClient(), RecordingStore()
+    cache = RecordingCache(str(tmp_path / "assess.db"))
+    assessor = NG12Assessor(gem=gem, agem=AsyncStubGeminiClient(gem), store=store, cache=cache,
+                            use_symptom_index=False)
+
+    first = asyncio.run(assessor.assess_async(PATIENT))
+    second = asyncio.run(assessor.assess_async(PATIENT))
+    assert first.debug["cache"] == "miss" and second.debug["cache"] == "hit"
+    assert store.version_reads_on_loop and not any(store.version_reads_on_loop)
+    assert cache.calls_on_loop and not any(cache.calls_on_loop)
+
+
+def test_chat_async_version_read_off_loop():
+    gem, store = StubGeminiClient(), RecordingStore()
+    agent = NG12ChatAgent(gem=gem, agem=AsyncStubGeminiClient(gem), vs=store, answer_cache=SemanticAnswerCache())
+    asyncio.run(agent.chat_async("When should I refer for dysphagia?", []))
+    assert store.version_reads_on_loop == [False]
+
+
+class RecordingEmbeddingCache(EmbeddingCache):
+    def __init__(self, path):
+        super().__init__(path=path)
+        self.calls_on_loop = []
+
+    def get(self, model, text):
+        self.calls_on_loop.append(_on_loop())
+        return super().get(model, text)
+
+    def put(self, model, text, vec):
+        self.calls_on_loop.append(_on_loop())
+        return super().put(model, text, vec)
+
+
+class _Embeddings:
+    def __init__(self, n):
+        self.embeddings = [type("E", (), {"values": [1.0, 0.0]})() for _ in range(n)]
+
+
+class _FakeGenai:
+    def __init__(self):
+        self.models = type("Models", (), {"embed_content": lambda _, model, contents: _Embeddings(len(contents))})()
+
+
+def test_async_embed_query_persistent_cache_off_loop(tmp_path):
+    cache = RecordingEmbeddingCache(str(tmp_path / "embed.db"))
+    agem = AsyncGeminiClient(client=_FakeGenai(), embed_cache=cache)
+
+    async def twice():
+        return [await agem.embed_query("lung"), await agem.embed_query("lung")]
+
+    assert asyncio.run(twice()) == [[1.0, 0.0], [1.0, 0.0]]
+    assert cache.calls_on_loop == [False, False, False]  # get (miss), put, get (hit)
@@ -0,0 +1,46 @@
+import os
+
+from app.rag.bm25 import BM25Index, HybridVectorStore
+
+
+class DenseStub:
+    """One fixed dense hit, in Chroma's result shape."""
+
+    def index_version(self):
+        return "dense:1"
+
+    def query(self, query_embedding, top_k=5):
+        return {"ids": [["a"]], "documents": [["lung cancer chest x-ray"]],
+                "metadatas": [[{}]], "distances": [[0.3]]}
+
+
+def _save(path, version, docs):
+    BM25Index(list(docs), list(docs.values()), [{} for _ in docs], version=version).save(path)
+
+
+def test_reloads_bm25_after_reingest(tmp_path):
+    path = str(tmp_path / "bm25.json")
+    _save(path, "v1", {"a": "lung cancer chest x-ray", "b": "dysphagia endoscopy"})
+    store = HybridVectorStore.from_path(DenseStub(), path, reload_interval_s=0)
+    assert store.index_version() == "dense:1+bm25:v1"
+    assert "b" in store.query([0.0], top_k=5, query_text="dysphagia")["ids"][0]
+
+    _save(path, "v2", {"a": "lung cancer chest x-ray", "c": "visible haematuria bladder"})
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    assert store.index_version() == "dense:1+bm25:v2"
+    assert "c" in store.query([0.0], top_k=5, query_text="haematuria")["ids"][0]
+
+
+def test_without_path_keeps_the_given_index(tmp_path):
+    index = BM25Index(["a"], ["lung cancer"], [{}], version="v1")
+    store = HybridVectorStore(DenseStub(), index, reload_interval_s=0)
+    assert store.index_version() == "dense:1+bm25:v1"
+
+
+def test_bm25_only_hits_get_numeric_distances():
+    index = BM25Index(["a", "b"], ["lung cancer chest x-ray", "dysphagia endoscopy"], [{}, {}])
+    res = HybridVectorStore(DenseStub(), index).query([0.0], top_k=5, query_text="dysphagia")
+    assert res["ids"][0] == ["a", "b"]
+    assert res["distances"][0] == [0.3, 0.3]
@@ -0,0 +1,247 @@
+import asyncio
+import time
+
+import pytest
+
+from app.llm.call_policy import CircuitOpenError, CallPolicy, DeadlineExceeded
+from app.llm.embedding_cache import EmbeddingCache
+from app.llm.gemini_client import AsyncGeminiClient, GeminiClient
+from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient, StubServiceError
+
+
+def _policy(**kwargs) -> CallPolicy:
+    opts = dict(timeout_s=1.0, deadline_s=2.0, max_attempts=3, backoff_s=0.001, backoff_max_s=0.005,
+                breaker_failures=0, seed=0)
+    opts.update(kwargs)
+    return CallPolicy("test", **opts)
+
+
+# ==========================
+# Retries
+# ==========================
+def test_retries_503_until_attempts_run_out():
+    gem = StubGeminiClient(error_rate=1.0)
+    with pytest.raises(StubServiceError):
+        _policy(max_attempts=3).call(gem.generate, "q")
+    assert gem.calls["generate"] == 3
+
+
+def test_retries_turn_transient_503s_into_successes():
+    gem = StubGeminiClient(error_rate=0.3, seed=0)
+    policy = _policy(max_attempts=6)
+    for _ in range(20):
+        policy.call(gem.generate, "q")
+    assert gem.faults > 0
+    assert gem.calls["generate"] == 20 + gem.faults
+
+
+def test_does_not_retry_400():
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise StubServiceError("generate", code=400)
+
+    policy = _policy(breaker_failures=1)
+    with pytest.raises(StubServiceError):
+        policy.call(bad_request)
+    assert len(calls) == 1
+    # the backend answered: a client error does not count against the breaker
+    assert policy.breaker.state == "closed"
+
+
+def test_async_retries_503():
+    gem = StubGeminiClient(error_rate=1.0)
+    with pytest.raises(StubServiceError):
+        asyncio.run(_policy(max_attempts=2).acall(AsyncStubGeminiClient(gem).generate, "q"))
+    assert gem.calls["generate"] == 2
+
+
+# ==========================
+# Timeouts and deadline
+# ==========================
+def test_per_attempt_timeout_retries_hung_calls():
+    gem = StubGeminiClient(slow_rate=1.0, slow_ms=500)
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        _policy(timeout_s=0.05, deadline_s=1.0, max_attempts=2).call(gem.generate, "q")
+    assert time.monotonic() - t0 < 0.4
+    assert gem.calls["generate"] == 2
+
+
+def test_deadline_caps_all_attempts():
+    agem = AsyncStubGeminiClient(StubGeminiClient(slow_rate=1.0, slow_ms=500))
+    policy = _policy(timeout_s=0.05, deadline_s=0.12, max_attempts=10)
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(policy.acall(agem.generate, "q"))
+    assert time.monotonic() - t0 < 0.3
+    assert agem.sync.calls["generate"] < 10
+
+
+def test_deadline_exceeded_is_a_timeout():
+    assert issubclass(DeadlineExceeded, TimeoutError)
+
+
+# ==========================
+# Hedging
+# ==========================
+# seed 1: the first call draws "slow", the second does not
+def test_hedge_beats_a_slow_attempt():
+    gem = StubGeminiClient(slow_rate=0.5, slow_ms=500, seed=1)
+    t0 = time.monotonic()
+    _policy(hedge_after_s=0.02, max_attempts=1).call(gem.generate, "q")
+    assert time.monotonic() - t0 < 0.3
+    assert gem.calls["generate"] == 2
+
+
+def test_async_hedge_beats_a_slow_attempt():
+    agem = AsyncStubGeminiClient(StubGeminiClient(slow_rate=0.5, slow_ms=500, seed=1))
+    t0 = time.monotonic()
+    asyncio.run(_policy(hedge_after_s=0.02, max_attempts=1).acall(agem.generate, "q"))
+    assert time.monotonic() - t0 < 0.3
+    assert agem.sync.calls["generate"] == 2
+
+
+def test_no_hedge_for_fast_calls():
+    gem = StubGeminiClient()
+    _policy(hedge_after_s=0.2).call(gem.generate, "q")
+    assert gem.calls["generate"] == 1
+
+
+# ==========================
+# Circuit breaker
+# ==========================
+def _trip(policy: CallPolicy, gem: StubGeminiClient) -> None:
+    for _ in range(policy.breaker.threshold):
+        with pytest.raises(StubServiceError):
+            policy.call(gem.generate, "q")
+
+
+def test_breaker_opens_then_probes():
+    gem = StubGeminiClient(error_rate=1.0)
+    policy = _policy(max_attempts=1, breaker_failures=2, breaker_reset_s=0.05)
+    _trip(policy, gem)
+    assert policy.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        policy.call(gem.generate, "q")
+    assert gem.calls["generate"] == 2  # rejected without reaching the backend
+
+    time.sleep(0.06)
+    assert policy.breaker.state == "half_open"
+    gem.error_rate = 0.0
+    policy.call(gem.generate, "q")
+    assert policy.breaker.state == "closed"
+
+
+def test_failed_probe_reopens():
+    gem = StubGeminiClient(error_rate=1.0)
+    policy = _policy(max_attempts=1, breaker_failures=2, breaker_reset_s=0.05)
+    _trip(policy, gem)
+    time.sleep(0.06)
+    with pytest.raises(StubServiceError):
+        policy.call(gem.generate, "q")
+    assert policy.breaker.state == "open"
+    assert policy.breaker.opened == 2
+
+
+def test_half_open_lets_one_probe_through():
+    policy = _policy(breaker_failures=1, breaker_reset_s=0.0)
+    policy.breaker.failure()
+    policy.breaker.before()
+    with pytest.raises(CircuitOpenError):
+        policy.breaker.before()
+    policy.breaker.release_probe()
+    policy.breaker.before()
+
+
+# ==========================
+# Streaming probes (GeminiClient over a fake genai client)
+# ==========================
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Models:
+    def __init__(self):
+        self.fail = True
+
+    def generate_content_stream(self, model, contents, config):
+        if self.fail:
+            raise StubServiceError("generate")
+        yield _Chunk("a")
+        yield _Chunk("b")
+
+
+class _AsyncModels:
+    def __init__(self, models):
+        self.models = models
+
+    async def generate_content_stream(self, model, contents, config):
+        async def chunks():
+            for chunk in self.models.generate_content_stream(model, contents, config):
+                yield chunk
+        if self.models.fail:
+            raise StubServiceError("generate")
+        return chunks()
+
+
+class _FakeGenai:
+    def __init__(self):
+        self.models = _Models()
+        self.aio = type("Aio", (), {"models": _AsyncModels(self.models)})()
+
+
+def _clients():
+    fake = _FakeGenai()
+    policy = _policy(max_attempts=1, breaker_failures=2, breaker_reset_s=0.05)
+    kwargs = dict(client=fake, gen_policy=policy, embed_policy=_policy(), embed_cache=EmbeddingCache())
+    return fake, policy, GeminiClient(**kwargs), AsyncGeminiClient(**kwargs)
+
+
+def test_stream_probe_closes_breaker():
+    fake, policy, gem, _ = _clients()
+    for _ in range(2):
+        with pytest.raises(StubServiceError):
+            list(gem.generate_stream("q"))
+    assert policy.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        list(gem.generate_stream("q"))
+
+    time.sleep(0.06)
+    fake.models.fail = False
+    assert list(gem.generate_stream("q")) == ["a", "b"]
+    assert policy.breaker.state == "closed"
+
+
+def test_failed_stream_probe_reopens_and_frees_the_slot():
+    fake, policy, gem, _ = _clients()
+    for _ in range(2):
+        with pytest.raises(StubServiceError):
+            list(gem.generate_stream("q"))
+    time.sleep(0.06)
+    with pytest.raises(StubServiceError):
+        list(gem.generate_stream("q"))
+    assert policy.breaker.state == "open"
+
+    time.sleep(0.06)
+    fake.models.fail = False
+    assert list(gem.generate_stream("q")) == ["a", "b"]
+
+
+def test_async_stream_probe_closes_breaker():
+    fake, policy, _, agem = _clients()
+
+    async def drain():
+        return [text async for text in agem.generate_stream("q")]
+
+    for _ in range(2):
+        with pytest.raises(StubServiceError):
+            asyncio.run(drain())
+    assert policy.breaker.state == "open"
+
+    time.sleep(0.06)
+    fake.models.fail = False
+    assert asyncio.run(drain()) == ["a", "b"]
+    assert policy.breaker.state == "closed"
@@ -0,0 +1,64 @@
+import asyncio
+
+from app.llm.answer_cache import SemanticAnswerCache
+from app.llm.chat_agent import NG12ChatAgent
+from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient, StubVectorStore
+
+QUESTION = "When should I refer for dysphagia?"
+
+
+class FailingGemini(StubGeminiClient):
+    """Stub whose JSON calls fail the way generate_validated reports it."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    def generate_json(self, system, user, schema=None, temperature=None, context=None):
+        if self.fail:
+            self.calls["generate_json"] += 1
+            return {"error": "Model did not return valid JSON (not valid JSON)", "raw": ""}
+        return super().generate_json(system, user, schema, temperature, context)
+
+
+class AsyncFailingGemini(AsyncStubGeminiClient):
+    async def generate_json(self, system, user, schema=None, temperature=None, context=None):
+        if self.sync.fail:
+            return self.sync.generate_json(system, user, schema, temperature, context)
+        return await super().generate_json(system, user, schema, temperature, context)
+
+
+def _agent(gem):
+    return NG12ChatAgent(gem=gem, agem=AsyncFailingGemini(gem), vs=StubVectorStore(),
+                         answer_cache=SemanticAnswerCache())
+
+
+def test_failed_generation_is_not_cached():
+    gem = FailingGemini()
+    agent = _agent(gem)
+
+    answer, citations, debug = agent.chat(QUESTION, [])
+    assert answer == ""
+    assert citations  # fallback citations from the retrieved chunks
+    assert debug["cache"] == "miss"
+
+    gem.fail = False
+    answer, _, debug = agent.chat(QUESTION, [])
+    assert answer
+    assert debug["cache"] == "miss"
+    assert gem.calls["generate_json"] == 2
+
+    # the good answer is cached
+    assert agent.chat(QUESTION, [])[2]["cache"] == "hit"
+
+
+def test_async_failed_generation_is_not_cached():
+    gem = FailingGemini()
+    agent = _agent(gem)
+
+    async def ask():
+        return await agent.chat_async(QUESTION, [])
+
+    assert asyncio.run(ask())[0] == ""
+    assert asyncio.run(ask())[2]["cache"] == "miss"
+    assert gem.calls["generate_json"] == 2
@@ -0,0 +1,16 @@
+import pytest
+
+from app.chat_store import ChatStore, MemoryChatStore
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ChatStore()
+
+
+def test_memory_store_keeps_the_last_messages():
+    store = MemoryChatStore(max_messages=2)
+    for text in ("one", "two", "three"):
+        store.add("s1", "user", text)
+    assert [m.content for m in store.get("s1")] == ["two", "three"]
+    assert store.to_openai_style("s1", max_messages=1) == [{"role": "user", "content": "three"}]
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+from app.llm.call_policy import CallPolicy
+from app.llm.context_cache import ContextCacheManager
+from app.llm.gemini_client import GeminiClient
+from app.llm.prompts import ASSESSOR_SYSTEM_PROMPT
+from app.llm.stub_client import StubCaches
+from app.llm.structured import ASSESSMENT_SCHEMA
+
+SYSTEM = "You are the NG12 Cancer Risk Assessor. " * 4
+CONTEXT = "NG12 EVIDENCE SNIPPETS:\n" + "guideline text " * 400
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _manager(caches=None, clock=None, **kwargs):
+    clock = clock or Clock()
+    caches = caches or StubCaches(min_tokens=100, clock=clock)
+    opts = dict(acaches=caches.aio, ttl_s=600, refresh_s=300, min_tokens=100, min_uses=2, clock=clock)
+    opts.update(kwargs)
+    return ContextCacheManager(caches, "stub-gen", **opts), caches, clock
+
+
+def test_evidence_prefix_is_cached_after_min_uses():
+    mgr, caches, _ = _manager()
+    assert mgr.handle(SYSTEM, CONTEXT) is None
+    assert caches.calls["create"] == 0
+    name = mgr.handle(SYSTEM, CONTEXT)
+    assert name is not None
+    assert mgr.handle(SYSTEM, CONTEXT) == name
+    assert caches.calls["create"] == 1
+
+
+def test_short_prefixes_are_never_cached():
+    mgr, caches, _ = _manager(min_tokens=10_000)
+    for _ in range(3):
+        assert mgr.handle(SYSTEM, CONTEXT) is None
+    assert caches.calls["create"] == 0
+
+
+def test_handle_is_refreshed_before_it_expires():
+    mgr, caches, clock = _manager(min_uses=1)
+    name = mgr.handle(SYSTEM, CONTEXT)
+
+    clock.now = 200.0  # more than refresh_s left: used as is
+    assert mgr.handle(SYSTEM, CONTEXT) == name
+    assert caches.calls["update"] == 0
+
+    clock.now = 400.0  # within refresh_s of expiry: extended on use
+    assert mgr.handle(SYSTEM, CONTEXT) == name
+    assert caches.calls["update"] == 1
+
+    clock.now = 900.0  # past the original TTL, inside the extended one
+    assert mgr.handle(SYSTEM, CONTEXT) == name
+    assert caches.calls["create"] == 1
+
+
+def test_async_refresh():
+    mgr, caches, clock = _manager(min_uses=1)
+
+    async def run():
+        name = await mgr.ahandle(SYSTEM, CONTEXT)
+        clock.now = 400.0
+        return name, await mgr.ahandle(SYSTEM, CONTEXT)
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert caches.calls == {"create": 1, "update": 1, "get": 0, "delete": 0}
+
+
+def test_failed_create_backs_off_then_switches_off():
+    clock = Clock()
+    mgr, caches, _ = _manager(StubCaches(min_tokens=100, clock=clock, fail=True), clock, min_uses=1)
+
+    assert mgr.handle(SYSTEM, CONTEXT) is None
+    assert mgr.handle(SYSTEM, CONTEXT) is None  # backed off: no second create
+    assert caches.calls["create"] == 1
+
+    for i in range(2):
+        assert mgr.handle(SYSTEM, f"{CONTEXT} bundle {i}") is None
+    assert caches.calls["create"] == 3
+    assert mgr.stats()["available"] is False
+
+    caches.fail = False
+    assert mgr.handle(SYSTEM, CONTEXT + " new bundle") is None
+    assert caches.calls["create"] == 3
+
+    clock.now = 601.0  # one TTL later the manager tries again
+    assert mgr.handle(SYSTEM, CONTEXT + " new bundle") is not None
+
+
+class SlowCaches(StubCaches):
+    def create(self, model, config):
+        time.sleep(1.0)
+        return super().create(model, config)
+
+
+def test_slow_create_is_bounded_by_the_call_policy():
+    clock = Clock()
+    policy = CallPolicy("caches", timeout_s=0.05, deadline_s=0.05, max_attempts=1)
+    mgr, caches, _ = _manager(SlowCaches(min_tokens=100, clock=clock), clock, min_uses=1, policy=policy)
+    t0 = time.monotonic()
+    assert mgr.handle(SYSTEM, CONTEXT) is None
+    assert time.monotonic() - t0 < 0.5
+    assert mgr.stats()["failed"] == 1
+
+
+def test_open_breaker_skips_without_switching_off():
+    clock = Clock()
+    policy = CallPolicy("caches", max_attempts=1, breaker_failures=1, breaker_reset_s=60)
+    caches = StubCaches(min_tokens=100, clock=clock, fail=True)
+    mgr, _, _ = _manager(caches, clock, min_uses=1, policy=policy)
+    assert mgr.handle(SYSTEM, CONTEXT) is None  # 400: a client error, breaker stays closed
+    policy.breaker.failure()
+    for i in range(5):
+        assert mgr.handle(SYSTEM, f"{CONTEXT} bundle {i}") is None
+    assert caches.calls["create"] == 1
+    assert mgr.stats()["available"] is True
+
+
+# ==========================
+# Stale handle retry in generate_json
+# ==========================
+OK = ('{"patient_id": "P", "decision": "NOT_MET", "confidence": 0.5, "summary": "s", '
+      '"reasoning": "r", "citations": []}')
+
+
+class _Reply:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class _Models:
+    def __init__(self, caches):
+        self.caches = caches
+        self.sent = []
+
+    def generate_content(self, model, contents, config=None):
+        self.sent.append((contents, config.cached_content if config is not None else None))
+        if config is not None and config.cached_content:
+            self.caches.get(name=config.cached_content)  # 404 once the cache is gone
+        return _Reply(OK)
+
+
+class _FakeGenai:
+    def __init__(self, caches):
+        self.caches = caches
+        self.models = _Models(caches)
+
+
+def test_generate_json_falls_back_when_the_handle_is_stale():
+    mgr, caches, _ = _manager(min_uses=1)
+    fake = _FakeGenai(caches)
+    gem = GeminiClient(client=fake, gen_policy=CallPolicy("t"), embed_policy=CallPolicy("e"), context_cache=mgr)
+
+    gem.generate_json(ASSESSOR_SYSTEM_PROMPT, "PATIENT: P", ASSESSMENT_SCHEMA, context=CONTEXT)
+    handle = fake.models.sent[-1][1]
+    assert handle is not None
+    assert "guideline text" not in fake.models.sent[-1][0]
+
+    caches.items.clear()  # deleted / expired server-side
+    res = gem.generate_json(ASSESSOR_SYSTEM_PROMPT, "PATIENT: P", ASSESSMENT_SCHEMA, context=CONTEXT)
+    assert res["decision"] == "NOT_MET"
+    (_, stale), (retried, none) = fake.models.sent[-2:]
+    assert stale == handle and none is None
+    assert "guideline text" in retried
+    assert mgr.stats()["invalidations"] == 1
@@ -0,0 +1,48 @@
+import pytest
+
+from app.llm.conversation_memory import is_follow_up, standalone_query
+
+HISTORY = [
+    {"role": "user", "content": "When should I refer for dysphagia?"},
+    {"role": "assistant", "content": "Offer an urgent direct access upper GI endoscopy ..."},
+]
+
+
+@pytest.mark.parametrize("message", [
+    "what about if they are over 55?",
+    "and for patients under 50?",
+    "Also for women?",
+    "Is that urgent?",
+    "How soon should they be seen?",
+    "Why?",
+])
+def test_follow_ups(message):
+    assert is_follow_up(message)
+
+
+@pytest.mark.parametrize("message", [
+    "What symptoms suggest that lung cancer needs urgent referral?",
+    "Is unexplained weight loss enough for a referral?",
+    "When should I refer someone with dysphagia?",
+    "What does NG12 say about rectal bleeding?",
+    "Which symptoms need an urgent chest X-ray?",
+    # long messages carry their own context, even with a leading marker
+    "And what are the referral criteria for a woman aged 60 with postmenopausal bleeding and a raised CA125?",
+])
+def test_self_contained_questions(message):
+    assert not is_follow_up(message)
+
+
+def test_standalone_query_adds_context_to_follow_ups():
+    query = standalone_query("what about over 60s?", HISTORY, topics="oesophageal cancer")
+    assert query == ("what about over 60s? (context: When should I refer for dysphagia?; "
+                     "oesophageal cancer)")
+
+
+def test_standalone_query_leaves_new_topics_alone():
+    message = "What symptoms suggest that lung cancer needs urgent referral?"
+    assert standalone_query(message, HISTORY, topics="oesophageal cancer") == message
+
+
+def test_standalone_query_without_history():
+    assert standalone_query("is that urgent?", []) == "is that urgent?"
@@ -0,0 +1,90 @@
+import threading
+
+from app.llm.embed_batcher import EmbeddingBatcher
+from app.llm.embedding_cache import EmbeddingCache
+from app.llm.gemini_client import GeminiClient
+
+
+class CountingEmbed:
+    """embed_fn fake: records every batch it is sent."""
+
+    def __init__(self, tag: float = 0.0):
+        self.tag = tag
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        return [[self.tag, float(len(t))] for t in texts]
+
+
+def _embed_concurrently(embed, texts):
+    results = {}
+    threads = [threading.Thread(target=lambda t=t: results.__setitem__(t, embed(t))) for t in texts]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return results
+
+
+def test_coalesces_and_dedupes_concurrent_texts():
+    fake = CountingEmbed()
+    batcher = EmbeddingBatcher(fake, window_ms=50, max_batch=32)
+    texts = ["lung", "breast", "lung", "bowel"] * 4
+    results = _embed_concurrently(batcher.embed, texts)
+    batcher.close()
+
+    assert results == {t: [0.0, float(len(t))] for t in texts}
+    assert sum(len(b) for b in fake.batches) == 3
+    assert batcher.stats()["requests"] == len(texts)
+
+
+def test_errors_reach_every_caller():
+    def broken(texts):
+        raise ConnectionError("down")
+
+    batcher = EmbeddingBatcher(broken, window_ms=1)
+    try:
+        batcher.embed("lung")
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("expected ConnectionError")
+    finally:
+        batcher.close()
+
+
+class _Embeddings:
+    def __init__(self, vectors):
+        self.embeddings = [type("E", (), {"values": v})() for v in vectors]
+
+
+class _FakeGenai:
+    """genai.Client fake whose embed_content goes through a CountingEmbed."""
+
+    def __init__(self, tag: float):
+        self.embed = CountingEmbed(tag)
+        self.models = type("Models", (), {"embed_content": lambda _, model, contents: _Embeddings(self.embed(contents))})()
+
+
+def test_each_client_batches_through_its_own_backend():
+    first, second = _FakeGenai(1.0), _FakeGenai(2.0)
+    a = GeminiClient(client=first, embed_cache=EmbeddingCache())
+    b = GeminiClient(client=second, embed_cache=EmbeddingCache())
+
+    assert a.embed_query("lung")[0] == 1.0
+    assert b.embed_query("lung")[0] == 2.0
+    assert first.embed.batches == [["lung"]]
+    assert second.embed.batches == [["lung"]]
+    assert a.embed_batcher is not b.embed_batcher
+
+
+def test_client_uses_a_batcher_it_is_given():
+    fake = CountingEmbed(3.0)
+    batcher = EmbeddingBatcher(fake, window_ms=1)
+    gem = GeminiClient(client=_FakeGenai(1.0), embed_cache=EmbeddingCache(), embed_batcher=batcher)
+    assert gem.embed_query("lung") == [3.0, 4.0]
+    assert fake.batches == [["lung"]]
+    batcher.close()
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+import app.patient_store as patient_store
+from app.patient_backends import PatientBackend, write_jsonl
+from app.patient_store import PatientStore
+
+
+def _row(pid: str, age: int) -> dict:
+    return {"patient_id": pid, "name": "Test", "age": age, "gender": "F", "smoking_history": "Never",
+            "symptoms": ["cough"], "symptom_duration_days": 21}
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        PatientBackend()
+
+
+def test_reload_closes_the_old_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(patient_store, "_RETIRE_AFTER_S", 0.0)
+    path = str(tmp_path / "patients.jsonl")
+    write_jsonl([_row("PT-1", 40)], path)
+    store = PatientStore(path, backend="jsonl", reload_interval_s=-1)
+    old = store._load()
+    assert store.get_patient("PT-1").age == 40
+
+    write_jsonl([_row("PT-1", 41)], path)
+    store.reload()
+    assert store.get_patient("PT-1").age == 41
+
+    deadline = time.monotonic() + 2.0
+    while not old._f.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert old._f.closed
+    store.close()
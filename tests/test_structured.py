@@ -0,0 +1,148 @@
+import asyncio
+import json
+
+import pytest
+
+from app.llm.chat_agent import _parse_answer
+from app.llm.structured import (
+    ASSESSMENT_SCHEMA,
+    CHAT_ANSWER_SCHEMA,
+    REPAIR_SYSTEM_PROMPT,
+    agenerate_validated,
+    generate_validated,
+    parse_json_output,
+    schema_errors,
+)
+from app.llm.stub_client import AsyncStubGeminiClient, StubGeminiClient
+
+VALID = {"decision": "NOT_MET", "confidence": 0.4, "summary": "s", "reasoning": "r", "citations": []}
+HITS = [{"page": 3, "chunk_id": "ng12_0003_00", "text": "Refer people with dysphagia ..."}]
+
+
+class Replies:
+    """call(system, user) fake returning canned raw outputs in order."""
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.calls = []
+
+    def __call__(self, system, user):
+        self.calls.append((system, user))
+        return self.outputs.pop(0)
+
+
+# ==========================
+# Schemas
+# ==========================
+def test_assessment_schema_starts_with_the_decision():
+    assert ASSESSMENT_SCHEMA["property_ordering"][0] == "decision"
+    assert "patient_id" not in ASSESSMENT_SCHEMA["properties"]
+    assert "debug" not in ASSESSMENT_SCHEMA["properties"]
+    assert ASSESSMENT_SCHEMA["properties"]["decision"]["enum"][-1] == "INSUFFICIENT_EVIDENCE"
+
+
+def test_chat_schema_starts_with_the_answer():
+    assert CHAT_ANSWER_SCHEMA["property_ordering"] == ["answer", "citations"]
+    assert CHAT_ANSWER_SCHEMA["required"] == ["answer", "citations"]
+
+
+def test_schema_errors():
+    assert schema_errors(VALID, ASSESSMENT_SCHEMA) == []
+    bad = dict(VALID, decision="MAYBE", confidence=1.5)
+    del bad["summary"]
+    errors = schema_errors(bad, ASSESSMENT_SCHEMA)
+    assert "$.summary: missing" in errors
+    assert any("MAYBE" in e for e in errors)
+    assert any("out of range" in e for e in errors)
+    assert schema_errors([], ASSESSMENT_SCHEMA) == ["$: expected an object"]
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(VALID),
+    "```json\n" + json.dumps(VALID) + "\n```",
+    "Here you go: " + json.dumps(VALID) + " Hope that helps.",
+])
+def test_parse_json_output(text):
+    assert parse_json_output(text) == VALID
+
+
+def test_parse_json_output_gives_up():
+    assert parse_json_output('```json\n{"decision": "NOT_') is None
+
+
+# ==========================
+# Repair loop
+# ==========================
+def test_valid_output_needs_no_repair():
+    call = Replies(json.dumps(VALID))
+    assert generate_validated(call, "SYS", "USER", ASSESSMENT_SCHEMA) == VALID
+    assert len(call.calls) == 1
+
+
+def test_malformed_output_is_repaired():
+    call = Replies('```json\n{"decision": "NOT_', json.dumps(VALID))
+    assert generate_validated(call, "SYS", "USER", ASSESSMENT_SCHEMA, repair_attempts=1) == VALID
+    system, user = call.calls[1]
+    assert system == REPAIR_SYSTEM_PROMPT
+    assert "not valid JSON" in user
+
+
+def test_still_failed_after_repairs():
+    call = Replies("nope", "still nope", "nope again")
+    res = generate_validated(call, "SYS", "USER", ASSESSMENT_SCHEMA, repair_attempts=2)
+    assert "error" in res and res["raw"] == "nope again"
+    assert len(call.calls) == 3
+
+
+def test_async_repair():
+    outputs = Replies('{"decision": "NOT_MET"}', json.dumps(VALID))
+
+    async def call(system, user):
+        return outputs(system, user)
+
+    res = asyncio.run(agenerate_validated(call, "SYS", "USER", ASSESSMENT_SCHEMA, repair_attempts=1))
+    assert res == VALID
+    assert "$.confidence: missing" in outputs.calls[1][1]
+
+
+def test_stub_malformed_outputs_are_repaired():
+    gem = StubGeminiClient(malformed_rate=0.5, seed=0)
+    repaired = failed = 0
+    for i in range(20):
+        before = gem.calls["generate_json"]
+        res = gem.generate_json("SYS", f'PATIENT: {{"patient_id": "PT-{i}"}}', ASSESSMENT_SCHEMA)
+        if "error" in res:
+            failed += 1
+        else:
+            assert schema_errors(res, ASSESSMENT_SCHEMA) == []
+            repaired += gem.calls["generate_json"] - before > 1
+    assert repaired > 0
+    assert gem.malformed >= repaired + failed
+
+
+def test_async_stub_always_malformed_fails_after_the_repairs():
+    agem = AsyncStubGeminiClient(StubGeminiClient(malformed_rate=1.0))
+    res = asyncio.run(agem.generate_json("SYS", 'PATIENT: {"patient_id": "PT-1"}', ASSESSMENT_SCHEMA))
+    assert "error" in res and res["raw"].startswith("```json")
+    assert agem.sync.calls["generate_json"] == agem.sync.malformed > 1
+
+
+# ==========================
+# Chat answers built from failed output are not cacheable
+# ==========================
+def test_failed_chat_output_is_not_cacheable():
+    failed = {"error": "Model did not return valid JSON (not valid JSON)", "raw": ""}
+    answer, citations, cacheable = _parse_answer(failed, HITS)
+    assert answer == "" and citations and not cacheable
+
+
+def test_uncited_chat_output_is_not_cacheable():
+    answer, citations, cacheable = _parse_answer({"answer": "Refer.", "citations": []}, HITS)
+    assert answer == "Refer." and citations[0]["chunk_id"] == "ng12_0003_00"
+    assert not cacheable
+
+
+def test_valid_chat_output_is_cacheable():
+    raw = json.dumps({"answer": "Refer.", "citations": [{"page": 3, "chunk_id": "ng12_0003_00", "excerpt": ""}]})
+    assert _parse_answer(raw, HITS)[2]
+    assert not _parse_answer("plain text answer", HITS)[2]
@@ -110,6 +110,83 @@ function appendChat(role, text){
   $("chatWindow").appendChild(div);
 
   $("chatWindow").scrollTop = $("chatWindow").scrollHeight;
+
+  return div;
+}
+
+
+function chatCitationsHTML(citations){
+
+  if(!citations || citations.length === 0) return "";
+
+  let html = "<br/><br/><b>Citations:</b><ul>";
+
+  citations.forEach(c => {
+    html += `
+      <li>
+        [${c.chunk_id} | p.${c.page}]
+      </li>
+    `;
+  });
+
+  return html + "</ul>";
+}
+
+
+/* ---------- SSE over fetch (EventSource cannot POST) ---------- */
+
+async function streamChat(body, onToken){
+
+  const res = await fetch("/chat/stream", {
+    method:"POST",
+    headers:{ "Content-Type":"application/json" },
+    body: JSON.stringify(body)
+  });
+
+  if(!res.ok || !res.body) throw new Error(`stream failed: ${res.status}`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+
+  let buffer = "";
+  let final = null;
+
+  while(true){
+
+    const { value, done } = await reader.read();
+
+    if(done) break;
+
+    buffer += decoder.decode(value, { stream:true });
+
+    let sep;
+
+    while((sep = buffer.indexOf("\n\n")) !== -1){
+
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+
+      frame.split("\n").forEach(line => {
+        if(line.startsWith("event:")) event = line.slice(6).trim();
+        else if(line.startsWith("data:")) data += line.slice(5).trim();
+      });
+
+      if(!data) continue;
+
+      const payload = JSON.parse(data);
+
+      if(event === "token") onToken(payload.text);
+      else if(event === "citations") final = payload;
+      else if(event === "error") throw new Error(payload.detail);
+    }
+  }
+
+  if(!final) throw new Error("stream ended without a final event");
+
+  return final;
 }
 
 
@@ -124,43 +201,32 @@ $("sendChat").onclick = async () => {
 
   $("chatMsg").value = "";
 
-  try {
-
-    const res = await fetch("/chat", {
-      method:"POST",
-      headers:{ "Content-Type":"application/json" },
-      body: JSON.stringify({
-        session_id: sessionId,
-        message: message
-      })
-    });
-
-    const data = await res.json();
+  const bubble = appendChat("Bot", `<span class="loading">...</span>`);
 
-    let answer = data.answer;
+  let partial = "";
 
-    /* ---------- CHAT CITATIONS ---------- */
+  try {
 
-    if(data.citations && data.citations.length > 0){
+    /* ---------- PARTIAL TOKENS ---------- */
 
-      answer += "<br/><br/><b>Citations:</b><ul>";
+    const data = await streamChat(
+      { session_id: sessionId, message: message },
+      text => {
+        partial += text;
+        bubble.textContent = partial;
+        $("chatWindow").scrollTop = $("chatWindow").scrollHeight;
+      }
+    );
 
-      data.citations.forEach(c => {
-        answer += `
-          <li>
-            [${c.chunk_id} | p.${c.page}]
-          </li>
-        `;
-      });
-
-      answer += "</ul>";
-    }
+    /* ---------- FINAL ANSWER + CHAT CITATIONS ---------- */
 
-    appendChat("Bot", answer);
+    bubble.innerHTML = data.answer + chatCitationsHTML(data.citations);
 
   } catch(err){
 
-    appendChat("Bot", "Error contacting backend");
+    bubble.innerHTML = partial
+      ? partial + "<br/><i>(response interrupted)</i>"
+      : "Error contacting backend";
 
     console.error(err);
   }